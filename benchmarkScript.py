@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+"""
+The benchmark script for the ROSA and Zyla calibration stages, run on
+synthetic data.
+
+-------------------------------------------------------------------------
+
+Usage
+-----
+
+	benchmarkScript.py [--size=<rows>x<cols>] [--frames=<n>] [--output=<file>] <instrument name> <benchmark directory> [<key>=<value> ...]
+
+	benchmarkScript.py --kisip=<n>[,<n>...] [--size=<rows>x<cols>] [--batches=<n>] [--bursts=<n>] [--nproc=<n>] [--frame-seconds=<s>] [--rank-seconds=<s>] [--busy] [--output=<file>] <instrument name> <benchmark directory>
+
+	instrument name : any of the following: ROSA_3500, ROSA_4170,
+		ROSA_CAK, ROSA_GBAND, ZYLA.
+
+	benchmark directory : directory for the synthetic data and
+		work files. The synthetic data are kept and reused by
+		later runs with the same size and number of frames.
+
+	<key>=<value> : optional. Configuration values for the
+		instrument section, e.g. burstWorkers=4.
+
+	--size : optional. Image size in pixels. Default 1024x1024.
+
+	--frames : optional. Number of data frames. Default 4096.
+
+	--output : optional. JSON lines file to append the results to.
+
+	--kisip : benchmark KISIP batch scheduling instead, with the
+		KISIP stand-in, for each of the given numbers of
+		concurrent batches.
+
+	--batches, --bursts : optional. Number of batches, and bursts
+		per batch, for --kisip. Default 4 and 8.
+
+	--nproc : optional. MPI ranks shared by concurrent batches,
+		for --kisip. Default 4.
+
+	--frame-seconds, --rank-seconds : optional. Simulated KISIP
+		time per frame and start-up time per rank, for --kisip.
+		Default 0.
+
+	--busy : optional. Simulated KISIP ranks keep a CPU busy
+		rather than sleep, for --kisip.
+
+-------------------------------------------------------------------------
+
+This script generates synthetic dark, flat, and data files, runs each
+calibration stage on them, and prints the wall time, CPU time,
+throughput, and peak memory of each stage. With --kisip, it instead
+times despeckling of synthetic bursts by kisipWrapper with the KISIP
+stand-in, ssosoft.kisipStandIn, and prints the time each number of
+concurrent batches takes next to the time the stand-in's runtime model
+gives. See ssosoft.rosaZylaBenchmark.
+
+-------------------------------------------------------------------------
+
+Website
+-------
+
+	https://github.com/SSOCsoft/SSOsoft
+
+-------------------------------------------------------------------------
+"""
+
+import ssosoft
+import sys
+
+options={'--size' : '1024x1024', '--frames' : '4096', '--output' : '',
+		'--kisip' : '', '--batches' : '4', '--bursts' : '8', '--nproc' : '4',
+		'--frame-seconds' : '0', '--rank-seconds' : '0', '--busy' : ''
+		}
+args=[]
+overrides={}
+for arg in sys.argv[1:]:
+	if arg == '--busy':
+		options['--busy']='1'
+	elif arg.split('=')[0] in options:
+		options[arg.split('=')[0]]=arg.split('=', 1)[1]
+	elif '=' in arg:
+		overrides[arg.split('=')[0]]=arg.split('=', 1)[1]
+	else:
+		args.append(arg)
+assert len(args)==2, ("Usage: {0} [--kisip=<n>[,<n>...]] [--size=<rows>x<cols>] "
+		"[--frames=<n>] [--output=<file>] <instrument> <benchmark directory> "
+		"[<key>=<value> ...]".format(sys.argv[0])
+		)
+
+b=ssosoft.rosaZylaBenchmark(args[1], args[0],
+		imageShape=[int(n) for n in options['--size'].split('x')],
+		dataFrames=int(options['--frames']),
+		configOverrides=overrides
+		)
+if options['--kisip']:
+	print("{0:>10s} {1:>6s} {2:>9s} {3:>9s} {4:>9s} {5:>10s}".format(
+		'concurrent', 'ranks', 'seconds', 'model', 'cpu', 'frames/s'
+		))
+	for record in b.bench_kisip(nBatches=int(options['--batches']),
+			burstsPerBatch=int(options['--bursts']),
+			concurrentBatches=[int(n) for n in options['--kisip'].split(',')],
+			mpiNproc=int(options['--nproc']),
+			secondsPerFrame=float(options['--frame-seconds']),
+			secondsPerRank=float(options['--rank-seconds']),
+			busy=bool(options['--busy'])
+			):
+		print("{0:>10d} {1:>6d} {2:>9.3f} {3:>9.3f} {4:>9.3f} {5:>10.1f}{6}".format(
+			record['concurrentBatches'], record['mpiNproc'], record['seconds'],
+			record['modelSeconds'], record['cpuSeconds'],
+			record['framesPerSecond'] or 0,
+			"  failed batches: {0}".format(record['failedBatches'])
+			if record['failedBatches'] else ''
+			))
+	if options['--output']:
+		b.bench_save_results(options['--output'])
+	sys.exit(0)
+print("{0:<24s} {1:>9s} {2:>9s} {3:>10s} {4:>9s} {5:>9s} {6:>10s} {7:>9s}".format(
+	'stage', 'seconds', 'cpu', 'frames/s', 'readMB/s', 'writeMB/s',
+	'tracedMB', 'rssMB'
+	))
+for record in b.bench_run():
+	print("{0:<24s} {1:>9.3f} {2:>9.3f} {3:>10.1f} {4:>9.1f} {5:>9.1f} {6:>10.1f} {7:>9.1f}".format(
+		record['stage'], record['seconds'], record['cpuSeconds'],
+		record['framesPerSecond'] or 0, record['readMBPerSecond'] or 0,
+		record['writeMBPerSecond'] or 0, record['peakTracedMB'] or 0,
+		record['peakRssMB']
+		))
+if options['--output']:
+	b.bench_save_results(options['--output'])
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+"""
+The run script for calibrating several SSOC ROSA and Zyla channels
+from one configuration file at the same time.
+
+-------------------------------------------------------------------------
+
+Usage
+-----
+
+	multiCalScript.py [--pipeline] [--follow] [--cpu=<n>] [--io=<n>]
+		[--kisip=<n>] <configuration file> <instrument name> [...]
+
+	configuration file : path to an instrument configuration file.
+		Consult the ssosoft documents for more information about
+		this file.
+
+	instrument name : one or more of the following: ROSA_3500,
+		ROSA_4170, ROSA_CAK, ROSA_GBAND, ZYLA.
+
+	--pipeline, --follow : optional. As for standardCalScript.py,
+		for every channel.
+
+	--cpu, --io, --kisip : optional. Number of worker process
+		tasks, file reads, and KISIP batches that may run at once
+		across all channels. Default the cpuWorkers, ioWorkers,
+		and kisipBatches values of the MULTI_CAL section of the
+		configuration file.
+
+-------------------------------------------------------------------------
+
+Each channel is calibrated in its own process, exactly as by
+standardCalScript.py, and writes its own log file named
+'<obsTime>_<instrument name>.log' in its workBase. The channels share
+a bounded number of workers, handed out evenly between the channels
+that have work, so that small channels fill the gaps left by the
+serial phases of large ones. See rosaZylaMultiCal. The script exits
+with code 1 if any channel failed.
+
+-------------------------------------------------------------------------
+
+Website
+-------
+
+	https://github.com/SSOCsoft/SSOsoft
+
+-------------------------------------------------------------------------
+"""
+
+import ssosoft
+import sys
+
+options={'--cpu' : None, '--io' : None, '--kisip' : None}
+args=[]
+for arg in sys.argv[1:]:
+	if arg.split('=')[0] in options:
+		options[arg.split('=')[0]]=int(arg.split('=', 1)[1])
+	elif arg not in ['--pipeline', '--follow']:
+		args.append(arg)
+assert len(args) >= 2, ("Usage: {0} [--pipeline] [--follow] [--cpu=<n>] [--io=<n>] "
+		"[--kisip=<n>] <config file> <instrument> [...]".format(sys.argv[0])
+		)
+
+m=ssosoft.rosaZylaMultiCal(args[1:], args[0],
+		cpuWorkers=options['--cpu'],
+		ioWorkers=options['--io'],
+		kisipBatches=options['--kisip'],
+		pipeline='--pipeline' in sys.argv[1:],
+		follow='--follow' in sys.argv[1:]
+		)
+exitCodes=m.multi_cal_run()
+sys.exit(1 if any(exitCodes.values()) else 0)
@@ -11,18 +11,70 @@ provided for.
 Classes
 -------
 
+burstQueue :
+	A work queue kept in files on a shared filesystem, for building
+	bursts on several processes and nodes.
+burstWriter :
+	A background writer for burst cubes, overlapping disk writes
+	with the assembly of the next burst.
+calStore :
+	A store of master calibration images keyed on their inputs,
+	shared by runs across work directories and days.
+dirIndex :
+	A persistent, incrementally updated index of the files in a
+	directory matching a pattern, in order.
+fitsIndex :
+	An index of the extensions of a multi-extension FITS file,
+	giving random access to single frames.
+framePrefetcher :
+	Reads upcoming image files on a pool of I/O threads, so that
+	file access latency overlaps with processing.
+kisipStandIn :
+	A stand-in for the KISIP executable and its MPI runner, for
+	running and tuning kisipWrapper without KISIP or MPI.
 kisipWrapper :
 	A wrapper class used for configuring and running the
 	Kiepenheuer-Institut Speckle Interfrerometry Package (KISIP).
+rosaZylaBenchmark :
+	Benchmarks of the ROSA and Zyla calibration stages on synthetic
+	data, with per-stage timing, throughput, and peak memory.
 rosaZylaCal :
 	A class containing all methods and attributes necessary for
 	flat-fielding and formatting of images for speckle analysis
 	by KISIP.
+rosaZylaMultiCal :
+	Calibrates several ROSA and Zyla channels at the same time,
+	sharing a bounded number of workers between them.
+runManifest :
+	A persistent record of completed work, used to resume an
+	interrupted calibration run.
+runMetadata :
+	A per-run SQLite store of burst headers, timestamps and cube
+	paths, indexed by batch and index.
 ssosoftConfig :
 	Metadata showing basic information about this release of SSOsoft,
 	including authorship, version, etc.
+stageMetrics :
+	Structured per-stage performance records, written as JSON lines
+	and as a Prometheus textfile.
+workerSlots :
+	A bounded number of worker slots shared fairly between the
+	channels of a multi-channel run.
 """
 
+from ssosoft.burstQueue import *
+from ssosoft.burstWriter import *
+from ssosoft.calStore import *
+from ssosoft.dirIndex import *
+from ssosoft.fitsIndex import *
+from ssosoft.framePrefetcher import *
+from ssosoft.kisipStandIn import *
 from ssosoft.kisipWrapper import *
+from ssosoft.rosaZylaBenchmark import *
 from ssosoft.rosaZylaCal import *
+from ssosoft.rosaZylaMultiCal import *
+from ssosoft.runManifest import *
+from ssosoft.runMetadata import *
+from ssosoft.stageMetrics import *
+from ssosoft.workerSlots import *
 
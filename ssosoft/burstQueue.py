@@ -0,0 +1,427 @@
+import json
+import os
+import shutil
+import socket
+import time
+from .runManifest import manifest_fingerprint
+
+class burstQueue:
+	"""
+	A work queue kept in files on a shared filesystem, through which
+	any number of processes, on one or more nodes, share the tasks of
+	a run, with no service other than the filesystem.
+
+	-----------------------------------------------------------------
+
+	queue_publish writes the plan, a list of tasks and the setup the
+	workers need, to plan.json in queueDir, and one empty file per
+	task to a todo directory of the run. A process claims a task by
+	renaming its file into the claimed directory, under a name
+	giving the claimant's host and process ID. Renaming is atomic,
+	so one claimant alone succeeds. The claimant touches its claim
+	as it works, and when done writes the task's result to the done
+	directory and removes the claim.
+
+	A claim not touched for claimTimeout seconds, or held by a
+	process that no longer exists on this host, is taken to belong
+	to a dead process, and queue_recover renames it back to todo for
+	another process to claim. A slow process taken for dead may
+	still finish its task, so a task may be done twice; its result
+	must not depend on which process did it. claimTimeout should
+	well exceed both the time between touches and any clock skew
+	between nodes.
+
+	The plan and the results are written under temporary names and
+	renamed, so a partial file is never read. Publishing the same
+	plan again, e.g. when a coordinator is restarted, keeps the
+	tasks already done.
+
+	Once every result has been collected, queue_close marks the run
+	finished. The plan and the results are kept, so that a process
+	joining after the run, or between runs, finds a finished queue
+	and stops rather than waiting for a plan to be published. A
+	coordinator starting the next run calls queue_prepare first,
+	which removes a finished run, so that processes joining while
+	it prepares the plan wait for it.
+
+	-----------------------------------------------------------------
+
+	Parameters
+	----------
+	queueDir : str
+		Directory of the queue, on a filesystem shared by all
+		processes, at the same path on every node.
+	claimTimeout : float
+		Seconds after which an untouched claim is recovered.
+		Default 600.
+	logger : logging.Logger
+		Logger for informative messages.
+
+	-----------------------------------------------------------------
+
+	Example
+	-------
+
+	In the coordinator,
+
+		queue=burstQueue(queueDir)
+		queue.queue_prepare()
+		queue.queue_publish(tasks, setup)
+		## ... collect the results with queue_result ...
+		queue.queue_close()
+
+	and in each worker,
+
+		queue=burstQueue(queueDir)
+		queue.queue_wait(3600, 5)
+		while not queue.queue_finished():
+			claim=queue.queue_claim()
+			if claim is None:
+				queue.queue_recover()
+				time.sleep(5)
+				continue
+			taskId, task=claim
+			queue.queue_complete(taskId, doTask(task))
+	"""
+
+	def __init__(self, queueDir, claimTimeout=600, logger=None):
+		"""
+		Parameters
+		----------
+		queueDir : str
+			Directory of the queue, on a shared filesystem.
+		claimTimeout : float
+			Seconds after which an untouched claim is
+			recovered. Default 600.
+		logger : logging.Logger
+			Logger for informative messages.
+		"""
+		self.claimTimeout=claimTimeout
+		self.host=socket.gethostname()
+		self.logger=logger
+		self.owner='{0}.{1}'.format(self.host, os.getpid())
+		self.plan=None
+		self.queueDir=queueDir
+		self.runDir=None
+
+	def queue_claim(self):
+		"""
+		Claims the first task not yet claimed or done.
+
+		Returns
+		-------
+		tuple
+			(task ID, task), or None if no task is free.
+		"""
+		try:
+			names=sorted(os.listdir(os.path.join(self.runDir, 'todo')))
+		except (OSError, TypeError):
+			return None
+		for name in names:
+			todoFile=os.path.join(self.runDir, 'todo', name)
+			if os.path.exists(self.queue_path('done', name+'.json')):
+				## Recovered from a process that finished after all.
+				try:
+					os.remove(todoFile)
+				except FileNotFoundError:
+					pass
+				continue
+			try:
+				## Touch first: renaming keeps the time the task
+				## was published, and the claim would look stale.
+				os.utime(todoFile)
+				os.rename(todoFile, self.queue_path('claimed',
+					'{0}.{1}'.format(name, self.owner)
+					))
+			except FileNotFoundError:
+				continue
+			return int(name), self.plan['tasks'][int(name)]
+		return None
+
+	def queue_close(self):
+		"""
+		Marks the run finished, once its results are no longer
+		needed. The plan and the results are kept for processes
+		still polling the queue.
+		"""
+		open(os.path.join(self.runDir, 'finished'), mode='w').close()
+		if self.logger is not None:
+			self.logger.info("Burst queue: finished: {0}".format(self.runDir))
+
+	def queue_closed(self):
+		"""
+		Returns whether the run has been marked finished by
+		queue_close.
+
+		Returns
+		-------
+		bool
+		"""
+		try:
+			return os.path.exists(os.path.join(self.runDir, 'finished'))
+		except TypeError:
+			return False
+
+	def queue_complete(self, taskId, result):
+		"""
+		Records the result of a claimed task and gives up the
+		claim.
+
+		Parameters
+		----------
+		taskId : int
+			Task ID returned by queue_claim.
+		result : JSON-serializable object
+			Result of the task.
+		"""
+		doneFile=self.queue_path('done', '{0:06d}.json'.format(taskId))
+		tmpFile='{0}.{1}.tmp'.format(doneFile, self.owner)
+		with open(tmpFile, mode='w') as f:
+			json.dump({'owner' : self.owner, 'result' : result}, f)
+		os.replace(tmpFile, doneFile)
+		try:
+			os.remove(self.queue_path('claimed', '{0:06d}.{1}'.format(taskId, self.owner)))
+		except FileNotFoundError:
+			if self.logger is not None:
+				self.logger.warning("Burst queue: task {0} was recovered from this "
+						"process before it finished.".format(taskId)
+						)
+
+	def queue_finished(self):
+		"""
+		Returns whether every task is done. A queue that has been
+		closed, removed, or replaced by a different plan, counts
+		as finished.
+
+		Returns
+		-------
+		bool
+		"""
+		if self.queue_closed():
+			return True
+		try:
+			done=[name for name in os.listdir(os.path.join(self.runDir, 'done'))
+					if name.endswith('.json')
+					]
+		except (OSError, TypeError):
+			return True
+		return len(done) >= len(self.plan['tasks'])
+
+	def queue_heartbeat(self, taskId):
+		"""
+		Touches a claim, to show that its process is alive.
+
+		Parameters
+		----------
+		taskId : int
+			Task ID returned by queue_claim.
+
+		Returns
+		-------
+		bool
+			False if the claim has been recovered by another
+			process.
+		"""
+		try:
+			os.utime(self.queue_path('claimed', '{0:06d}.{1}'.format(taskId, self.owner)))
+		except FileNotFoundError:
+			return False
+		return True
+
+	def queue_load(self):
+		"""
+		Loads the published plan.
+
+		Returns
+		-------
+		bool
+			True if a plan was found.
+		"""
+		try:
+			with open(os.path.join(self.queueDir, 'plan.json'), mode='r') as f:
+				self.plan=json.load(f)
+		except (OSError, ValueError):
+			return False
+		self.runDir=os.path.join(self.queueDir, self.plan['runId'])
+		return True
+
+	def queue_path(self, state, name):
+		"""
+		Returns the path of a task file of the run.
+
+		Parameters
+		----------
+		state : str
+			'todo', 'claimed', or 'done'.
+		name : str
+			File name.
+
+		Returns
+		-------
+		str
+		"""
+		return os.path.join(self.runDir, state, name)
+
+	def queue_prepare(self):
+		"""
+		Removes the plan and results of a finished run, so that
+		processes joining before the next plan is published wait
+		for it. A run not yet finished is left to be resumed.
+		"""
+		if not self.queue_load() or not self.queue_closed():
+			return
+		try:
+			os.remove(os.path.join(self.queueDir, 'plan.json'))
+		except FileNotFoundError:
+			pass
+		shutil.rmtree(self.runDir, ignore_errors=True)
+		self.plan=None
+		self.runDir=None
+
+	def queue_publish(self, tasks, setup=None):
+		"""
+		Publishes a plan. Tasks done under an identical plan
+		published before are kept, unless that run was closed;
+		any other plan is replaced.
+
+		Parameters
+		----------
+		tasks : list
+			JSON-serializable tasks.
+		setup : dict
+			JSON-serializable values workers need for every
+			task.
+		"""
+		runId=manifest_fingerprint(tasks, setup)
+		if self.queue_load():
+			if (self.plan['runId'] == runId and os.path.isdir(self.runDir)
+					and not self.queue_closed()):
+				if self.logger is not None:
+					self.logger.info("Burst queue: resuming {0}: {1} of {2} tasks "
+							"done.".format(self.runDir, self.queue_status()['done'],
+								len(tasks)
+								)
+							)
+				return
+			shutil.rmtree(self.runDir, ignore_errors=True)
+		self.runDir=os.path.join(self.queueDir, runId)
+		for state in ['todo', 'claimed', 'done']:
+			os.makedirs(os.path.join(self.runDir, state), exist_ok=True)
+		for taskId in range(len(tasks)):
+			open(self.queue_path('todo', '{0:06d}'.format(taskId)), mode='w').close()
+		self.plan={'runId' : runId, 'setup' : setup, 'tasks' : tasks}
+		planFile=os.path.join(self.queueDir, 'plan.json')
+		tmpFile='{0}.{1}.tmp'.format(planFile, self.owner)
+		with open(tmpFile, mode='w') as f:
+			json.dump(self.plan, f)
+		os.replace(tmpFile, planFile)
+		if self.logger is not None:
+			self.logger.info("Burst queue: published {0} tasks in: "
+					"{1}".format(len(tasks), self.runDir)
+					)
+
+	def queue_recover(self):
+		"""
+		Returns the tasks of dead processes to the queue.
+
+		Returns
+		-------
+		int
+			Number of tasks recovered.
+		"""
+		try:
+			names=os.listdir(os.path.join(self.runDir, 'claimed'))
+		except (OSError, TypeError):
+			return 0
+		recovered=0
+		for name in names:
+			taskName, owner=name.split('.', 1)
+			if owner == self.owner:
+				continue
+			host, pid=owner.rsplit('.', 1)
+			claimFile=self.queue_path('claimed', name)
+			try:
+				dead=time.time()-os.stat(claimFile).st_mtime > self.claimTimeout
+			except FileNotFoundError:
+				continue
+			if not dead and host == self.host:
+				try:
+					os.kill(int(pid), 0)
+				except ProcessLookupError:
+					dead=True
+				except (PermissionError, ValueError):
+					pass
+			if not dead:
+				continue
+			try:
+				os.rename(claimFile, self.queue_path('todo', taskName))
+			except FileNotFoundError:
+				continue
+			recovered+=1
+			if self.logger is not None:
+				self.logger.warning("Burst queue: recovered task {0} from dead "
+						"process: {1}".format(taskName, owner)
+						)
+		return recovered
+
+	def queue_result(self, taskId):
+		"""
+		Returns the result of a task.
+
+		Parameters
+		----------
+		taskId : int
+			Task ID, its index in the plan's tasks.
+
+		Returns
+		-------
+		object
+			The result, or None if the task is not done.
+		"""
+		try:
+			with open(self.queue_path('done', '{0:06d}.json'.format(taskId)), mode='r') as f:
+				return json.load(f)['result']
+		except FileNotFoundError:
+			return None
+
+	def queue_status(self):
+		"""
+		Counts the tasks in each state.
+
+		Returns
+		-------
+		dict
+			Number of 'todo', 'claimed', and 'done' tasks.
+		"""
+		status={}
+		for state in ['todo', 'claimed', 'done']:
+			try:
+				status[state]=len([name for name in os.listdir(os.path.join(self.runDir, state))
+						if not name.endswith('.tmp')
+						])
+			except (OSError, TypeError):
+				status[state]=0
+		return status
+
+	def queue_wait(self, timeout, pollInterval):
+		"""
+		Waits for a plan to be published.
+
+		Parameters
+		----------
+		timeout : float
+			Seconds to wait.
+		pollInterval : float
+			Seconds between looks.
+
+		Returns
+		-------
+		bool
+			True if a plan was found.
+		"""
+		end=time.time()+timeout
+		while not self.queue_load():
+			if time.time() > end:
+				return False
+			time.sleep(pollInterval)
+		return True
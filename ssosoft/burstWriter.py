@@ -0,0 +1,147 @@
+import collections
+import numpy as np
+import queue
+import threading
+
+class burstWriter:
+	"""
+	A background writer for burst cubes, so that the next burst can
+	be assembled while the previous one is written to disk.
+
+	-----------------------------------------------------------------
+
+	The writer owns a fixed set of burst buffers. The caller takes a
+	free buffer with writer_get_buffer, fills it, and hands it back
+	with writer_submit together with the cube file name. A writer
+	thread saves the cubes in submission order and then returns
+	each buffer to the free set. With two buffers, assembling
+	burst N+1 overlaps with writing burst N. Memory use is bounded by
+	the number of buffers.
+
+	Files whose writes have finished are reported, in submission
+	order, by writer_completed. A write error is raised to the
+	caller by the next call to writer_get_buffer, writer_submit,
+	writer_completed, or writer_close.
+
+	-----------------------------------------------------------------
+
+	Parameters
+	----------
+	bufferShape : tuple
+		Shape of each burst buffer, (burstNumber,)+imageShape.
+	nBuffers : int
+		Number of burst buffers. Default 2.
+	logger : logging.Logger
+		Logger for error messages.
+	"""
+
+	def __init__(self, bufferShape, nBuffers=2, logger=None):
+		"""
+		Parameters
+		----------
+		bufferShape : tuple
+			Shape of each burst buffer, (burstNumber,)+imageShape.
+		nBuffers : int
+			Number of burst buffers. Default 2.
+		logger : logging.Logger
+			Logger for error messages.
+		"""
+		self.completed=collections.deque()
+		self.error=None
+		self.freeBuffers=queue.Queue()
+		self.logger=logger
+		self.writeQueue=queue.Queue()
+
+		for i in range(max(1, nBuffers)):
+			self.freeBuffers.put(np.empty(bufferShape, dtype=np.float32))
+		self.thread=threading.Thread(target=self.writer_run, daemon=True)
+		self.thread.start()
+
+	def writer_check(self):
+		"""
+		Raises the first error met by the writer thread, if any.
+		"""
+		if self.error is not None:
+			raise self.error
+
+	def writer_close(self):
+		"""
+		Waits for all submitted writes to finish and stops the
+		writer thread.
+		"""
+		self.writeQueue.put(None)
+		self.thread.join()
+		self.writer_check()
+
+	def writer_completed(self):
+		"""
+		Returns the cube files written since the last call.
+
+		Returns
+		-------
+		list
+			Paths to the written cube files, in submission order.
+		"""
+		self.writer_check()
+		files=[]
+		while self.completed:
+			files.append(self.completed.popleft())
+		return files
+
+	def writer_get_buffer(self):
+		"""
+		Returns a free burst buffer, waiting for a write to finish
+		if none is free.
+
+		Returns
+		-------
+		numpy.ndarray
+			np.float32 array of shape bufferShape. Its contents
+			are undefined.
+		"""
+		while True:
+			self.writer_check()
+			try:
+				data=self.freeBuffers.get(timeout=1)
+			except queue.Empty:
+				continue
+			## A buffer is also freed after a failed write.
+			self.writer_check()
+			return data
+
+	def writer_run(self):
+		"""
+		Writer thread main loop.
+		"""
+		while True:
+			item=self.writeQueue.get()
+			if item is None:
+				return
+			data, file=item
+			if self.error is None:
+				try:
+					with open(file, mode='wb') as f:
+						data.tofile(f)
+				except Exception as err:
+					if self.logger is not None:
+						self.logger.critical("Could not save binary file: "
+								"{0}".format(err)
+								)
+					self.error=err
+				else:
+					self.completed.append(file)
+			self.freeBuffers.put(data)
+
+	def writer_submit(self, data, file):
+		"""
+		Queues a filled burst buffer for writing.
+
+		Parameters
+		----------
+		data : numpy.ndarray
+			A buffer obtained from writer_get_buffer.
+		file : str
+			Path to save the burst cube to.
+		"""
+		self.writer_check()
+		self.writeQueue.put((data, file))
@@ -0,0 +1,173 @@
+import astropy.io.fits as fits
+import numpy as np
+import os
+import shutil
+
+class calStore:
+	"""
+	A store of master calibration images (average dark, average
+	flat, gain, noise cube) shared by all runs of an instrument.
+
+	-----------------------------------------------------------------
+
+	Images are stored as FITS files under
+	<storeBase>/<instrument>/<product>.<key>.fits, where key is a
+	fingerprint of everything the image was computed from: the
+	instrument, image shape, exposure time, and the names, sizes and
+	modification times of the source files. Any run, in any workBase
+	and on any day, that would compute the same image finds it in the
+	store instead of averaging the source frames again. A change to
+	any source file gives a different key, so a stale image is never
+	returned. The key is also written to the CALKEY header keyword.
+
+	-----------------------------------------------------------------
+
+	Parameters
+	----------
+	storeBase : str
+		Top-level directory of the store.
+	instrument : str
+		Instrument name, used as a subdirectory of storeBase.
+	logger : logging.Logger
+		Logger for informative messages.
+	"""
+
+	def __init__(self, storeBase, instrument, logger):
+		"""
+		Parameters
+		----------
+		storeBase : str
+			Top-level directory of the store.
+		instrument : str
+			Instrument name, used as a subdirectory of storeBase.
+		logger : logging.Logger
+			Logger for informative messages.
+		"""
+		self.instrument=instrument.upper()
+		self.logger=logger
+		self.storeBase=storeBase
+		self.storeDir=os.path.join(self.storeBase, self.instrument)
+
+		os.makedirs(self.storeDir, exist_ok=True)
+
+	def cal_store_file(self, product, key):
+		"""
+		Returns the path of a stored calibration image.
+
+		Parameters
+		----------
+		product : str
+			Calibration product, e.g. 'dark'.
+		key : str
+			Fingerprint of the image's inputs.
+
+		Returns
+		-------
+		str
+		"""
+		return os.path.join(self.storeDir, '{0}.{1}.fits'.format(product, key))
+
+	def cal_store_get(self, product, key):
+		"""
+		Looks up a calibration image in the store.
+
+		Parameters
+		----------
+		product : str
+			Calibration product, e.g. 'dark'.
+		key : str
+			Fingerprint of the image's inputs.
+
+		Returns
+		-------
+		numpy.ndarray or None
+			The stored image, or None if not in the store.
+		"""
+		file=self.cal_store_file(product, key)
+		if not os.path.exists(file):
+			return None
+		self.logger.info("Calibration store: found {0}: {1}".format(product, file))
+		with fits.open(file) as hdu:
+			return np.array(hdu[0].data)
+
+	def cal_store_get_file(self, product, key):
+		"""
+		Looks up a calibration file in the store, without reading
+		it, e.g. for a cube too large to hold in memory.
+
+		Parameters
+		----------
+		product : str
+			Calibration product, e.g. 'noise'.
+		key : str
+			Fingerprint of the image's inputs.
+
+		Returns
+		-------
+		str or None
+			Path to the stored FITS file, or None if not in the
+			store.
+		"""
+		file=self.cal_store_file(product, key)
+		if not os.path.exists(file):
+			return None
+		self.logger.info("Calibration store: found {0}: {1}".format(product, file))
+		return file
+
+	def cal_store_put(self, product, key, image):
+		"""
+		Adds a calibration image to the store. The file is written
+		under a temporary name and renamed, so concurrent runs
+		never read a partial file.
+
+		Parameters
+		----------
+		product : str
+			Calibration product, e.g. 'dark'.
+		key : str
+			Fingerprint of the image's inputs.
+		image : numpy.ndarray
+			The calibration image.
+		"""
+		file=self.cal_store_file(product, key)
+		tmpFile='{0}.{1}.tmp'.format(file, os.getpid())
+		hdu=fits.PrimaryHDU(image)
+		hdu.header['CALKEY']=key
+		hdu.header['CALPROD']=product
+		hdu.header['INSTRUME']=self.instrument
+		try:
+			hdu.writeto(tmpFile, overwrite=True)
+			os.replace(tmpFile, file)
+		except Exception as err:
+			self.logger.warning("Calibration store: could not save {0}: "
+					"{1}".format(file, err)
+					)
+		else:
+			self.logger.info("Calibration store: saved {0}: {1}".format(product, file))
+
+	def cal_store_put_file(self, product, key, file):
+		"""
+		Adds a calibration FITS file to the store by copying it.
+		The copy is written under a temporary name and renamed,
+		so concurrent runs never read a partial file.
+
+		Parameters
+		----------
+		product : str
+			Calibration product, e.g. 'noise'.
+		key : str
+			Fingerprint of the image's inputs.
+		file : str
+			Path to the FITS file, with CALKEY set to key.
+		"""
+		storeFile=self.cal_store_file(product, key)
+		tmpFile='{0}.{1}.tmp'.format(storeFile, os.getpid())
+		try:
+			shutil.copyfile(file, tmpFile)
+			os.replace(tmpFile, storeFile)
+		except Exception as err:
+			self.logger.warning("Calibration store: could not save {0}: "
+					"{1}".format(storeFile, err)
+					)
+		else:
+			self.logger.info("Calibration store: saved {0}: {1}".format(product, storeFile))
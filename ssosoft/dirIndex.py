@@ -0,0 +1,247 @@
+import fnmatch
+import json
+import os
+import time
+
+class dirIndex:
+	"""
+	An index of the files in a directory that match a pattern, in
+	order, with the size and modification time of each, kept up to
+	date without listing the directory again when it is unchanged.
+
+	-----------------------------------------------------------------
+
+	The directory is listed with a single os.scandir pass. For each
+	matching file the index records its size, modification time and
+	an order key computed by orderKey from the file name, so names
+	are parsed once, when a file is first seen. The index is saved
+	as JSON to indexFile. On update, the directory is listed again
+	only if its modification time has changed since the last
+	listing; then only files not already in the index are examined,
+	and files that have gone are dropped. Files are assumed not to
+	change once they appear; use index_restat to refresh their
+	sizes and modification times.
+
+	Files whose order key is None sort after all others, by name.
+
+	-----------------------------------------------------------------
+
+	Parameters
+	----------
+	directory : str
+		Directory to index.
+	pattern : str
+		fnmatch pattern the file names must match. Default '*'.
+	orderKey : callable
+		Function of a file name returning a JSON-serializable
+		order key, or None if the name cannot be ordered. Default
+		None orders by name.
+	indexFile : str
+		Path to save the index to. Default None keeps the index
+		in memory only.
+	logger : logging.Logger
+		Logger for informative messages.
+
+	-----------------------------------------------------------------
+
+	Example
+	-------
+
+		index=dirIndex(dataBase, '*spool.dat', orderKey=zylaOrder)
+		dataList=index.index_files()
+	"""
+
+	def __init__(self, directory, pattern='*', orderKey=None, indexFile=None, logger=None):
+		"""
+		Parameters
+		----------
+		directory : str
+			Directory to index.
+		pattern : str
+			fnmatch pattern the file names must match.
+			Default '*'.
+		orderKey : callable
+			Function of a file name returning a
+			JSON-serializable order key, or None if the name
+			cannot be ordered. Default None orders by name.
+		indexFile : str
+			Path to save the index to. Default None keeps the
+			index in memory only.
+		logger : logging.Logger
+			Logger for informative messages.
+		"""
+		self.dirMtime=None
+		self.directory=directory
+		self.entries={}
+		self.indexFile=indexFile
+		self.logger=logger
+		self.order=None
+		self.orderKey=orderKey
+		self.pattern=pattern
+		self.scanTime=None
+
+		self.index_load()
+		self.index_update()
+
+	def index_entries(self):
+		"""
+		Returns the indexed files with their statistics, in order.
+
+		Returns
+		-------
+		list
+			(path, size, mtime in ns, order key) for each file.
+		"""
+		return [(os.path.join(self.directory, name),)+tuple(self.entries[name])
+				for name in self.index_names()
+				]
+
+	def index_files(self, pattern=None):
+		"""
+		Returns the paths of the indexed files, in order.
+
+		Parameters
+		----------
+		pattern : str
+			Optional fnmatch pattern selecting a subset of the
+			indexed files by name.
+
+		Returns
+		-------
+		list
+		"""
+		names=self.index_names()
+		if pattern is not None:
+			names=[name for name in names if fnmatch.fnmatchcase(name, pattern)]
+		return [os.path.join(self.directory, name) for name in names]
+
+	def index_load(self):
+		"""
+		Loads the saved index, if there is one for this directory
+		and pattern.
+		"""
+		if self.indexFile is None or not os.path.exists(self.indexFile):
+			return
+		try:
+			with open(self.indexFile, mode='r') as f:
+				index=json.load(f)
+		except ValueError:
+			return
+		if (index.get('directory') != os.path.abspath(self.directory)
+				or index.get('pattern') != self.pattern):
+			return
+		self.dirMtime=index['dirMtime']
+		self.entries=index['entries']
+		self.scanTime=index['scanTime']
+
+	def index_names(self):
+		"""
+		Returns the names of the indexed files, in order.
+
+		Returns
+		-------
+		list
+		"""
+		if self.order is None:
+			self.order=sorted(self.entries, key=lambda name: (
+				self.entries[name][2] is None,
+				self.entries[name][2] if self.entries[name][2] is not None else 0,
+				name
+				))
+		return self.order
+
+	def index_restat(self):
+		"""
+		Refreshes the size and modification time of every indexed
+		file, e.g. while files are still being written.
+		"""
+		for name, entry in self.entries.items():
+			try:
+				st=os.stat(os.path.join(self.directory, name))
+			except OSError:
+				continue
+			entry[0], entry[1]=st.st_size, st.st_mtime_ns
+		self.index_save()
+
+	def index_save(self):
+		"""
+		Saves the index. The file is written under a temporary
+		name and renamed, so concurrent runs never read a partial
+		index.
+		"""
+		if self.indexFile is None:
+			return
+		tmpFile='{0}.{1}.tmp'.format(self.indexFile, os.getpid())
+		try:
+			os.makedirs(os.path.dirname(self.indexFile), exist_ok=True)
+			with open(tmpFile, mode='w') as f:
+				json.dump({'directory' : os.path.abspath(self.directory),
+						'pattern' : self.pattern,
+						'dirMtime' : self.dirMtime,
+						'scanTime' : self.scanTime,
+						'entries' : self.entries
+						}, f)
+			os.replace(tmpFile, self.indexFile)
+		except OSError as err:
+			if self.logger is not None:
+				self.logger.warning("Could not save directory index: "
+						"{0}: {1}".format(self.indexFile, err)
+						)
+
+	def index_update(self):
+		"""
+		Brings the index up to date with the directory. The
+		directory is listed only if it has been modified since
+		the last listing.
+
+		Returns
+		-------
+		list
+			Paths of files added to the index, in order.
+		"""
+		dirMtime=os.stat(self.directory).st_mtime_ns
+		## A listing made within a second of a modification might
+		## have missed files with the same modification time.
+		if (dirMtime == self.dirMtime and self.scanTime is not None
+				and self.scanTime-dirMtime > 1e9):
+			return []
+		scanTime=time.time_ns()
+		names=set()
+		added=[]
+		with os.scandir(self.directory) as it:
+			for entry in it:
+				if not fnmatch.fnmatchcase(entry.name, self.pattern):
+					continue
+				names.add(entry.name)
+				if entry.name in self.entries:
+					continue
+				try:
+					if not entry.is_file():
+						names.discard(entry.name)
+						continue
+					st=entry.stat()
+				except OSError:
+					names.discard(entry.name)
+					continue
+				self.entries[entry.name]=[st.st_size, st.st_mtime_ns,
+						self.orderKey(entry.name) if self.orderKey is not None
+						else entry.name
+						]
+				added.append(entry.name)
+		removed=[name for name in self.entries if name not in names]
+		for name in removed:
+			del self.entries[name]
+		self.dirMtime=dirMtime
+		self.scanTime=scanTime
+		self.order=None
+		if self.logger is not None:
+			self.logger.info("Indexed directory {0}: {1} files, {2} new, "
+					"{3} removed.".format(
+						self.directory, len(self.entries), len(added), len(removed)
+						)
+					)
+		self.index_save()
+		addedSet=set(added)
+		return [os.path.join(self.directory, name)
+				for name in self.index_names() if name in addedSet
+				]
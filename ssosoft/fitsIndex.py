@@ -0,0 +1,321 @@
+import astropy.io.fits as fits
+import hashlib
+import json
+import numpy as np
+import os
+import weakref
+
+class fitsIndex:
+	"""
+	An index of the extensions of a multi-extension FITS file, giving
+	random access to single frames without parsing every header.
+
+	-----------------------------------------------------------------
+
+	The index records, for the primary HDU and each extension, the
+	byte offsets of the header and data, the data shape, BITPIX, and
+	the BZERO/BSCALE scaling. It is built once by scanning the
+	header cards of the file and saved as a JSON sidecar under
+	indexBase, together with the file's size and modification time.
+	Later passes load the sidecar instead of scanning again, and a
+	changed file is indexed afresh.
+
+	Frames are numbered from 0, so frame k is extension k+1. A frame
+	is returned as a view of a memory map of the file, or as a
+	scaled copy if the extension is scaled, with the same values as
+	astropy would give. The memory map is kept only while frames
+	from it are in use, so that an index can be kept for the length
+	of a run without holding the file open. Only plain image
+	extensions are supported; anything else raises a ValueError
+	while indexing.
+
+	-----------------------------------------------------------------
+
+	Parameters
+	----------
+	file : str
+		Path to the FITS file.
+	indexBase : str
+		Directory holding the index sidecars. Default None keeps
+		the index in memory only.
+	logger : logging.Logger
+		Logger for warnings.
+
+	-----------------------------------------------------------------
+
+	Example
+	-------
+
+		index=fitsIndex(file, indexBase)
+		frame=index[k]
+		cube=index.index_read_frames(0, len(index))
+	"""
+
+	def __init__(self, file, indexBase=None, logger=None):
+		"""
+		Parameters
+		----------
+		file : str
+			Path to the FITS file.
+		indexBase : str
+			Directory holding the index sidecars. Default None
+			keeps the index in memory only.
+		logger : logging.Logger
+			Logger for warnings.
+		"""
+		self.file=file
+		self.fileMap=None
+		self.indexFile=None
+		self.logger=logger
+		self.records=[]
+
+		st=os.stat(self.file)
+		self.fileStat=[st.st_size, st.st_mtime_ns]
+		if indexBase is not None:
+			self.indexFile=os.path.join(indexBase, '{0}.{1}.json'.format(
+				os.path.basename(self.file),
+				hashlib.sha1(os.path.abspath(self.file).encode('utf-8')).hexdigest()[:8]
+				))
+		if not self.index_load():
+			self.index_build()
+			self.index_save()
+
+	def __getitem__(self, k):
+		if not 0 <= k < len(self):
+			raise IndexError("Frame {0} not in {1}".format(k, self.file))
+		record=self.records[k+1]
+		nBytes=abs(record['bitpix'])//8*int(np.prod(record['shape']))
+		raw=self.index_map()[
+			record['dataOffset']:record['dataOffset']+nBytes
+			].view(self.index_dtype(record['bitpix'])).reshape(record['shape'])
+		return self.index_scale(raw, record)
+
+	def __len__(self):
+		return len(self.records)-1
+
+	def index_build(self):
+		"""
+		Scans the header cards of the file for the values needed
+		to locate and decode each HDU.
+		"""
+		self.records=[]
+		with open(self.file, mode='rb') as f:
+			while True:
+				headerOffset=f.tell()
+				cards={}
+				while 'END' not in cards:
+					block=f.read(2880)
+					if not block and not cards:
+						return
+					if len(block) < 2880:
+						raise ValueError("Truncated header in "
+								"{0}".format(self.file)
+								)
+					for i in range(0, 2880, 80):
+						card=block[i:i+80].decode('ascii', errors='replace')
+						key=card[:8].strip()
+						if key == 'END':
+							cards['END']=None
+							break
+						if card[8:10] == '= ':
+							cards[key]=card[10:].split('/')[0].strip().strip("'").strip()
+				if self.records and cards.get('XTENSION') != 'IMAGE':
+					raise ValueError("Extension {0} of {1} is not an "
+							"image extension".format(len(self.records), self.file)
+							)
+				bitpix=int(cards['BITPIX'])
+				naxis=int(cards['NAXIS'])
+				shape=[int(cards['NAXIS{0}'.format(n)]) for n in range(naxis, 0, -1)]
+				nBytes=abs(bitpix)//8*int(cards.get('GCOUNT', 1))*(
+						int(cards.get('PCOUNT', 0))
+						+(int(np.prod(shape)) if naxis else 0)
+						)
+				self.records.append({
+					'headerOffset' : headerOffset,
+					'dataOffset' : f.tell(),
+					'shape' : shape,
+					'bitpix' : bitpix,
+					'bzero' : float(cards.get('BZERO', 0)),
+					'bscale' : float(cards.get('BSCALE', 1))
+					})
+				f.seek(-(-nBytes//2880)*2880, os.SEEK_CUR)
+
+	def index_complete(self):
+		"""
+		Checks that the file holds all of the data its headers
+		describe, i.e. it is not truncated.
+
+		Returns
+		-------
+		bool
+		"""
+		record=self.records[-1]
+		nBytes=abs(record['bitpix'])//8*int(np.prod(record['shape']))
+		return record['dataOffset']+nBytes <= self.fileStat[0]
+
+	def index_dtype(self, bitpix):
+		"""
+		Returns the big-endian numpy data type of a BITPIX value.
+
+		Parameters
+		----------
+		bitpix : int
+			FITS BITPIX value.
+
+		Returns
+		-------
+		numpy.dtype
+		"""
+		return np.dtype({8 : 'u1', 16 : '>i2', 32 : '>i4', 64 : '>i8',
+				-32 : '>f4', -64 : '>f8'
+				}[bitpix])
+
+	def index_header(self, ext):
+		"""
+		Reads the header of one HDU.
+
+		Parameters
+		----------
+		ext : int
+			HDU number, 0 for the primary HDU.
+
+		Returns
+		-------
+		astropy.io.fits.Header
+		"""
+		record=self.records[ext]
+		with open(self.file, mode='rb') as f:
+			f.seek(record['headerOffset'])
+			headerBytes=f.read(record['dataOffset']-record['headerOffset'])
+		return fits.Header.fromstring(headerBytes.decode('ascii'))
+
+	def index_load(self):
+		"""
+		Loads the index sidecar, if there is one and the file is
+		unchanged since it was written.
+
+		Returns
+		-------
+		bool
+			True if the index was loaded.
+		"""
+		if self.indexFile is None or not os.path.exists(self.indexFile):
+			return False
+		try:
+			with open(self.indexFile, mode='r') as f:
+				index=json.load(f)
+		except ValueError:
+			return False
+		if index.get('fileStat') != self.fileStat:
+			return False
+		self.records=index['records']
+		return True
+
+	def index_map(self):
+		"""
+		Returns a read-only memory map of the whole file. The map
+		is shared by all frames in use and opened again once none
+		are.
+
+		Returns
+		-------
+		numpy.memmap
+			np.uint8 array of the file's bytes.
+		"""
+		fileMap=self.fileMap() if self.fileMap is not None else None
+		if fileMap is None:
+			fileMap=np.memmap(self.file, dtype=np.uint8, mode='r')
+			self.fileMap=weakref.ref(fileMap)
+		return fileMap
+
+	def index_read_frames(self, start, stop, out=None):
+		"""
+		Reads a range of frames into one array.
+
+		Parameters
+		----------
+		start : int
+			First frame to read.
+		stop : int
+			Frame after the last one to read.
+		out : numpy.ndarray
+			Optional array of shape (stop-start,)+frame shape to
+			read into. Default None allocates one in the data
+			type of the frames.
+
+		Returns
+		-------
+		numpy.ndarray
+		"""
+		## Keep the file mapped until every frame is read.
+		fileMap=self.index_map()
+		if out is None:
+			first=self[start]
+			out=np.empty((stop-start,)+first.shape, dtype=first.dtype.newbyteorder('='))
+		for i, k in enumerate(range(start, stop)):
+			np.copyto(out[i], self[k], casting='unsafe')
+		return out
+
+	def index_save(self):
+		"""
+		Saves the index sidecar. The file is written under a
+		temporary name and renamed, so concurrent runs never read
+		a partial index.
+		"""
+		if self.indexFile is None:
+			return
+		tmpFile='{0}.{1}.tmp'.format(self.indexFile, os.getpid())
+		try:
+			os.makedirs(os.path.dirname(self.indexFile), exist_ok=True)
+			with open(tmpFile, mode='w') as f:
+				json.dump({'file' : self.file,
+						'fileStat' : self.fileStat,
+						'records' : self.records
+						}, f)
+			os.replace(tmpFile, self.indexFile)
+		except OSError as err:
+			if self.logger is not None:
+				self.logger.warning("Could not save FITS index: {0}: "
+						"{1}".format(self.indexFile, err)
+						)
+
+	def index_shapes(self):
+		"""
+		Returns the shapes of the frames.
+
+		Returns
+		-------
+		list
+			(rows, cols) tuple of each frame.
+		"""
+		return [tuple(record['shape']) for record in self.records[1:]]
+
+	def index_scale(self, raw, record):
+		"""
+		Applies BZERO and BSCALE to raw data, as astropy does.
+
+		Parameters
+		----------
+		raw : numpy.ndarray
+			Raw big-endian data of one HDU.
+		record : dict
+			Index record of the HDU.
+
+		Returns
+		-------
+		numpy.ndarray
+			raw itself if the HDU is not scaled, unsigned integers
+			for the FITS unsigned convention, and floating point
+			otherwise.
+		"""
+		bitpix, bzero, bscale=record['bitpix'], record['bzero'], record['bscale']
+		if bzero == 0 and bscale == 1:
+			return raw
+		if bitpix > 8 and bscale == 1 and bzero == 2**(bitpix-1):
+			## Unsigned integers: flipping the sign bit adds BZERO.
+			udtype=raw.dtype.str.replace('i', 'u')
+			return raw.view(udtype)^np.array(bzero, dtype=udtype)
+		if bitpix == 8 and bscale == 1 and bzero == -128:
+			return (raw^np.uint8(128)).view(np.int8)
+		dtype=np.float32 if abs(bitpix) <= 16 else np.float64
+		return raw.astype(dtype)*dtype(bscale)+dtype(bzero)
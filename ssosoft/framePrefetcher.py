@@ -0,0 +1,138 @@
+import collections
+import concurrent.futures
+
+class framePrefetcher:
+	"""
+	Reads upcoming image files on a pool of I/O threads, so that
+	per-file latency on network storage overlaps with processing.
+
+	-----------------------------------------------------------------
+
+	Files are read in the order of fileList by a user-supplied load
+	function, up to depth files ahead of the consumer, and are
+	delivered in their original order. The amount of data held in
+	memory is capped at maxBytes: the size of a loaded file is
+	measured from the arrays the load function returns, and until
+	the first file has been read only one file is in flight. At
+	least one file is always read, whatever the cap. A read error
+	is raised to the consumer when the file it occurred in is
+	reached.
+
+	-----------------------------------------------------------------
+
+	Parameters
+	----------
+	fileList : list
+		Paths to the files, in the order they will be consumed.
+	loadFile : callable
+		Function taking a path and returning a list of
+		numpy.ndarray frames.
+	depth : int
+		Maximum number of files read ahead. Default 8.
+	nThreads : int
+		Number of I/O threads. Default 4.
+	maxBytes : int
+		Maximum number of bytes read ahead. Default 1 GiB.
+
+	-----------------------------------------------------------------
+
+	Example
+	-------
+
+		for file, frames in framePrefetcher(fileList, load):
+			...
+	"""
+
+	def __init__(self, fileList, loadFile, depth=8, nThreads=4, maxBytes=2**30):
+		"""
+		Parameters
+		----------
+		fileList : list
+			Paths to the files, in the order they will be consumed.
+		loadFile : callable
+			Function taking a path and returning a list of
+			numpy.ndarray frames.
+		depth : int
+			Maximum number of files read ahead. Default 8.
+		nThreads : int
+			Number of I/O threads. Default 4.
+		maxBytes : int
+			Maximum number of bytes read ahead. Default 1 GiB.
+		"""
+		self.current=(None, None)
+		self.depth=max(1, depth)
+		self.fileBytes=None
+		self.fileList=list(fileList)
+		self.loadFile=loadFile
+		self.maxBytes=maxBytes
+		self.nextFile=0
+		self.pending=collections.deque()
+		self.pool=concurrent.futures.ThreadPoolExecutor(max(1, nThreads))
+
+		self.prefetch_fill()
+
+	def __iter__(self):
+		return self
+
+	def __next__(self):
+		if not self.pending:
+			self.prefetch_close()
+			raise StopIteration
+		file, future=self.pending.popleft()
+		try:
+			frames=future.result()
+		except Exception:
+			self.prefetch_close()
+			raise
+		fileBytes=sum(frame.nbytes for frame in frames)
+		if self.fileBytes is None or fileBytes > self.fileBytes:
+			self.fileBytes=fileBytes
+		self.current=(file, frames)
+		self.prefetch_fill()
+		return self.current
+
+	def prefetch_close(self):
+		"""
+		Cancels reads not yet started and releases the I/O
+		threads.
+		"""
+		for file, future in self.pending:
+			future.cancel()
+		self.pending.clear()
+		self.pool.shutdown(wait=False)
+
+	def prefetch_fill(self):
+		"""
+		Submits reads until depth or maxBytes is reached.
+		"""
+		if self.fileBytes is None:
+			depth=1
+		else:
+			depth=min(self.depth, max(1, self.maxBytes//max(1, self.fileBytes)))
+		while self.nextFile < len(self.fileList) and len(self.pending) < depth:
+			file=self.fileList[self.nextFile]
+			self.pending.append((file, self.pool.submit(self.loadFile, file)))
+			self.nextFile+=1
+
+	def prefetch_get(self, file):
+		"""
+		Returns the frames of a file, skipping over any files
+		before it. The most recently returned file can be asked
+		for again.
+
+		Parameters
+		----------
+		file : str
+			Path to the file.
+
+		Returns
+		-------
+		list
+			numpy.ndarray frames returned by loadFile.
+		"""
+		while self.current[0] != file:
+			try:
+				next(self)
+			except StopIteration:
+				raise KeyError("File not in prefetch list: {0}".format(file))
+		return self.current[1]
@@ -0,0 +1,284 @@
+import numpy as np
+import os
+import stat
+import subprocess
+import sys
+import time
+
+class kisipStandIn:
+	"""
+	A stand-in for the KISIP speckle executable and its MPI runner,
+	to run and tune kisipWrapper without KISIP or an MPI install.
+
+	-----------------------------------------------------------------
+
+	stand_in_install writes two executables to a directory, mpirun
+	and entry, for use as kisipEnvBin, kisipEnvMpirun, and
+	kisipEnvKisipExe. 'mpirun -np N entry' starts N entry
+	processes, its ranks, and exits with the largest of their
+	return codes.
+
+	Each rank reads init_file.dat, init_method.dat, and
+	init_props.dat from its working directory, as KISIP does, and
+	checks that every burst file of the batch, and the noise file
+	if there is one, has the size given by init_props.dat. Ranks
+	share the bursts round robin, and for each burst write
+	<speckled prefix>.<index>.final, an unformatted np.float32
+	image of rows x cols, as KISIP does. The image is the mean of
+	the burst's frames.
+
+	Runtime is simulated: each rank waits secondsPerRank times the
+	number of ranks at start, standing in for MPI start-up and
+	communication, which grow with the number of ranks, and
+	secondsPerFrame for each frame of its bursts. A batch thus
+	takes about secondsPerRank*N+secondsPerFrame*frames/N. With
+	busy set, ranks keep a CPU busy while waiting instead of
+	sleeping, so that concurrent batches compete for cores as
+	KISIP's do.
+
+	The stand-in needs only numpy. The executables load this
+	module by path, without importing the ssosoft package.
+
+	-----------------------------------------------------------------
+
+	Parameters
+	----------
+	secondsPerFrame : float
+		Simulated processing time per frame. Default 0.
+	secondsPerRank : float
+		Simulated start-up time per rank. Default 0.
+	busy : bool
+		Default False sleeps while waiting. Set to True to keep a
+		CPU busy instead.
+
+	-----------------------------------------------------------------
+
+	Example
+	-------
+
+		s=ssosoft.kisipStandIn(secondsPerFrame=0.01, secondsPerRank=0.1)
+		s.stand_in_install('/scratch/kisipStandIn')
+
+	and in the configuration file
+
+		[KISIP_ENV]
+		kisipEnvBin=/scratch/kisipStandIn
+		kisipEnvMpirun=mpirun
+		kisipEnvKisipExe=entry
+	"""
+
+	def __init__(self, secondsPerFrame=0.0, secondsPerRank=0.0, busy=False):
+		"""
+		Parameters
+		----------
+		secondsPerFrame : float
+			Simulated processing time per frame. Default 0.
+		secondsPerRank : float
+			Simulated start-up time per rank. Default 0.
+		busy : bool
+			Default False sleeps while waiting. Set to True to
+			keep a CPU busy instead.
+		"""
+		self.busy=bool(busy)
+		self.secondsPerFrame=float(secondsPerFrame)
+		self.secondsPerRank=float(secondsPerRank)
+
+	def stand_in_entry(self, rank=0, nRanks=1, workDir='.'):
+		"""
+		Runs one rank of the stand-in speckle executable.
+
+		Parameters
+		----------
+		rank : int
+			Rank of this process. Default 0.
+		nRanks : int
+			Number of ranks. Default 1.
+		workDir : str
+			Directory holding the init files. Default the
+			current directory.
+
+		Returns
+		-------
+		int
+			0 on success, 1 if the init files or burst files are
+			not as expected.
+		"""
+		try:
+			init=self.stand_in_read_init_files(workDir)
+		except (OSError, ValueError, IndexError) as err:
+			self.stand_in_log("Rank {0}: cannot read init files: {1}".format(rank, err))
+			return 1
+		frameCount=init['rows']*init['cols']
+		burstBytes=init['headerOff']+init['burstNumber']*frameCount*4
+		indices=range(init['startInd'], init['endInd']+1)
+		if rank == 0:
+			self.stand_in_log("KISIP stand-in: {0} ranks: bursts {1} to {2}: "
+					"{3} x {4} x {5}".format(nRanks, init['startInd'],
+						init['endInd'], init['burstNumber'], init['rows'],
+						init['cols']
+						))
+			if not os.path.exists(init['noiseFile']):
+				self.stand_in_log("Warning: no noise file: {0}".format(init['noiseFile']))
+			elif os.path.getsize(init['noiseFile']) != init['burstNumber']*frameCount*4:
+				self.stand_in_log("Noise file has the wrong size: {0}".format(init['noiseFile']))
+				return 1
+		for i in indices:
+			burstFile='{0}.{1:03d}'.format(init['burstPrefix'], i)
+			if not os.path.exists(burstFile) or os.path.getsize(burstFile) != burstBytes:
+				self.stand_in_log("Rank {0}: missing or wrong size burst file, expected {1} "
+						"bytes: {2}".format(rank, burstBytes, burstFile))
+				return 1
+		self.stand_in_wait(self.secondsPerRank*nRanks)
+		for i in indices[rank::nRanks]:
+			burst=np.fromfile('{0}.{1:03d}'.format(init['burstPrefix'], i),
+					dtype=np.float32,
+					count=init['burstNumber']*frameCount,
+					offset=init['headerOff']
+					).reshape(init['burstNumber'], frameCount)
+			self.stand_in_wait(self.secondsPerFrame*init['burstNumber'])
+			finalFile='{0}.{1:03d}.final'.format(init['speckledPrefix'], i)
+			tmpFile='{0}.{1}.tmp'.format(finalFile, os.getpid())
+			burst.mean(axis=0, dtype=np.float32).tofile(tmpFile)
+			os.replace(tmpFile, finalFile)
+			self.stand_in_log("Rank {0}: wrote {1}".format(rank, finalFile))
+		return 0
+
+	def stand_in_install(self, binDir):
+		"""
+		Writes the mpirun and entry executables, with this
+		instance's settings, to a directory.
+
+		Parameters
+		----------
+		binDir : str
+			Directory for the executables, created if needed.
+
+		Returns
+		-------
+		str
+			binDir.
+		"""
+		os.makedirs(binDir, exist_ok=True)
+		settings="secondsPerFrame={0!r}, secondsPerRank={1!r}, busy={2!r}".format(
+				self.secondsPerFrame, self.secondsPerRank, self.busy
+				)
+		for name, call in [('mpirun', 'standIn.stand_in_mpirun(sys.argv[1:])'),
+				('entry', "standIn.stand_in_entry("
+					"int(os.environ.get('KISIP_STAND_IN_RANK', 0)), "
+					"int(os.environ.get('KISIP_STAND_IN_SIZE', 1)))")
+				]:
+			script=os.path.join(binDir, name)
+			with open(script, mode='w') as f:
+				f.write("#!{0}\n"
+						"import importlib.util, os, sys\n"
+						"spec=importlib.util.spec_from_file_location('kisipStandIn', {1!r})\n"
+						"module=importlib.util.module_from_spec(spec)\n"
+						"spec.loader.exec_module(module)\n"
+						"standIn=module.kisipStandIn({2})\n"
+						"sys.exit({3})\n".format(
+							sys.executable, os.path.abspath(__file__), settings, call
+							))
+			os.chmod(script, os.stat(script).st_mode|stat.S_IXUSR|stat.S_IXGRP|stat.S_IXOTH)
+		return binDir
+
+	def stand_in_log(self, message):
+		"""
+		Writes one line to standard output in a single write, so
+		that the lines of ranks sharing the output do not
+		interleave.
+
+		Parameters
+		----------
+		message : str
+			Line to write.
+		"""
+		sys.stdout.write(message+"\n")
+		sys.stdout.flush()
+
+	def stand_in_mpirun(self, argv):
+		"""
+		Runs the stand-in MPI runner. Ranks inherit its standard
+		output and are told their rank and the number of ranks
+		through the KISIP_STAND_IN_RANK and KISIP_STAND_IN_SIZE
+		environment variables.
+
+		Parameters
+		----------
+		argv : list
+			Arguments: '-np', number of ranks, and the
+			executable to run.
+
+		Returns
+		-------
+		int
+			The largest return code of the ranks.
+		"""
+		if len(argv) < 3 or argv[0] != '-np':
+			self.stand_in_log("Usage: mpirun -np <ranks> <executable> [arguments]")
+			return 2
+		nRanks=int(argv[1])
+		ranks=[]
+		for rank in range(nRanks):
+			env=dict(os.environ,
+					KISIP_STAND_IN_RANK=str(rank),
+					KISIP_STAND_IN_SIZE=str(nRanks)
+					)
+			ranks.append(subprocess.Popen(argv[2:], env=env))
+		return max(rank.wait() for rank in ranks)
+
+	def stand_in_read_init_files(self, workDir='.'):
+		"""
+		Reads the KISIP init files written by
+		kisipWrapper.kisip_write_init_files.
+
+		Parameters
+		----------
+		workDir : str
+			Directory holding the init files. Default the
+			current directory.
+
+		Returns
+		-------
+		dict
+			Keys 'burstPrefix', 'startInd', 'endInd',
+			'speckledPrefix', 'noiseFile' from init_file.dat,
+			'method', the lines of init_method.dat, and 'cols',
+			'rows', 'burstNumber', 'headerOff' from
+			init_props.dat.
+		"""
+		with open(os.path.join(workDir, 'init_file.dat'), mode='r') as f:
+			initFile=f.read().splitlines()
+		with open(os.path.join(workDir, 'init_method.dat'), mode='r') as f:
+			initMethod=f.read().splitlines()
+		with open(os.path.join(workDir, 'init_props.dat'), mode='r') as f:
+			initProps=f.read().splitlines()
+		return {
+			'burstPrefix' : initFile[0],
+			'startInd' : int(initFile[1]),
+			'endInd' : int(initFile[2]),
+			'speckledPrefix' : initFile[3],
+			'noiseFile' : initFile[4],
+			'method' : initMethod,
+			'cols' : int(initProps[0]),
+			'rows' : int(initProps[1]),
+			'burstNumber' : int(initProps[2]),
+			'headerOff' : int(initProps[3])
+			}
+
+	def stand_in_wait(self, seconds):
+		"""
+		Waits, sleeping or keeping a CPU busy.
+
+		Parameters
+		----------
+		seconds : float
+			Time to wait.
+		"""
+		if seconds <= 0:
+			return
+		if not self.busy:
+			time.sleep(seconds)
+			return
+		end=time.perf_counter()+seconds
+		while time.perf_counter() < end:
+			pass
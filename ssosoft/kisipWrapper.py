@@ -1,8 +1,11 @@
+import concurrent.futures
 import configparser
 import glob
 import logging, logging.config
 import os
 import subprocess
+import threading
+from .runManifest import manifest_fingerprint
 
 class kisipWrapper:
 	"""
@@ -78,6 +81,8 @@ class kisipWrapper:
 		self.burstNumber=rosaZylaCal.burstNumber
 		self.configFile=rosaZylaCal.configFile
 		self.imageShape=rosaZylaCal.imageShape
+		self.indexDirectory=rosaZylaCal.rosa_zyla_index_directory
+		self.indexLock=threading.Lock()
 		self.instrument=rosaZylaCal.instrument.upper()
 		self.kisipPreSpeckleBatch=0
 		self.kisipPreSpeckleStartInd=0
@@ -87,11 +92,15 @@ class kisipWrapper:
 		self.obsTime=rosaZylaCal.obsTime
 		self.postSpeckleBase=rosaZylaCal.postSpeckleBase
 		self.preSpeckleBase=rosaZylaCal.preSpeckleBase
+		self.sharedSlot=rosaZylaCal.rosa_zyla_shared_slot
 		self.speckleBase=rosaZylaCal.speckleBase
+		self.useDirIndex=rosaZylaCal.useDirIndex
 		self.workBase=rosaZylaCal.workBase
 
 		self.logFile=rosaZylaCal.logFile
 		self.logger=rosaZylaCal.logger
+		self.manifest=rosaZylaCal.manifest
+		self.metrics=rosaZylaCal.metrics
 	
 	def kisip_configure_run(self):
 		"""
@@ -128,6 +137,9 @@ class kisipWrapper:
 		self.kisipEnvMpiNproc=config['KISIP_ENV']['kisipEnvMpiNproc']
 		self.kisipEnvMpirun=config['KISIP_ENV']['kisipEnvMpirun']
 		self.kisipEnvKisipExe=config['KISIP_ENV']['kisipEnvKisipExe']
+		self.kisipEnvConcurrentBatches=config['KISIP_ENV'].getint(
+				'kisipEnvConcurrentBatches', fallback=1
+				)
 	
 		self.logger.info("This is kisipWrapper, part of SSOsoft "
 				"version {0}".format(self.ssosoftConfig.__version__)
@@ -163,21 +175,301 @@ class kisipWrapper:
 				self.logger.critical("CRITICAL: {0}".format(err))
 				raise
 
-	def kisip_despeckle_all_batches(self):
+	def kisip_batch_done(self, batch):
+		"""
+		Checks the run manifest for a batch despeckled by an
+		earlier, interrupted run. A batch is done only if its
+		.final outputs are intact, its burst files are unchanged,
+		and the KISIP parameters are the same.
+
+		Parameters
+		----------
+		batch : int
+			The KISIP pre-speckled image batch number.
+
+		Returns
+		-------
+		bool
+		"""
+		if self.manifest is None:
+			return False
+		if self.manifest.manifest_is_done('kisip', batch,
+				params=self.kisip_params_fingerprint()
+				):
+			self.logger.info("Run manifest: KISIP batch {0} already "
+					"complete, skipping.".format(batch)
+					)
+			return True
+		return False
+
+	def kisip_batch_files(self, base, fileForm, batch, suffix):
+		"""
+		Lists the files of one batch.
+
+		Parameters
+		----------
+		base : str
+			Directory to search.
+		fileForm : str
+			File name format, burstFileForm or speckledFileForm.
+		batch : int
+			The KISIP pre-speckled image batch number.
+		suffix : str
+			File name ending after the index, e.g. '' or '.final'.
+
+		Returns
+		-------
+		list
+			Sorted paths to the files.
+		"""
+		pattern=(fileForm.format(self.obsDate, self.obsTime, batch, 0)[:-3]
+				+'[0-9][0-9][0-9]'+suffix
+				)
+		if self.useDirIndex:
+			## Batches run on several threads share the index.
+			with self.indexLock:
+				return self.indexDirectory(base, '*',
+						persist=False, level0=False
+						).index_files(pattern)
+		return sorted(glob.glob(os.path.join(base, pattern)))
+
+	def kisip_batch_work_dir(self, batch):
+		"""
+		Returns the working directory of a batch when batches run
+		concurrently. Each batch gets its own directory, and its
+		own KISIP init files, under workBase.
+
+		Parameters
+		----------
+		batch : int
+			The KISIP pre-speckled image batch number.
+
+		Returns
+		-------
+		str
+			Path to the batch working directory.
+		"""
+		return os.path.join(self.workBase, 'kisip.batch.{:02d}'.format(batch))
+
+	def kisip_collect_return_codes(self, futures, batchCallback=None):
+		"""
+		Waits for submitted KISIP batches and gathers their return
+		codes. An exception raised by any batch is re-raised once
+		all batches have finished.
+
+		Parameters
+		----------
+		futures : dict
+			concurrent.futures.Future for each batch number.
+		batchCallback : callable
+			Optional function called with the batch number of
+			each batch that succeeds, in this thread, in the
+			order the batches finish.
+
+		Returns
+		-------
+		dict
+			KISIP return code for each batch, None if the batch
+			raised an exception.
+		"""
+		returnCodes={}
+		failed=None
+		futureBatches={future : batch for batch, future in futures.items()}
+		for future in concurrent.futures.as_completed(futureBatches):
+			batch=futureBatches[future]
+			try:
+				returnCodes[batch]=future.result()
+			except Exception as err:
+				returnCodes[batch]=None
+				failed=err
+			else:
+				if returnCodes[batch] == 0 and batchCallback is not None:
+					batchCallback(batch)
+		if failed is not None:
+			raise failed
+		return {batch : returnCodes[batch] for batch in futures}
+
+	def kisip_despeckle_all_batches(self, batchCallback=None):
 		"""
 		The main method used for despeckling image data with
-		KISIP.
+		KISIP. Up to kisipEnvConcurrentBatches batches run at the
+		same time, each in its own working directory, sharing the
+		kisipEnvMpiNproc MPI ranks between them.
+
+		Parameters
+		----------
+		batchCallback : callable
+			Optional function called with the batch number of
+			each batch as soon as KISIP finishes it successfully,
+			e.g. rosaZylaCal.rosa_zyla_save_despeckled_as_fits.
+
+		Returns
+		-------
+		dict
+			KISIP return code for each batch.
 		"""
 		self.kisip_configure_run()
 		self.logger.info("Preparing to run KISIP on batches: "
 				"{0}".format(self.batchList)
 				)
-		for batch in self.batchList:
-			self.kisip_set_batch_start_end_inds(batch)
-			self.kisip_set_environment()
-			self.kisip_write_init_files()
-			self.kisip_spawn_kisip()
-	
+		self.kisip_set_environment()
+		nConcurrent=max(1, min(self.kisipEnvConcurrentBatches,
+			len(self.batchList)
+			))
+		if nConcurrent == 1:
+			returnCodes={}
+			for batch in self.batchList:
+				if self.kisip_batch_done(batch):
+					returnCodes[batch]=0
+					continue
+				self.kisip_set_batch_start_end_inds(batch)
+				self.kisip_write_init_files()
+				returnCodes[batch]=self.kisip_spawn_kisip()
+				if returnCodes[batch] == 0 and batchCallback is not None:
+					batchCallback(batch)
+		else:
+			returnCodes=self.kisip_despeckle_concurrent_batches(
+					self.batchList, nConcurrent, batchCallback
+					)
+		for batch, returnCode in returnCodes.items():
+			if returnCode != 0:
+				self.logger.error("ERROR: KISIP batch: {0} exited "
+						"with code: {1}".format(batch, returnCode)
+						)
+		self.logger.info("KISIP return codes by batch: "
+				"{0}".format(returnCodes)
+				)
+		return returnCodes
+
+	def kisip_despeckle_concurrent_batches(self, batchList, nConcurrent,
+			batchCallback=None):
+		"""
+		Runs KISIP on several batches at the same time. Each batch
+		is given its own working directory and init files, and
+		kisipEnvMpiNproc is split evenly between the batches
+		running at once.
+
+		Parameters
+		----------
+		batchList : list
+			KISIP pre-speckled image batch numbers to process.
+		nConcurrent : int
+			Number of batches to run at the same time.
+		batchCallback : callable
+			Optional function called with the batch number of
+			each batch as soon as KISIP finishes it successfully.
+
+		Returns
+		-------
+		dict
+			KISIP return code for each batch.
+		"""
+		nProc=max(1, int(self.kisipEnvMpiNproc)//nConcurrent)
+		self.logger.info("Running {0} KISIP batches concurrently on "
+				"{1} threads each.".format(nConcurrent, nProc)
+				)
+		futures={}
+		with concurrent.futures.ThreadPoolExecutor(nConcurrent) as pool:
+			for batch in batchList:
+				futures[batch]=self.kisip_submit_batch(pool, batch, nProc)
+			return self.kisip_collect_return_codes(futures, batchCallback)
+
+	def kisip_despeckle_pipelined(self, saveBursts, batchCallback=None):
+		"""
+		Despeckles batches while burst cubes are still being
+		produced. saveBursts is run in this thread, and each batch
+		is handed to KISIP as soon as its last burst is saved.
+		Up to kisipEnvConcurrentBatches batches run at once, each
+		in its own working directory.
+
+		Parameters
+		----------
+		saveBursts : callable
+			Burst production method accepting a batchCallback
+			keyword, normally rosaZylaCal.rosa_zyla_save_bursts
+			of the instance this wrapper was created from.
+		batchCallback : callable
+			Optional function called with the batch number of
+			each batch KISIP finishes successfully, e.g.
+			rosaZylaCal.rosa_zyla_save_despeckled_as_fits. It is
+			called on a converter thread as soon as the batch
+			finishes, while bursts are still being saved, one
+			batch at a time in the order the batches finish. An
+			exception it raises is re-raised once all batches
+			are done.
+
+		Returns
+		-------
+		dict
+			KISIP return code for each batch.
+
+		Example
+		-------
+
+			r=ssosoft.rosaZylaCal('zyla', 'config.ini')
+			r.rosa_zyla_run_calibration(saveBursts=False)
+			k=ssosoft.kisipWrapper(r)
+			k.kisip_despeckle_pipelined(r.rosa_zyla_save_bursts)
+		"""
+		self.kisip_configure_run()
+		self.kisip_set_environment()
+		nConcurrent=max(1, self.kisipEnvConcurrentBatches)
+		nProc=max(1, int(self.kisipEnvMpiNproc)//nConcurrent)
+		self.logger.info("Running KISIP on batches as they are completed, "
+				"{0} at a time on {1} threads each.".format(
+					nConcurrent, nProc
+					)
+				)
+		def kisip_convert_batch(batch, future):
+			## Runs in the thread that finished the batch, or in
+			## this one if the batch was already done.
+			if future.exception() is None and future.result() == 0:
+				conversions[batch]=converter.submit(batchCallback, batch)
+
+		def kisip_submit(batch):
+			futures[batch]=self.kisip_submit_batch(pool, batch, nProc)
+			if batchCallback is not None:
+				futures[batch].add_done_callback(
+						lambda future: kisip_convert_batch(batch, future)
+						)
+
+		futures={}
+		conversions={}
+		with concurrent.futures.ThreadPoolExecutor(1) as converter:
+			with concurrent.futures.ThreadPoolExecutor(nConcurrent) as pool:
+				saveBursts(batchCallback=kisip_submit)
+				self.logger.info("All bursts saved, waiting for KISIP to "
+						"finish batches: {0}".format(list(futures))
+						)
+				returnCodes=self.kisip_collect_return_codes(futures)
+		self.logger.info("KISIP return codes by batch: "
+				"{0}".format(returnCodes)
+				)
+		for conversion in conversions.values():
+			conversion.result()
+		return returnCodes
+
+	def kisip_params_fingerprint(self):
+		"""
+		Fingerprints the KISIP parameters that affect the
+		despeckled output.
+
+		Returns
+		-------
+		str
+		"""
+		return manifest_fingerprint(
+				self.kisipArcsecPerPixX, self.kisipArcsecPerPixY,
+				self.kisipMethodSubfieldArcsec, self.wavelengthnm,
+				self.kisipMethodMethod, self.kisipMethodPhaseRecLimit,
+				self.kisipMethodUX, self.kisipMethodUV,
+				self.kisipMethodMaxIter, self.kisipMethodSNThresh,
+				self.kisipMethodWeightExp, self.kisipMethodPhaseRecApod,
+				self.kisipMethodNoiseFilter, self.kisipPropsHeaderOff,
+				self.kisipPropsTelescopeDiamm, self.kisipPropsAoLockX,
+				self.kisipPropsAoLockY, self.kisipPropsAoUsed
+				)
+
 	def kisip_set_environment(self):
 		"""
 		Sets the necessary operating sytstem environment
@@ -219,16 +511,10 @@ class kisipWrapper:
 			)
 			)
 			
-		fList=glob.glob(
-				os.path.join(
-					self.preSpeckleBase,
-					self.burstFileForm.format(
-						self.obsDate,
-						self.obsTime,
-						self.kisipPreSpeckleBatch,
-						0
-						)[:-3]+'*' ## Remove last '000' add '*'.
-					)
+		fList=self.kisip_batch_files(self.preSpeckleBase,
+				self.burstFileForm,
+				self.kisipPreSpeckleBatch,
+				''
 				)
 		nFile=len(fList)
 		if nFile==0:
@@ -258,66 +544,165 @@ class kisipWrapper:
 		self.kisipPreSpeckleStartInd=0	##Assumption.
 		self.kisipPreSpeckleEndInd=nFile-1	## Following assumption.
 
-	def kisip_spawn_kisip(self):
+	def kisip_spawn_kisip(self, batch=None, nProc=None, workDir=None):
 		"""
 		Spawns KISIP using an MPI runner and parameters specified
 		in the configuration file.
+
+		Parameters
+		----------
+		batch : int
+			Batch number, used for log messages. Default None
+			uses kisipPreSpeckleBatch.
+		nProc : int
+			Number of MPI processes. Default None uses
+			kisipEnvMpiNproc.
+		workDir : str
+			Directory holding the KISIP init files, in which KISIP
+			is run. Default None uses workBase.
+
+		Returns
+		-------
+		int
+			The KISIP return code.
 		"""
+		if batch is None:
+			batch=self.kisipPreSpeckleBatch
+		if nProc is None:
+			nProc=self.kisipEnvMpiNproc
+		if workDir is None:
+			workDir=self.workBase
 		kisipCommand="{0} {1} {2} {3}".format(
 				os.path.join(self.kisipEnvBin, self.kisipEnvMpirun),
 				'-np',
-				self.kisipEnvMpiNproc,
+				nProc,
 				os.path.join(self.kisipEnvBin, self.kisipEnvKisipExe)
 				)
 		self.logger.info("KISIP command: {0}".format(kisipCommand))
 		self.logger.info("KISIP log will be in directory: {0}".format(self.speckleBase))
 		self.logger.info("Now running KISIP for batch: {0} on: "
 				"{1} threads.".format(
-					self.kisipPreSpeckleBatch,
-					self.kisipEnvMpiNproc
+					batch,
+					nProc
 					)
 				)
-		try:
-			os.chdir(self.workBase)
-			process=subprocess.Popen([
-				os.path.join(self.kisipEnvBin, self.kisipEnvMpirun),
-					'-np',
-					self.kisipEnvMpiNproc,
-					os.path.join(self.kisipEnvBin, self.kisipEnvKisipExe)
-					],
-					stdout=subprocess.PIPE,
-					stderr=subprocess.STDOUT
-					)
-			with process.stdout as pipe:
-				for line in iter(pipe.readline, b''):
-					self.logger.info((line.strip()).decode('utf-8'))
-			returnCode=process.wait()
+		burstFiles=self.kisip_batch_files(self.preSpeckleBase,
+				self.burstFileForm, batch, ''
+				)
+		## In a multi-channel run, a batch waits for one of the KISIP
+		## slots shared between the channels.
+		with self.sharedSlot('kisip'):
+			with self.metrics.metrics_stage('kisip_batch', batch=batch,
+					frames=len(burstFiles)*int(self.burstNumber),
+					files=len(burstFiles),
+					bytesRead=sum(os.path.getsize(f) for f in burstFiles)
+					) as record:
+				returnCode=None
+				try:
+					process=subprocess.Popen([
+						os.path.join(self.kisipEnvBin, self.kisipEnvMpirun),
+							'-np',
+							str(nProc),
+							os.path.join(self.kisipEnvBin, self.kisipEnvKisipExe)
+							],
+							cwd=workDir,
+							stdout=subprocess.PIPE,
+							stderr=subprocess.STDOUT
+							)
+					with process.stdout as pipe:
+						for line in iter(pipe.readline, b''):
+							self.logger.info("Batch {0}: {1}".format(
+								batch,
+								(line.strip()).decode('utf-8')
+								)
+								)
+					## Reap KISIP with wait4 to get the resource usage of
+					## this batch alone, MPI ranks included, as other
+					## batches may be running at the same time.
+					pid, status, usage=os.wait4(process.pid, 0)
+					process.returncode=os.waitstatus_to_exitcode(status)
+					returnCode=process.returncode
+					record['childCpuSeconds']=usage.ru_utime+usage.ru_stime
+					record['childPeakRssMB']=usage.ru_maxrss/1024
 
-		except Exception as err:
-			self.logger.critical("CRITICAL: KISIP run failed: {0}".format(err))
-			self.logger.error("Something went wrong with KISIP run. "
-					"Check logfile. Code: {0}".format(returnCode)
-					)
-			raise
-		else:
-			self.logger.info(
-					"KISIP batch: {0} exited with code: "
-					"{1}".format(
-						self.kisipPreSpeckleBatch,
-						returnCode
+				except Exception as err:
+					self.logger.critical("CRITICAL: KISIP run failed: {0}".format(err))
+					self.logger.error("Something went wrong with KISIP run. "
+							"Check logfile. Code: {0}".format(returnCode)
+							)
+					raise
+				else:
+					self.logger.info(
+							"KISIP batch: {0} exited with code: "
+							"{1}".format(
+								batch,
+								returnCode
+								)
+							)
+				finalFiles=self.kisip_batch_files(self.speckleBase,
+						self.speckledFileForm, batch, '.final'
 						)
-					)
+				record['returnCode']=returnCode
+				record['bytesWritten']=sum(os.path.getsize(f) for f in finalFiles)
+				if returnCode == 0 and self.manifest is not None:
+					self.manifest.manifest_record('kisip', batch, finalFiles,
+							sources=burstFiles,
+							params=self.kisip_params_fingerprint()
+							)
+				return returnCode
+
+	def kisip_submit_batch(self, pool, batch, nProc):
+		"""
+		Prepares a batch in its own working directory and submits
+		its KISIP run to a thread pool.
+
+		Parameters
+		----------
+		pool : concurrent.futures.Executor
+			Pool the KISIP run is submitted to.
+		batch : int
+			The KISIP pre-speckled image batch number.
+		nProc : int
+			Number of MPI processes for this batch.
 
-	def kisip_write_init_files(self):
+		Returns
+		-------
+		concurrent.futures.Future
+			Resolves to the KISIP return code.
+		"""
+		if self.kisip_batch_done(batch):
+			future=concurrent.futures.Future()
+			future.set_result(0)
+			return future
+		workDir=self.kisip_batch_work_dir(batch)
+		if not os.path.isdir(workDir):
+			os.mkdir(workDir)
+		self.kisip_set_batch_start_end_inds(batch)
+		self.kisip_write_init_files(workDir=workDir)
+		return pool.submit(self.kisip_spawn_kisip,
+				batch=batch,
+				nProc=nProc,
+				workDir=workDir
+				)
+
+	def kisip_write_init_files(self, workDir=None):
 		"""
 		Writes the KISIP configuration files.
+
+		Parameters
+		----------
+		workDir : str
+			Directory to write the init files to. Default None
+			uses workBase.
 		"""
+		if workDir is None:
+			workDir=self.workBase
 		self.logger.info("Preparing to write KISIP init files.")
 		self.logger.info("Writing KISIP config file: "
-				"{0}".format(os.path.join(self.workBase, 'init_file.dat'))
+				"{0}".format(os.path.join(workDir, 'init_file.dat'))
 				)
 		try:
-			with open(os.path.join(self.workBase, 'init_file.dat'), mode='wt') as f:
+			with open(os.path.join(workDir, 'init_file.dat'), mode='wt') as f:
 				f.write("{0}{1}".format(
 					os.path.join(
 						self.preSpeckleBase,
@@ -364,10 +749,10 @@ class kisipWrapper:
 			raise
 
 		self.logger.info("Writing KISIP config file: "
-				"{0}".format(os.path.join(self.workBase, 'init_method.dat'))
+				"{0}".format(os.path.join(workDir, 'init_method.dat'))
 				)
 		try:
-			with open(os.path.join(self.workBase, 'init_method.dat'), mode='wt') as f:
+			with open(os.path.join(workDir, 'init_method.dat'), mode='wt') as f:
 				f.write("{0}{1}".format(self.kisipMethodMethod, os.linesep))
 				f.write("{0}{1}".format(self.kisipMethodSubfieldArcsec, os.linesep))
 				f.write("{0}{1}".format(self.kisipMethodPhaseRecLimit, os.linesep))
@@ -383,10 +768,10 @@ class kisipWrapper:
 			raise
 
 		self.logger.info("Writing KISIP config file: "
-				"{0}".format(os.path.join(self.workBase, 'init_props.dat'))
+				"{0}".format(os.path.join(workDir, 'init_props.dat'))
 				)
 		try:
-			with open(os.path.join(self.workBase, 'init_props.dat'), mode='wt') as f:
+			with open(os.path.join(workDir, 'init_props.dat'), mode='wt') as f:
 				f.write("{0}{1}".format(self.imageShape[1], os.linesep))
 				f.write("{0}{1}".format(self.imageShape[0], os.linesep))
 				f.write("{0}{1}".format(self.burstNumber, os.linesep))
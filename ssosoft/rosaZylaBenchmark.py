@@ -0,0 +1,654 @@
+import astropy.io.fits as fits
+import configparser
+import glob
+import json
+import numpy as np
+import os
+import resource
+import shutil
+import socket
+import time
+import tracemalloc
+from . import ssosoftConfig
+from .kisipStandIn import kisipStandIn
+from .kisipWrapper import kisipWrapper
+from .rosaZylaCal import rosaZylaCal
+from .stageMetrics import stageMetrics
+
+class rosaZylaBenchmark:
+	"""
+	Benchmarks of the ROSA and Zyla calibration stages on synthetic
+	data, to measure performance without observatory data.
+
+	-----------------------------------------------------------------
+
+	Synthetic dark, flat, and data files are generated under
+	benchBase/<instrument>: Zyla unformatted binary spool files
+	with zero-valued overscan rows and columns, or ROSA
+	multi-extension FITS files of unsigned 16-bit frames. A
+	configuration file for the run is written alongside. The files
+	are kept and reused for as long as the generation parameters
+	are unchanged.
+
+	bench_run then runs each stage on a rosaZylaCal or kisipWrapper
+	instance and times it: file discovery, shape detection and
+	checking, dark and flat averaging, gain, saving the calibration
+	images, noise cube, rosa_zyla_save_bursts, KISIP init-file
+	generation, and rosa_zyla_save_despeckled_as_fits. For the
+	last, the KISIP output of each burst is stood in for by its
+	first frame. The run does not resume from an earlier one, so
+	every stage does its full work. The calibration's own stage
+	metrics are off, as they would reset the peak RSS measured
+	here. Files are read through the page cache as left by
+	generation and earlier stages.
+
+	bench_kisip measures despeckling orchestration instead:
+	kisipWrapper runs on synthetic burst cubes with kisipStandIn in
+	place of KISIP and MPI, for several numbers of concurrent
+	batches.
+
+	Each stage gives one record, a JSON-serializable dict, with
+	wall and CPU time, frames, files, bytes of the stage's input
+	and output files, frames/s and MB/s, the peak memory allocated
+	during the stage as traced by tracemalloc, and the peak
+	resident set size of the stage, as measured by stageMetrics,
+	and of the worker processes finished so far.
+
+	-----------------------------------------------------------------
+
+	Parameters
+	----------
+	benchBase : str
+		Directory for the synthetic data and work files.
+	instrument : str
+		ZYLA, or a ROSA band, e.g. ROSA_GBAND. Default ZYLA.
+	imageShape : tuple
+		(rows, cols) of the usable image. Default (1024, 1024).
+	overscan : tuple
+		(rows, cols) of Zyla overscan added below and to the
+		right of the image. Default (8, 8). Not used for ROSA.
+	darkFrames : int
+		Number of dark frames. Default 256.
+	flatFrames : int
+		Number of flat frames. Default 256.
+	dataFrames : int
+		Number of data frames. Default 4096.
+	framesPerFile : int
+		Frames per ROSA file. Default 256. Zyla files always
+		hold one frame.
+	burstNumber : int
+		Frames per burst. Default 64.
+	configOverrides : dict
+		Optional configuration values for the instrument section,
+		e.g. {'burstWorkers' : 4}, to benchmark settings.
+	traceMemory : bool
+		Default True traces peak memory with tracemalloc. Set to
+		False to avoid its overhead.
+	seed : int
+		Seed of the synthetic pixel values. Default 0.
+
+	-----------------------------------------------------------------
+
+	Example
+	-------
+
+		b=ssosoft.rosaZylaBenchmark('/scratch/bench', 'ZYLA',
+				configOverrides={'burstWorkers' : 4})
+		for record in b.bench_run():
+			print(record['stage'], record['framesPerSecond'])
+		b.bench_save_results('bench.jsonl')
+
+	and for KISIP batch scheduling
+
+		b.bench_kisip(nBatches=8, concurrentBatches=[1, 2, 4, 8],
+				mpiNproc=8, secondsPerFrame=0.01)
+	"""
+
+	def __init__(self, benchBase, instrument='ZYLA', imageShape=(1024, 1024),
+			overscan=(8, 8), darkFrames=256, flatFrames=256, dataFrames=4096,
+			framesPerFile=256, burstNumber=64, configOverrides=None,
+			traceMemory=True, seed=0):
+		"""
+		Parameters
+		----------
+		benchBase : str
+			Directory for the synthetic data and work files.
+		instrument : str
+			ZYLA, or a ROSA band, e.g. ROSA_GBAND. Default ZYLA.
+		imageShape : tuple
+			(rows, cols) of the usable image. Default
+			(1024, 1024).
+		overscan : tuple
+			(rows, cols) of Zyla overscan. Default (8, 8).
+		darkFrames : int
+			Number of dark frames. Default 256.
+		flatFrames : int
+			Number of flat frames. Default 256.
+		dataFrames : int
+			Number of data frames. Default 4096.
+		framesPerFile : int
+			Frames per ROSA file. Default 256.
+		burstNumber : int
+			Frames per burst. Default 64.
+		configOverrides : dict
+			Optional configuration values for the instrument
+			section.
+		traceMemory : bool
+			Default True traces peak memory with tracemalloc.
+		seed : int
+			Seed of the synthetic pixel values. Default 0.
+		"""
+		self.burstNumber=int(burstNumber)
+		self.configOverrides=dict(configOverrides or {})
+		self.darkFrames=int(darkFrames)
+		self.dataFrames=int(dataFrames)
+		self.flatFrames=int(flatFrames)
+		self.framesPerFile=int(framesPerFile)
+		self.imageShape=tuple(int(n) for n in imageShape)
+		self.instrument=instrument.upper()
+		self.metrics=stageMetrics()
+		self.overscan=tuple(int(n) for n in overscan)
+		self.results=[]
+		self.seed=int(seed)
+		self.traceMemory=traceMemory
+
+		self.benchDir=os.path.join(benchBase, self.instrument)
+		self.configFile=os.path.join(self.benchDir, 'benchmark.ini')
+		self.workBase=os.path.join(self.benchDir, 'work')
+
+	def bench_generate(self):
+		"""
+		Generates the synthetic dark, flat, and data files, unless
+		files made with the same parameters are already present.
+		Frames cycle through a small pool of random frames, so
+		generation is limited by writing rather than by the random
+		number generator.
+		"""
+		params=self.bench_params()
+		paramsFile=os.path.join(self.benchDir, 'synthetic.json')
+		try:
+			with open(paramsFile, mode='r') as f:
+				if json.load(f) == params:
+					return
+		except (OSError, ValueError):
+			pass
+		rng=np.random.default_rng(self.seed)
+		for kind, nFrames, level in [('dark', self.darkFrames, 100),
+				('flat', self.flatFrames, 2000),
+				('data', self.dataFrames, 1500)
+				]:
+			kindDir=os.path.join(self.benchDir, kind)
+			shutil.rmtree(kindDir, ignore_errors=True)
+			os.makedirs(kindDir)
+			pool=rng.integers(level, level+100, size=(8,)+self.imageShape,
+					dtype=np.uint16
+					)
+			if 'ZYLA' in self.instrument:
+				spool=np.zeros((self.imageShape[0]+self.overscan[0],
+					self.imageShape[1]+self.overscan[1]
+					), dtype=np.uint16)
+				for k in range(nFrames):
+					spool[:self.imageShape[0], :self.imageShape[1]]=pool[k%len(pool)]
+					## Zyla file numbers are written least
+					## significant digit first.
+					spool.tofile(os.path.join(kindDir,
+						'{0:010d}'.format(k)[::-1]+'spool.dat'
+						))
+			if 'ROSA' in self.instrument:
+				for n, start in enumerate(range(0, nFrames, self.framesPerFile)):
+					hdul=fits.HDUList([fits.PrimaryHDU()])
+					for k in range(start, min(nFrames, start+self.framesPerFile)):
+						hdul.append(fits.ImageHDU(pool[k%len(pool)]))
+					hdul.writeto(os.path.join(kindDir,
+						'bench_{0}_{1:04d}.fit'.format(kind, n)
+						))
+		os.makedirs(self.workBase, exist_ok=True)
+		with open(paramsFile, mode='w') as f:
+			json.dump(params, f)
+
+	def bench_kisip(self, nBatches=4, burstsPerBatch=8, concurrentBatches=None,
+			mpiNproc=4, secondsPerFrame=0.0, secondsPerRank=0.0, busy=False,
+			fitsConversion=True):
+		"""
+		Measures despeckling orchestration: kisipWrapper run with
+		kisipStandIn in place of KISIP and MPI, once for each
+		number of concurrent batches.
+
+		nBatches batches of burstsPerBatch synthetic burst cubes,
+		of burstNumber frames of imageShape, are written straight
+		to preSpeckleBase with a noise file and run metadata, so no
+		raw data are needed. For each value of concurrentBatches,
+		kisip_despeckle_all_batches runs on them, converting each
+		batch to FITS as it finishes if fitsConversion is set, and
+		gives one record of stage 'kisip_despeckle'. The record
+		also has 'modelSeconds', the time the batches would take
+		under the stand-in's runtime model with no orchestration
+		overhead, and 'failedBatches'.
+
+		Parameters
+		----------
+		nBatches : int
+			Number of batches. Default 4.
+		burstsPerBatch : int
+			Bursts per batch, at most 1000. Default 8.
+		concurrentBatches : list
+			Values of kisipEnvConcurrentBatches to measure.
+			Default None measures [1, 2, 4].
+		mpiNproc : int
+			kisipEnvMpiNproc, the ranks shared by concurrent
+			batches. Default 4.
+		secondsPerFrame : float
+			Simulated KISIP time per frame. Default 0.
+		secondsPerRank : float
+			Simulated KISIP start-up time per rank. Default 0.
+		busy : bool
+			Default False. Set to True for ranks to keep a CPU
+			busy rather than sleep.
+		fitsConversion : bool
+			Default True converts each batch to FITS as it
+			finishes, as standardCalScript.py does.
+
+		Returns
+		-------
+		list
+			One record per value of concurrentBatches, see
+			bench_stage. Also appended to the results attribute.
+		"""
+		if concurrentBatches is None:
+			concurrentBatches=[1, 2, 4]
+		binDir=kisipStandIn(secondsPerFrame, secondsPerRank, busy).stand_in_install(
+				os.path.join(self.benchDir, 'kisipStandIn')
+				)
+		for kind in ['dark', 'flat', 'data']:
+			os.makedirs(os.path.join(self.benchDir, kind), exist_ok=True)
+		self.bench_write_config()
+		r=rosaZylaCal(self.instrument, self.configFile)
+		r.rosa_zyla_configure_run()
+		shutil.rmtree(r.preSpeckleBase)
+		os.mkdir(r.preSpeckleBase)
+		if os.path.exists(r.metadataFile):
+			os.remove(r.metadataFile)
+		r.imageShape=self.imageShape
+		r.batchList=list(range(nBatches))
+
+		burstCube=np.random.default_rng(self.seed).random(
+				(self.burstNumber,)+self.imageShape, dtype=np.float32
+				)
+		metadata=r.rosa_zyla_get_metadata()
+		burstFiles=[]
+		for batch in r.batchList:
+			for index in range(burstsPerBatch):
+				burstFiles.append(os.path.join(r.preSpeckleBase,
+					r.burstFileForm.format(r.obsDate, r.obsTime, batch, index)
+					))
+				burstCube.tofile(burstFiles[-1])
+				metadata.metadata_put(batch, index, 1000*batch+index,
+						burstFiles[-1], ''
+						)
+		metadata.metadata_commit()
+		np.zeros_like(burstCube).tofile(os.path.join(r.preSpeckleBase, r.noiseFile))
+
+		records=[]
+		for nConcurrent in concurrentBatches:
+			self.bench_write_config(kisipEnv={
+				'kisipEnvBin' : binDir,
+				'kisipEnvMpiNproc' : mpiNproc,
+				'kisipEnvConcurrentBatches' : nConcurrent
+				})
+			for dirBase in [r.speckleBase, r.postSpeckleBase]:
+				shutil.rmtree(dirBase)
+				os.mkdir(dirBase)
+			r.dirIndices={}
+			k=kisipWrapper(r)
+			## Ranks per batch and the batch runtime, as
+			## kisip_despeckle_all_batches and kisipStandIn give them.
+			nRunning=max(1, min(nConcurrent, nBatches))
+			nProc=mpiNproc if nRunning == 1 else max(1, mpiNproc//nRunning)
+			batchSeconds=(secondsPerRank*nProc
+					+secondsPerFrame*self.burstNumber*-(-burstsPerBatch//nProc)
+					)
+			returnCodes={}
+			record=self.bench_stage('kisip_despeckle',
+					lambda: returnCodes.update(k.kisip_despeckle_all_batches(
+						batchCallback=r.rosa_zyla_save_despeckled_as_fits
+						if fitsConversion else None
+						)),
+					frames=len(burstFiles)*self.burstNumber,
+					files=len(burstFiles),
+					inputs=burstFiles,
+					outputs=lambda: glob.glob(os.path.join(r.speckleBase, '*.final'))
+						+glob.glob(os.path.join(r.postSpeckleBase, '*')),
+					concurrentBatches=nConcurrent,
+					mpiNproc=mpiNproc,
+					nBatches=nBatches,
+					burstsPerBatch=burstsPerBatch,
+					secondsPerFrame=secondsPerFrame,
+					secondsPerRank=secondsPerRank,
+					busy=busy,
+					fitsConversion=fitsConversion,
+					modelSeconds=-(-nBatches//nRunning)*batchSeconds
+					)
+			record['failedBatches']=[batch for batch, returnCode in returnCodes.items()
+					if returnCode != 0
+					]
+			records.append(record)
+		r.rosa_zyla_get_metadata().metadata_close()
+		return records
+
+	def bench_params(self):
+		"""
+		Returns the parameters of the synthetic data.
+
+		Returns
+		-------
+		dict
+		"""
+		return {
+			'instrument' : self.instrument,
+			'imageShape' : list(self.imageShape),
+			'overscan' : list(self.overscan) if 'ZYLA' in self.instrument else [0, 0],
+			'darkFrames' : self.darkFrames,
+			'flatFrames' : self.flatFrames,
+			'dataFrames' : self.dataFrames,
+			'framesPerFile' : 1 if 'ZYLA' in self.instrument else self.framesPerFile,
+			'seed' : self.seed
+			}
+
+	def bench_run(self):
+		"""
+		Generates the synthetic data if needed, writes the
+		configuration file, and runs and measures every stage.
+
+		Returns
+		-------
+		list
+			One record per stage, see bench_stage. Also kept in
+			the results attribute.
+		"""
+		self.bench_generate()
+		self.bench_write_config()
+		r=rosaZylaCal(self.instrument, self.configFile)
+		r.rosa_zyla_configure_run()
+		for dirBase in [r.preSpeckleBase, r.speckleBase, r.postSpeckleBase]:
+			shutil.rmtree(dirBase)
+			os.mkdir(dirBase)
+		for file in [r.metadataFile, r.darkFile, r.flatFile, r.gainFile, r.noiseFileFits]:
+			if os.path.exists(file):
+				os.remove(file)
+		nFiles={kind : len(os.listdir(os.path.join(self.benchDir, kind)))
+				for kind in ['dark', 'flat', 'data']
+				}
+		nBursts=self.dataFrames//self.burstNumber
+
+		def bench_file_lists():
+			r.rosa_zyla_get_file_lists()
+			r.rosa_zyla_order_files()
+
+		def bench_average(kind):
+			image=r.rosa_zyla_average_image_from_list(getattr(r, kind+'List'))
+			setattr(r, 'avgDark' if kind == 'dark' else 'avgFlat', image)
+
+
+		def bench_save_bursts():
+			r.rosa_zyla_open_manifest()
+			r.rosa_zyla_save_bursts()
+
+		def bench_kisip_init_files():
+			for batch in r.batchList:
+				workDir=k.kisip_batch_work_dir(batch)
+				os.makedirs(workDir, exist_ok=True)
+				k.kisip_set_batch_start_end_inds(batch)
+				k.kisip_write_init_files(workDir)
+
+		self.results=[]
+		self.bench_stage('file_lists', bench_file_lists,
+				frames=self.darkFrames+self.flatFrames+self.dataFrames,
+				files=sum(nFiles.values())
+				)
+		self.bench_stage('detect_shapes',
+				lambda: r.rosa_zyla_get_data_image_shapes(r.flatList[0]),
+				frames=1, files=1
+				)
+		self.bench_stage('check_shapes', r.rosa_zyla_check_dark_data_flat_shapes,
+				frames=self.darkFrames+self.flatFrames+self.dataFrames,
+				files=sum(nFiles.values())
+				)
+		self.bench_stage('average_dark', lambda: bench_average('dark'),
+				frames=self.darkFrames, files=nFiles['dark'], inputs=r.darkList
+				)
+		self.bench_stage('average_flat', lambda: bench_average('flat'),
+				frames=self.flatFrames, files=nFiles['flat'], inputs=r.flatList
+				)
+		self.bench_stage('gain', r.rosa_zyla_compute_gain, frames=1)
+		r.rosa_zyla_get_cal_keys()
+		self.bench_stage('save_cal_images', r.rosa_zyla_save_cal_images,
+				frames=3,
+				outputs=lambda: [r.darkFile, r.flatFile, r.gainFile]
+				)
+		self.bench_stage('noise', r.rosa_zyla_compute_noise_file, frames=self.burstNumber,
+				outputs=lambda: [os.path.join(r.preSpeckleBase, r.noiseFile),
+					r.noiseFileFits
+					]
+				)
+		self.bench_stage('save_bursts', bench_save_bursts,
+				frames=nBursts*self.burstNumber, files=nFiles['data'],
+				inputs=r.dataList,
+				outputs=lambda: [burstEntry['file']
+					for burstEntry in r.rosa_zyla_plan_bursts()
+					]
+				)
+
+		k=kisipWrapper(r)
+		k.kisip_configure_run()
+		self.bench_stage('kisip_init_files', bench_kisip_init_files,
+				frames=nBursts, files=3*len(r.batchList)
+				)
+
+		## Stand in for KISIP: the first frame of each burst.
+		frameCount=self.imageShape[0]*self.imageShape[1]
+		for burstEntry in r.rosa_zyla_plan_bursts():
+			np.fromfile(burstEntry['file'], dtype=np.float32,
+					count=frameCount
+					).tofile(os.path.join(r.speckleBase,
+						r.speckledFileForm.format(r.obsDate, r.obsTime,
+							burstEntry['batch'], burstEntry['index']
+							)+'.final'
+						))
+		self.bench_stage('save_despeckled_as_fits', r.rosa_zyla_save_despeckled_as_fits,
+				frames=nBursts, files=nBursts,
+				inputs=glob.glob(os.path.join(r.speckleBase, '*.final')),
+				outputs=lambda: glob.glob(os.path.join(r.postSpeckleBase, '*'))
+				)
+		r.rosa_zyla_get_metadata().metadata_close()
+		return self.results
+
+	def bench_save_results(self, resultsFile, results=None):
+		"""
+		Appends records to a JSON lines file, one record per line,
+		for regression tracking.
+
+		Parameters
+		----------
+		resultsFile : str
+			Path to the results file.
+		results : list
+			Records to save. Default None saves the results of
+			the last bench_run.
+		"""
+		if results is None:
+			results=self.results
+		with open(resultsFile, mode='a') as f:
+			for record in results:
+				f.write(json.dumps(record)+"\n")
+
+	def bench_stage(self, stage, function, frames=0, files=0, inputs=None, outputs=None,
+			**fields):
+		"""
+		Runs and measures one stage, and appends its record to the
+		results attribute.
+
+		Parameters
+		----------
+		stage : str
+			Name of the stage.
+		function : callable
+			Function running the stage, called without
+			arguments.
+		frames : int
+			Number of frames the stage processes.
+		files : int
+			Number of files the stage processes.
+		inputs : list
+			Optional paths to the files the stage reads in full.
+		outputs : callable
+			Optional function returning the paths to the files
+			the stage wrote, called once it is done.
+		**fields
+			Further fields of the record, e.g. settings of the
+			stage.
+
+		Returns
+		-------
+		dict
+			Keys 'stage', 'seconds', 'cpuSeconds', 'frames',
+			'files', 'bytesRead', 'bytesWritten',
+			'framesPerSecond', 'readMBPerSecond',
+			'writeMBPerSecond', 'peakTracedMB', 'peakRssMB',
+			'peakRssScope', 'childPeakRssMB', and the benchmark
+			parameters, version, host, and time. peakTracedMB is
+			None if traceMemory is False.
+		"""
+		if inputs is None:
+			inputs=[]
+		bytesRead=sum(os.path.getsize(file) for file in inputs)
+		stagePeak=self.metrics.metrics_reset_peak_rss()
+		peakTraced=None
+		if self.traceMemory:
+			tracemalloc.start()
+		cpu0=time.process_time()
+		t0=time.perf_counter()
+		try:
+			function()
+		finally:
+			seconds=time.perf_counter()-t0
+			cpuSeconds=time.process_time()-cpu0
+			if self.traceMemory:
+				peakTraced=tracemalloc.get_traced_memory()[1]
+				tracemalloc.stop()
+		bytesWritten=0
+		if outputs is not None:
+			bytesWritten=sum(os.path.getsize(file) for file in outputs()
+					if os.path.exists(file)
+					)
+		record={
+			'stage' : stage,
+			'seconds' : seconds,
+			'cpuSeconds' : cpuSeconds,
+			'frames' : frames,
+			'files' : files,
+			'bytesRead' : bytesRead,
+			'bytesWritten' : bytesWritten,
+			'framesPerSecond' : frames/seconds if seconds > 0 else None,
+			'readMBPerSecond' : bytesRead/2**20/seconds if seconds > 0 else None,
+			'writeMBPerSecond' : bytesWritten/2**20/seconds if seconds > 0 else None,
+			'peakTracedMB' : peakTraced/2**20 if peakTraced is not None else None,
+			'peakRssMB' : self.metrics.metrics_peak_rss()/2**20,
+			'peakRssScope' : 'stage' if stagePeak else 'process',
+			## ru_maxrss is in kilobytes on Linux.
+			'childPeakRssMB' : resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss/1024,
+			'params' : self.bench_params(),
+			'burstNumber' : self.burstNumber,
+			'configOverrides' : self.configOverrides,
+			'version' : ssosoftConfig.__version__,
+			'host' : socket.gethostname(),
+			'time' : time.strftime('%Y-%m-%dT%H:%M:%S')
+			}
+		record.update(fields)
+		self.results.append(record)
+		return record
+
+	def bench_write_config(self, kisipEnv=None):
+		"""
+		Writes the configuration file of the benchmark run, with
+		configOverrides applied to the instrument section.
+
+		Parameters
+		----------
+		kisipEnv : dict
+			Optional values for the KISIP_ENV section.
+		"""
+		if 'ZYLA' in self.instrument:
+			filePattern='*spool.dat'
+		if 'ROSA' in self.instrument:
+			filePattern='*.fit'
+		config=configparser.ConfigParser(interpolation=None)
+		config.optionxform=str
+		config[self.instrument]={
+			'darkBase' : os.path.join(self.benchDir, 'dark'),
+			'dataBase' : os.path.join(self.benchDir, 'data'),
+			'flatBase' : os.path.join(self.benchDir, 'flat'),
+			'workBase' : self.workBase,
+			'burstNumber' : str(self.burstNumber),
+			'burstFileForm' : '{:s}_{:s}_bench_kisip.raw.batch.{:02d}.{:03d}',
+			'obsDate' : '20240101',
+			'obsTime' : '120000',
+			'expTimems' : '10',
+			'speckledFileForm' : '{:s}_{:s}_bench_kisip.speckle.batch.{:02d}.{:03d}',
+			'darkFilePattern' : filePattern,
+			'dataFilePattern' : filePattern,
+			'flatFilePattern' : filePattern,
+			'noiseFile' : 'kisip.bench.noise',
+			'wavelengthnm' : '656.3',
+			'kisipArcsecPerPixX' : '0.109',
+			'kisipArcsecPerPixY' : '0.109',
+			'kisipMethodSubfieldArcsec' : '12',
+			'resumeRun' : 'False',
+			'recordMetrics' : 'False'
+			}
+		for key, value in self.configOverrides.items():
+			config[self.instrument][key]=str(value)
+		config['KISIP_METHOD']={
+			'kisipMethodMethod' : '1',
+			'kisipMethodPhaseRecLimit' : '95',
+			'kisipMethodUX' : '10',
+			'kisipMethodUV' : '10',
+			'kisipMethodMaxIter' : '30',
+			'kisipMethodSNThresh' : '80',
+			'kisipMethodWeightExp' : '1.2',
+			'kisipMethodPhaseRecApod' : '15',
+			'kisipMethodNoiseFilter' : '1'
+			}
+		config['KISIP_PROPS']={
+			'kisipPropsHeaderOff' : '0',
+			'kisipPropsTelescopeDiamm' : '760',
+			'kisipPropsAoLockX' : '-1',
+			'kisipPropsAoLockY' : '-1',
+			'kisipPropsAoUsed' : '1'
+			}
+		config['KISIP_ENV']={
+			'kisipEnvBin' : '',
+			'kisipEnvLib' : '',
+			'kisipEnvMpiNproc' : '1',
+			'kisipEnvMpirun' : 'mpirun',
+			'kisipEnvKisipExe' : 'entry',
+			'kisipEnvConcurrentBatches' : '1'
+			}
+		for key, value in (kisipEnv or {}).items():
+			config['KISIP_ENV'][key]=str(value)
+		config['loggers']={'keys' : 'root'}
+		config['handlers']={'keys' : 'benchHand'}
+		config['formatters']={'keys' : 'benchForm'}
+		config['logger_root']={'level' : 'INFO', 'handlers' : 'benchHand'}
+		config['handler_benchHand']={
+			'class' : 'FileHandler',
+			'level' : 'INFO',
+			'formatter' : 'benchForm',
+			'args' : "('%(logfilename)s', 'a')"
+			}
+		config['formatter_benchForm']={
+			'format' : '%(asctime)s %(name)s %(levelname)s %(funcName)s %(message)s',
+			'datefmt' : ''
+			}
+		os.makedirs(self.workBase, exist_ok=True)
+		with open(self.configFile, mode='w') as f:
+			config.write(f)
@@ -3,13 +3,64 @@ from astropy.time import Time
 from astropy.time import TimeDelta
 from datetime import datetime
 import configparser
+import contextlib
+import concurrent.futures
+import copy
 import glob
+import itertools
+import json
 import logging, logging.config
 import matplotlib.pyplot as plt
+from multiprocessing import shared_memory
+import multiprocessing
 import numpy as np
 import os
 import re
+import shutil
+import socket
 import sys
+import time
+from .burstQueue import burstQueue
+from .burstWriter import burstWriter
+from .calStore import calStore
+from .dirIndex import dirIndex
+from .fitsIndex import fitsIndex
+from .framePrefetcher import framePrefetcher
+from .runMetadata import runMetadata
+from .runManifest import runManifest, manifest_file_stats, manifest_fingerprint
+from .stageMetrics import stageMetrics
+
+## Per-process state for pool workers, see _rosa_zyla_pool_init.
+_poolCal=None
+_poolShm=[]
+
+def _rosa_zyla_pool_init(cal, sharedArrays):
+	"""
+	Pool initializer. Attaches the shared-memory calibration images
+	to a worker's copy of the rosaZylaCal instance.
+
+	Parameters
+	----------
+	cal : rosaZylaCal class instance
+		Copy of the calling instance, without calibration images.
+	sharedArrays : dict
+		Maps attribute names to (shared memory name, shape, dtype).
+	"""
+	global _poolCal
+	for name, (shmName, shape, dtype) in sharedArrays.items():
+		shm=shared_memory.SharedMemory(name=shmName)
+		_poolShm.append(shm)
+		setattr(cal, name, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+	_poolCal=cal
+
+def _rosa_zyla_pool_call(task):
+	"""
+	Runs one pool task, a (method name, arguments...) tuple, on the
+	worker's rosaZylaCal instance, holding a shared CPU slot in a
+	multi-channel run.
+	"""
+	with _poolCal.rosa_zyla_shared_slot('cpu'):
+		return getattr(_poolCal, task[0])(*task[1:])
 
 class rosaZylaCal:
 
@@ -109,77 +160,151 @@ class rosaZylaCal:
 			print("Exception: {0}".format(err))
 			raise
 		
+		self.averageWorkers=1
 		self.avgDark=None
 		self.avgFlat=None
 		self.batchList=[]
+		self.burstCube=None
 		self.burstNumber=0
+		self.burstWorkerName=""
+		self.burstWorkers=1
+		self.burstWriteBuffers=2
+		self.checkWorkers=8
+		self.computeNoise=False
+		self.calCompression="none"
+		self.calKeys={}
+		self.calStore=None
+		self.calQuantizeLevel=16
+		self.calStoreBase=""
 		self.configFile=configFile
 		self.darkBase=""
 		self.darkList=[""]
 		self.dataBase=""
 		self.dataList=[""]
 		self.dataShape=None
+		self.dirIndices={}
+		self.distributedBursts=False
 		self.darkFilePattern=""
 		self.dataFilePattern=""
 		self.flatFilePattern=""
 		self.flatBase=""
 		self.flatList=[""]
+		self.flatfieldDark=None
+		self.flatfieldGain=None
+		self.fitsIndexBase=""
+		self.fitsIndices={}
+		self.fitsWorkers=1
+		self.followIdleTimeout=1800
+		self.followInterval=5
+		self.followSettle=30
+		self.followStopFile=""
 		self.gain=None
 		self.imageShape=None
 		self.instrument=instrument.upper()
 		self.logFile=""
+		self.manifest=None
+		self.manifestFile=""
+		self.metadata=None
+		self.metadataFile=""
+		self.metrics=stageMetrics()
+		self.metricsFile=""
+		self.metricsPromFile=""
 		self.noise=None
 		self.noiseFile=""
 		self.obsDate=""
 		self.obsTime=""
 		self.expTimems=""
+		self.postSpeckleCompression="none"
+		self.postSpeckleCube="none"
+		self.postSpeckleQuantizeLevel=16
+		self.prefetchDepth=0
+		self.prefetchMaxMB=1024
+		self.prefetchThreads=4
         
 		self.preSpeckleBase=""
+		self.qualityCandidates=0
+		self.qualityCube=None
+		self.qualityMetric="sharpness"
+		self.qualityMetrics=True
+		self.qualityStride=4
+		self.qualityThreshold=0.0
+		self.queueBurstsPerTask=16
+		self.queueClaimTimeout=600
+		self.queueDir=""
+		self.queuePollInterval=5
+		self.queueWaitTimeout=3600
+		self.recordMetrics=True
+		self.resumeRun=True
+		self.sharedSlots={}
+		self.useDirIndex=True
+		self.useFitsIndex=True
 		self.workBase=""
+		self.zylaGeometryFile=""
 
-	def rosa_zyla_average_image_from_list(self, fileList):
+	def rosa_zyla_average_image_from_list(self, fileList, averageWorkers=None):
 		"""
 		Computes an average image from a list of image files.
+		Frames are summed in double precision. With more than one
+		worker, the list is split into contiguous chunks that are
+		summed on a process pool, and the partial sums are merged
+		pairwise.
 
 		Parameters
 		----------
 		fileList : list
 			A list of file paths to the images to be averaged.
+		averageWorkers : int
+			Number of worker processes. Default None uses the
+			averageWorkers configuration value.
 
 		Returns
 		-------
 		numpy.ndarray
 			2-Dimensional with dtype np.float32.
 		"""
-		def rosa_zyla_print_average_image_progress():
-			if not fNum % 100:
-				self.logger.info("Progress: "
-						"{:0.1%}.".format(fNum/numImg)
-						)
-
+		if averageWorkers is None:
+			averageWorkers=self.averageWorkers
 		self.logger.info("Computing average image from {0} files "
 				"in directory: {1}".format(
 					len(fileList), os.path.dirname(fileList[0])
 					)
 				)
-		avgIm=np.zeros(self.imageShape, dtype=np.float32)
-		fNum=0
-		for file in fileList:
-			if 'ZYLA' in self.instrument:
-				if fNum == 0:
-					numImg=len(fileList)
-				avgIm=avgIm+self.rosa_zyla_read_binary_image(file)
-				fNum+=1
-				rosa_zyla_print_average_image_progress()
-			if 'ROSA' in self.instrument:
-				with fits.open(file) as hdu:
-					if fNum == 0:
-						numImg=len(fileList)*len(hdu[1:])
-					for ext in hdu[1:]:
-						avgIm=avgIm+ext.data
-						fNum+=1
-						rosa_zyla_print_average_image_progress()
-		avgIm=avgIm/fNum
+		if 'ZYLA' in self.instrument:
+			numImg=len(fileList)
+		if 'ROSA' in self.instrument:
+			numImg=len(fileList)*self.rosa_zyla_count_extensions(fileList[0])
+		averageWorkers=min(averageWorkers, len(fileList))
+		if averageWorkers > 1:
+			self.logger.info("Summing images with {0} worker "
+					"processes.".format(averageWorkers)
+					)
+			nChunk=min(len(fileList), 4*averageWorkers)
+			chunks=[fileList[i*len(fileList)//nChunk:(i+1)*len(fileList)//nChunk]
+					for i in range(nChunk)
+					]
+			with self.rosa_zyla_worker_pool(averageWorkers) as pool:
+				partials=pool.map(_rosa_zyla_pool_call,
+						[('rosa_zyla_sum_image_from_list', chunk)
+							for chunk in chunks],
+						1
+						)
+			## Tree reduction: merge neighbouring partial sums
+			## in place until one remains.
+			while len(partials) > 1:
+				merged=[]
+				for i in range(0, len(partials)-1, 2):
+					(sumA, nA), (sumB, nB)=partials[i], partials[i+1]
+					sumA+=sumB
+					merged.append((sumA, nA+nB))
+				if len(partials)%2:
+					merged.append(partials[-1])
+				partials=merged
+			sumIm, fNum=partials[0]
+		else:
+			sumIm, fNum=self.rosa_zyla_sum_image_from_list(fileList,
+					numImg=numImg
+					)
+		avgIm=np.float32(sumIm/fNum)
 
 		self.logger.info("Images averaged/images predicted: "
 				"{0}/{1}".format(fNum,numImg)
@@ -198,12 +323,374 @@ class rosaZylaCal:
 				)
 		return avgIm
 
-	def rosa_zyla_check_dark_data_flat_shapes(self):
+	def rosa_zyla_benchmark_compression(self, image=None, settings=None):
+		"""
+		Measures the bytes written and the time spent for FITS tile
+		compression settings, to help choose calCompression and
+		postSpeckleCompression. Each setting is written to a
+		temporary file in workBase, read back, and removed.
+
+		Parameters
+		----------
+		image : numpy.ndarray
+			Image to compress. Default None uses the average
+			flat.
+		settings : list
+			(compression, quantizeLevel) tuples to try. Default
+			None tries no compression, lossless GZIP, and RICE
+			and HCOMPRESS at quantize level 16.
+
+		Returns
+		-------
+		list
+			One dict per setting with keys 'compression',
+			'quantizeLevel', 'bytes', 'ratio', 'writeSeconds',
+			'readSeconds', and 'maxError', the largest absolute
+			difference from the original image.
+
+		Example
+		-------
+
+			r=ssosoft.rosaZylaCal('zyla', 'config.ini')
+			r.rosa_zyla_run_calibration(saveBursts=False)
+			for result in r.rosa_zyla_benchmark_compression():
+				print(result)
+		"""
+		if image is None:
+			image=self.avgFlat
+		if settings is None:
+			settings=[('none', 16), ('GZIP_2', 0), ('RICE_1', 16),
+					('HCOMPRESS_1', 16)
+					]
+		image=np.asarray(image, dtype=np.float32)
+		file=os.path.join(self.workBase,
+				'compression_benchmark.{0}.fits'.format(os.getpid())
+				)
+		results=[]
+		try:
+			for compression, quantizeLevel in settings:
+				## rosa_zyla_save_fits_image logs failed writes and
+				## continues; measure only a file this setting wrote.
+				if os.path.exists(file):
+					os.remove(file)
+				t0=time.perf_counter()
+				self.rosa_zyla_save_fits_image(image, file,
+						compression=compression,
+						quantizeLevel=quantizeLevel
+						)
+				t1=time.perf_counter()
+				if not os.path.exists(file):
+					self.logger.critical("Fatal: compression benchmark: could not "
+							"write {0} q={1}: {2}".format(compression,
+								quantizeLevel, file
+								)
+							)
+					raise OSError("Compression benchmark: could not write {0} "
+							"q={1}: {2}".format(compression, quantizeLevel, file)
+							)
+				readImage=np.array(self.rosa_zyla_read_fits_image(file))
+				t2=time.perf_counter()
+				results.append({
+					'compression' : compression,
+					'quantizeLevel' : quantizeLevel,
+					'bytes' : os.path.getsize(file),
+					'ratio' : image.nbytes/os.path.getsize(file),
+					'writeSeconds' : t1-t0,
+					'readSeconds' : t2-t1,
+					'maxError' : float(np.max(np.abs(readImage-image)))
+					})
+				self.logger.info("Compression benchmark: {compression} "
+						"q={quantizeLevel}: {bytes} bytes, ratio "
+						"{ratio:0.2f}, write {writeSeconds:0.4f} s, read "
+						"{readSeconds:0.4f} s, max error "
+						"{maxError:0.4g}".format(**results[-1])
+						)
+		finally:
+			if os.path.exists(file):
+				os.remove(file)
+		return results
+
+	def rosa_zyla_burst_done(self, burstEntry):
+		"""
+		Checks the run manifest for a burst saved by an earlier,
+		interrupted run.
+
+		Parameters
+		----------
+		burstEntry : dict
+			One entry of the burst plan produced by
+			rosa_zyla_plan_bursts.
+
+		Returns
+		-------
+		bool
+			True if the burst is complete and need not be
+			saved again.
+		"""
+		if self.manifest is None:
+			return False
+		return (self.manifest.manifest_is_done('burst', burstEntry['file'])
+				and self.rosa_zyla_get_metadata().metadata_get(
+					burstEntry['batch'], burstEntry['index']
+					) is not None
+				)
+
+	def rosa_zyla_burst_worker(self):
+		"""
+		Joins a distributed burst run of this instrument and
+		configuration file, started elsewhere with distributedBursts
+		set, and builds bursts from its work queue until every task
+		is done. Any number of workers may run, on any nodes that
+		mount workBase at the same path. Each writes its own log and
+		metrics files, named with its host and process ID. The
+		bursts are recorded in the run metadata and manifest by the
+		coordinating run. A worker that finds the queue of a
+		finished run, and no run being prepared, returns at once.
+
+		Returns
+		-------
+		int
+			Number of tasks done by this worker.
+
+		Example
+		-------
+
+			r=ssosoft.rosaZylaCal('zyla', 'config.ini')
+			r.rosa_zyla_burst_worker()
+		"""
+		self.burstWorkerName='{0}.{1}'.format(socket.gethostname(), os.getpid())
+		self.rosa_zyla_configure_run()
+		queue=self.rosa_zyla_open_burst_queue()
+		self.logger.info("Burst worker {0}: waiting up to {1} s for the burst "
+				"queue: {2}".format(self.burstWorkerName, self.queueWaitTimeout,
+					self.queueDir
+					)
+				)
+		if not queue.queue_wait(self.queueWaitTimeout, self.queuePollInterval):
+			self.logger.critical("Fatal: no burst queue published in: "
+					"{0}".format(self.queueDir)
+					)
+			raise TimeoutError("No burst queue published in: {0}".format(self.queueDir))
+		if queue.queue_finished():
+			self.logger.info("Burst worker {0}: burst queue already finished: "
+					"{1}".format(self.burstWorkerName, queue.runDir)
+					)
+			return 0
+		setup=queue.plan['setup']
+		self.dataShape=tuple(setup['dataShape'])
+		self.imageShape=tuple(setup['imageShape'])
+		self.flatfieldDark=np.load(setup['flatfieldDark'])
+		self.flatfieldGain=np.load(setup['flatfieldGain'])
+		nTasks=0
+		while not queue.queue_finished():
+			claim=queue.queue_claim()
+			if claim is None:
+				queue.queue_recover()
+				time.sleep(self.queuePollInterval)
+				continue
+			self.rosa_zyla_work_burst_task(queue, *claim)
+			nTasks+=1
+		self.logger.info("Burst worker {0}: burst queue finished, {1} tasks done "
+				"by this worker.".format(self.burstWorkerName, nTasks)
+				)
+		return nTasks
+
+	def rosa_zyla_build_burst(self, burstEntry, burstCube, fileFrames=None):
+		"""
+		Flat-fields the frames of a single burst into a burst cube
+		and prepares the burst's header text.
+
+		Parameters
+		----------
+		burstEntry : dict
+			One entry of the burst plan produced by
+			rosa_zyla_plan_bursts.
+		burstCube : numpy.ndarray
+			np.float32 buffer of shape (burstNumber,)+imageShape.
+			Every slot is overwritten, so it need not be cleared.
+		fileFrames : callable
+			Optional function returning the list of frames in a
+			file, e.g. framePrefetcher.prefetch_get. Default None
+			uses rosa_zyla_load_file_frames.
+
+		Returns
+		-------
+		tuple
+			(headerText, timestamp, quality): the burst's header
+			text, its timestamp, or None if the header holds
+			none, and the quality of its candidate frames, from
+			rosa_zyla_quality_rows, or None if qualityMetrics is
+			off, for the run metadata store.
+		"""
+		if fileFrames is None:
+			fileFrames=self.rosa_zyla_load_file_frames
+		## With frame selection, the candidates are flat-fielded into
+		## a scratch cube and the best burstNumber copied to burstCube.
+		selecting=len(burstEntry['frames']) > self.burstNumber
+		buildCube=burstCube
+		if selecting:
+			candidateShape=(len(burstEntry['frames']),)+burstCube.shape[1:]
+			if self.qualityCube is None or self.qualityCube.shape != candidateShape:
+				self.qualityCube=np.empty(candidateShape, dtype=np.float32)
+			buildCube=self.qualityCube
+		## A burst spans at most a few files, load each once.
+		i=0
+		for file in dict.fromkeys(f for f, ext in burstEntry['frames']):
+			frames=fileFrames(file)
+			for f, ext in burstEntry['frames']:
+				if f == file:
+					## Zyla files hold one frame, ext is None.
+					self.rosa_zyla_flatfield_frame(frames[(ext or 1)-1],
+							buildCube[i, :, :]
+							)
+					i+=1
+		quality=None
+		if self.qualityMetrics or selecting:
+			frameQuality=self.rosa_zyla_frame_quality(buildCube)
+			keep=range(len(burstEntry['frames']))
+			if selecting:
+				keep=self.rosa_zyla_select_frames(frameQuality, burstEntry)
+				np.take(buildCube, keep, axis=0, out=burstCube)
+			quality=self.rosa_zyla_quality_rows(burstEntry, frameQuality, keep)
+		if 'ZYLA' in self.instrument:
+			## The burst starts burst*frames per burst frames into
+			## the run.
+			burstFrames=len(burstEntry['frames'])
+			timestamp=self.zyla_time(burstEntry['burst'] if burstFrames == self.burstNumber
+					else burstEntry['burst']*burstFrames/self.burstNumber
+					).fits
+			headerText=('DATE    ='
+					+timestamp
+					+"\n"
+					+'EXPOSURE='+self.expTimems
+					)
+		if 'ROSA' in self.instrument:
+			headerFile, headerExt=burstEntry['header']
+			index=self.rosa_zyla_file_index(headerFile)
+			if index is not None:
+				header=index.index_header(headerExt)
+				primaryHeader=index.index_header(0)
+			else:
+				with fits.open(headerFile) as hdu:
+					header=hdu[headerExt].header
+					primaryHeader=hdu[0].header
+			timestamp=header.get('DATE-OBS', header.get('DATE'))
+			if timestamp is not None:
+				timestamp=str(timestamp)
+			headerText=(repr(header)+"\n"
+					+"\n"
+					+repr(primaryHeader)
+					)
+		return headerText, timestamp, quality
+
+	def rosa_zyla_check_dark_data_flat_shapes(self, checkWorkers=None):
+		"""
+		Checks that every dark, data, and flat file matches the
+		detected data shape, without reading any pixels. Zyla files
+		are checked by size, from os.stat. For ROSA files, the shape
+		of every extension is checked, from the FITS headers, and
+		the file must hold all of the extension data. Files are
+		checked on a pool of threads. Run before any averaging, so
+		that a truncated or foreign file stops the run at once.
+
+		Parameters
+		----------
+		checkWorkers : int
+			Number of threads. Default None uses the
+			checkWorkers configuration value.
+		"""
+		if checkWorkers is None:
+			checkWorkers=self.checkWorkers
+		fileList=self.darkList+self.flatList+self.dataList
+		self.logger.info("Checking shapes of {0} dark, flat, and data "
+				"files.".format(len(fileList))
+				)
+		def rosa_zyla_check_file_shape_slot(file):
+			with self.rosa_zyla_shared_slot('io'):
+				return self.rosa_zyla_check_file_shape(file)
+
+		with concurrent.futures.ThreadPoolExecutor(max(1, checkWorkers)) as pool:
+			problems=[problem for problem in pool.map(rosa_zyla_check_file_shape_slot, fileList)
+					if problem is not None
+					]
+		try:
+			assert(len(problems) == 0), (
+					"{0} files do not match the detected data shape, "
+					"first: {1}".format(len(problems), problems[0])
+					)
+		except AssertionError as err:
+			for problem in problems:
+				self.logger.critical("Bad file: {0}".format(problem))
+			self.logger.critical("Fatal: {0}".format(err))
+			raise
+		else:
+			self.logger.info("All files match the detected data shape.")
+
+	def rosa_zyla_check_file_shape(self, file):
+		"""
+		Checks that one dark, data, or flat file matches the
+		detected data shape, without reading any pixels.
+
+		Parameters
+		----------
+		file : str
+			Path to image file.
+
+		Returns
+		-------
+		str or None
+			Description of the problem, or None if the file
+			matches.
+		"""
+		try:
+			if 'ZYLA' in self.instrument:
+				expectedSize=int(self.dataShape[0])*int(self.dataShape[1])*np.dtype(np.uint16).itemsize
+				fileSize=os.stat(file).st_size
+				if fileSize != expectedSize:
+					return "{0}: size {1} bytes, expected {2}".format(
+							file, fileSize, expectedSize
+							)
+			if 'ROSA' in self.instrument:
+				if self.useFitsIndex:
+					## Unlike rosa_zyla_file_index, treat a file
+					## that cannot be indexed as bad.
+					index=self.rosa_zyla_fits_index(file)
+					if not index.index_complete():
+						return "{0}: truncated".format(file)
+					shapes=index.index_shapes()
+				else:
+					with fits.open(file) as hdu:
+						shapes=[(ext.header['NAXIS2'], ext.header['NAXIS1'])
+								for ext in hdu[1:]
+								]
+				for ext, shape in enumerate(shapes, 1):
+					if tuple(shape) != tuple(self.imageShape):
+						return ("{0}: extension {1} has shape {2}, "
+								"expected {3}".format(
+									file, ext, tuple(shape),
+									tuple(self.imageShape)
+									)
+								)
+		except Exception as err:
+			return "{0}: {1}".format(file, err)
+		return None
+
+	def rosa_zyla_complete_batch(self, batch, batchCallback=None):
 		"""
-		Checks dark, data, and flat frame sizes are all the same.
-		NOT YET IMPLEMENTED.
+		Marks a batch of bursts complete: commits its metadata and
+		calls batchCallback.
+
+		Parameters
+		----------
+		batch : int
+			Batch number.
+		batchCallback : callable
+			Optional function called with the batch number.
 		"""
-		pass
+		self.logger.info("Batch {0} complete.".format(batch))
+		self.rosa_zyla_get_metadata().metadata_commit()
+		if batchCallback is not None:
+			batchCallback(batch)
 
 	def rosa_zyla_compute_gain(self):
 		"""
@@ -222,35 +709,111 @@ class rosaZylaCal:
 
 	def rosa_zyla_compute_noise_file(self):
 		"""
-		Computes the noise file needed by KISIP. Optional.
+		Computes the noise cube needed by KISIP, gain*(flat-avgDark)
+		for the first burstNumber flat frames, and saves it to
+		noiseFile in preSpeckleBase and to noiseFileFits. The cube
+		is streamed one frame at a time through the shared frame
+		reader and flat-field kernel, so it works for ROSA and Zyla
+		alike and never holds more than a frame in memory.
+
+		Like the other calibration images, the cube is keyed on
+		its inputs. It is reused if noiseFileFits holds the
+		current key and the KISIP noise file is complete, and
+		otherwise taken from the calibration store, if configured,
+		or computed and added to the store.
 		"""
-		self.logger.info("Computing noise cube: shape: "
-				"{0}".format(self.imageShape+(self.burstNumber,))
-				)
-		self.noise=np.zeros((self.burstNumber,)+self.imageShape,
-				dtype=np.float32
-				)
-		i=0
-		for flat in self.flatList[0:self.burstNumber]:
-			self.noise[i, :, :]=(self.rosa_zyla_read_binary_image(flat)
-					-self.avgDark)
-			i+=1
-		self.noise=np.multiply(self.noise, self.gain)
-		
-		self.logger.info("Noise cube complete. "
-				"Saving to noise file: "
-				"{0}".format(
-					os.path.join(self.preSpeckleBase, self.noiseFile)
+		def rosa_zyla_flat_noise_frames():
+			frame=np.empty(self.imageShape, dtype=np.float32)
+			nFrames=0
+			for file, frames in self.rosa_zyla_iter_file_frames(self.flatList[:self.burstNumber]):
+				for data in frames:
+					if nFrames == self.burstNumber:
+						return
+					yield self.rosa_zyla_flatfield_frame(data, frame)
+					record['bytesRead']+=data.nbytes
+					nFrames+=1
+			if nFrames < self.burstNumber:
+				self.logger.warning("Only {0} flat frames for a noise cube "
+						"of {1}, padding with zeros.".format(nFrames, self.burstNumber)
+						)
+				frame[:]=0
+				for i in range(nFrames, self.burstNumber):
+					yield frame
+
+		with self.metrics.metrics_stage('noise', frames=int(self.burstNumber), files=1) as record:
+			key=self.calKeys['noise']
+			noisePath=os.path.join(self.preSpeckleBase, self.noiseFile)
+			cubeShape=(int(self.burstNumber),)+tuple(int(n) for n in self.imageShape)
+			cubeBytes=int(np.prod(cubeShape))*np.dtype(np.float32).itemsize
+			if (self.rosa_zyla_read_cal_key(self.noiseFileFits) == key
+					and os.path.exists(noisePath)
+					and os.path.getsize(noisePath) == cubeBytes):
+				self.logger.info("Calibration noise file found: {0}".format(noisePath))
+				record['source']='workBase'
+				return
+
+			storeFile=None
+			if self.calStore is not None:
+				storeFile=self.calStore.cal_store_get_file('noise', key)
+			record['source']='computed' if storeFile is None else 'calStore'
+			if storeFile is not None:
+				record['bytesRead']=os.path.getsize(storeFile)
+			self.logger.info("{0} noise cube: shape: {1}: saving to noise "
+					"file: {2}".format(
+						"Copying" if storeFile is not None else "Computing",
+						cubeShape, noisePath
+						)
 					)
-				)
-		self.rosa_zyla_save_binary_image_cube(
-				self.noise,
-				os.path.join(self.preSpeckleBase, self.noiseFile)
-				)
-		self.logger.info("Saved noise file: "
-				"{0}".format(os.path.join(self.preSpeckleBase, self.noiseFile))
-				)
-	
+			tmpFile='{0}.{1}.tmp'.format(noisePath, os.getpid())
+			try:
+				with open(tmpFile, mode='wb') as f:
+					if storeFile is not None:
+						with fits.open(storeFile) as hdu:
+							for ext in hdu:
+								if ext.is_image and ext.header.get('NAXIS') == 3:
+									for i in range(self.burstNumber):
+										np.asarray(ext.section[i], dtype=np.float32).tofile(f)
+									break
+					else:
+						self.rosa_zyla_prepare_flatfield()
+						for frame in rosa_zyla_flat_noise_frames():
+							frame.tofile(f)
+				assert(os.path.getsize(tmpFile) == cubeBytes), (
+						"Noise cube has {0} bytes, expected {1}".format(
+							os.path.getsize(tmpFile), cubeBytes
+							)
+						)
+				os.replace(tmpFile, noisePath)
+			except Exception as err:
+				self.logger.critical("Could not save noise file: {0}".format(err))
+				if os.path.exists(tmpFile):
+					os.remove(tmpFile)
+				raise
+			self.logger.info("Saved noise file: {0}".format(noisePath))
+			record['bytesWritten']+=cubeBytes
+
+			self.noise=np.memmap(noisePath, dtype=np.float32, mode='r', shape=cubeShape)
+			self.logger.info("Saving noise: {0}".format(self.noiseFileFits))
+			if storeFile is not None:
+				shutil.copyfile(storeFile, self.noiseFileFits)
+				record['bytesWritten']+=os.path.getsize(self.noiseFileFits)
+				return
+			if self.calCompression == 'none':
+				self.rosa_zyla_stream_fits_cube(self.noise, self.noiseFileFits,
+						cards={'CALKEY' : key}
+						)
+			else:
+				## Tile compression needs the whole cube, read from
+				## the memory map.
+				self.rosa_zyla_save_fits_image(self.noise, self.noiseFileFits,
+						compression=self.calCompression,
+						quantizeLevel=self.calQuantizeLevel
+						)
+				self.rosa_zyla_write_cal_key(self.noiseFileFits, key)
+			record['bytesWritten']+=os.path.getsize(self.noiseFileFits)
+			if self.calStore is not None:
+				self.calStore.cal_store_put_file('noise', key, self.noiseFileFits)
+
 	def rosa_zyla_configure_run(self):
 		"""
 		Configures the rosaZylaCal instance according to the contents of
@@ -264,8 +827,47 @@ class rosaZylaCal:
 		config=configparser.ConfigParser()
 		config.read(self.configFile)
 		
-		self.burstNumber=np.int(config[self.instrument]['burstNumber'])
+		self.burstNumber=int(config[self.instrument]['burstNumber'])
 		self.burstFileForm=config[self.instrument]['burstFileForm']
+		self.burstWorkers=config[self.instrument].getint('burstWorkers', fallback=1)
+		self.burstWriteBuffers=config[self.instrument].getint('burstWriteBuffers', fallback=2)
+		self.averageWorkers=config[self.instrument].getint('averageWorkers', fallback=1)
+		self.fitsWorkers=config[self.instrument].getint('fitsWorkers', fallback=1)
+		self.checkWorkers=config[self.instrument].getint('checkWorkers', fallback=8)
+		self.postSpeckleCube=config[self.instrument].get('postSpeckleCube',
+				fallback='none'
+				).lower()
+		self.calCompression=config[self.instrument].get('calCompression',
+				fallback='none'
+				)
+		self.calQuantizeLevel=config[self.instrument].getfloat('calQuantizeLevel',
+				fallback=16
+				)
+		self.postSpeckleCompression=config[self.instrument].get('postSpeckleCompression',
+				fallback='none'
+				)
+		self.postSpeckleQuantizeLevel=config[self.instrument].getfloat('postSpeckleQuantizeLevel',
+				fallback=16
+				)
+		self.resumeRun=config[self.instrument].getboolean('resumeRun', fallback=True)
+		self.computeNoise=config[self.instrument].getboolean('computeNoise', fallback=False)
+		self.calStoreBase=config[self.instrument].get('calStoreBase', fallback='')
+		self.prefetchDepth=config[self.instrument].getint('prefetchDepth', fallback=0)
+		self.prefetchThreads=config[self.instrument].getint('prefetchThreads', fallback=4)
+		self.prefetchMaxMB=config[self.instrument].getint('prefetchMaxMB', fallback=1024)
+		self.qualityMetrics=config[self.instrument].getboolean('qualityMetrics',
+				fallback=True
+				)
+		self.qualityStride=max(1, config[self.instrument].getint('qualityStride', fallback=4))
+		self.qualityCandidates=config[self.instrument].getint('qualityCandidates',
+				fallback=0
+				)
+		self.qualityMetric=config[self.instrument].get('qualityMetric',
+				fallback='sharpness'
+				).lower()
+		self.qualityThreshold=config[self.instrument].getfloat('qualityThreshold',
+				fallback=0.0
+				)
 		self.darkBase=config[self.instrument]['darkBase']
 		self.dataBase=config[self.instrument]['dataBase']
 		self.darkFilePattern=config[self.instrument]['darkFilePattern']
@@ -278,6 +880,11 @@ class rosaZylaCal:
 		self.expTimems=config[self.instrument]['expTimems']
 		self.speckledFileForm=config[self.instrument]['speckledFileForm']
 		self.workBase=config[self.instrument]['workBase']
+		self.useFitsIndex=config[self.instrument].getboolean('useFitsIndex', fallback=True)
+		self.useDirIndex=config[self.instrument].getboolean('useDirIndex', fallback=True)
+		self.fitsIndexBase=config[self.instrument].get('fitsIndexBase',
+				fallback=os.path.join(self.workBase, 'fitsIndex')
+				)
 
 		self.preSpeckleBase=os.path.join(self.workBase, 'preSpeckle')
 		self.speckleBase=os.path.join(self.workBase, 'speckle')
@@ -286,6 +893,59 @@ class rosaZylaCal:
 		self.flatFile=os.path.join(self.workBase, '{0}_flat.fits'.format(self.instrument))
 		self.gainFile=os.path.join(self.workBase, '{0}_gain.fits'.format(self.instrument))
 		self.noiseFileFits=os.path.join(self.workBase, '{0}_noise.fits'.format(self.instrument))
+		self.manifestFile=os.path.join(self.workBase,
+				'{0}_{1}.manifest'.format(self.obsTime, self.instrument.lower())
+				)
+		self.zylaGeometryFile=os.path.join(self.calStoreBase or self.workBase,
+				'zyla_geometry.json'
+				)
+		self.metadataFile=os.path.join(self.workBase,
+				'{0}_{1}.metadata.sqlite'.format(self.obsTime, self.instrument.lower())
+				)
+		self.followInterval=config[self.instrument].getfloat('followInterval', fallback=5)
+		self.followSettle=config[self.instrument].getfloat('followSettle', fallback=30)
+		self.followIdleTimeout=config[self.instrument].getfloat('followIdleTimeout',
+				fallback=1800
+				)
+		self.followStopFile=config[self.instrument].get('followStopFile',
+				fallback=''
+				) or os.path.join(self.workBase,
+					'{0}_{1}.stop'.format(self.obsTime, self.instrument.lower())
+					)
+		self.recordMetrics=config[self.instrument].getboolean('recordMetrics',
+				fallback=True
+				)
+		## Burst workers joining a distributed run write their own
+		## log and metrics files.
+		workerSuffix='.'+self.burstWorkerName if self.burstWorkerName else ''
+		self.metricsFile=config[self.instrument].get('metricsFile',
+				fallback=''
+				) or os.path.join(self.workBase,
+					'{0}_{1}{2}.metrics.jsonl'.format(self.obsTime,
+						self.instrument.lower(), workerSuffix
+						)
+					)
+		self.metricsPromFile=config[self.instrument].get('metricsPromFile',
+				fallback=''
+				)
+		self.distributedBursts=config[self.instrument].getboolean('distributedBursts',
+				fallback=False
+				)
+		self.queueBurstsPerTask=config[self.instrument].getint('queueBurstsPerTask',
+				fallback=16
+				)
+		self.queueClaimTimeout=config[self.instrument].getfloat('queueClaimTimeout',
+				fallback=600
+				)
+		self.queuePollInterval=config[self.instrument].getfloat('queuePollInterval',
+				fallback=5
+				)
+		self.queueWaitTimeout=config[self.instrument].getfloat('queueWaitTimeout',
+				fallback=3600
+				)
+		self.queueDir=os.path.join(self.workBase,
+				'{0}_{1}.queue'.format(self.obsTime, self.instrument.lower())
+				)
 
 		## Directories preSpeckleBase, speckleBase, and postSpeckle
 		## must exist or be created in order to continue.
@@ -303,7 +963,9 @@ class rosaZylaCal:
 		## Set-up logging.
 		self.logFile='{0}{1}'.format(
 				os.path.join(self.workBase,
-					'{0}_{1}'.format(self.obsTime, self.instrument.lower())
+					'{0}_{1}{2}'.format(self.obsTime, self.instrument.lower(),
+						workerSuffix
+						)
 					),
 				'.log'
 				)
@@ -317,6 +979,15 @@ class rosaZylaCal:
 		self.logger.info("Contact {0} to report bugs, make suggestions, "
 				"or contribute.".format(self.ssosoftConfig.__email__))
 		self.logger.info("Now configuring this {0} data calibration run.".format(self.instrument))
+		if self.recordMetrics:
+			self.logger.info("Writing stage metrics to: {0}".format(self.metricsFile))
+			self.metrics=stageMetrics(self.metricsFile, self.metricsPromFile,
+					labels={'instrument' : self.instrument,
+						'obsDate' : self.obsDate,
+						'obsTime' : self.obsTime
+						},
+					logger=self.logger
+					)
 
 		## darkBase, dataBase, and flatBase directories must exist.
 		try:
@@ -343,6 +1014,56 @@ class rosaZylaCal:
 		else:
 			self.logger.info("Using flat directory: {0}".format(self.flatBase))
 
+		for compression in [self.calCompression, self.postSpeckleCompression]:
+			if compression not in ['none', 'RICE_1', 'GZIP_1', 'GZIP_2',
+					'HCOMPRESS_1', 'PLIO_1']:
+				self.logger.critical("Fatal: unknown FITS compression: "
+						"{0}".format(compression)
+						)
+				raise ValueError("Invalid FITS compression: {0}".format(compression))
+		if self.postSpeckleCube not in ['none', 'batch', 'run']:
+			self.logger.critical("Fatal: postSpeckleCube must be none, "
+					"batch, or run: {0}".format(self.postSpeckleCube)
+					)
+			raise ValueError("Invalid postSpeckleCube: "
+					"{0}".format(self.postSpeckleCube)
+					)
+		if self.qualityMetric not in ['sharpness', 'contrast']:
+			self.logger.critical("Fatal: qualityMetric must be sharpness "
+					"or contrast: {0}".format(self.qualityMetric)
+					)
+			raise ValueError("Invalid qualityMetric: "
+					"{0}".format(self.qualityMetric)
+					)
+		if self.qualityCandidates != 0 and self.qualityCandidates < self.burstNumber:
+			self.logger.critical("Fatal: qualityCandidates must be 0, or at "
+					"least burstNumber {0}: {1}".format(self.burstNumber,
+						self.qualityCandidates
+						)
+					)
+			raise ValueError("Invalid qualityCandidates: "
+					"{0}".format(self.qualityCandidates)
+					)
+
+	def rosa_zyla_count_extensions(self, file):
+		"""
+		Counts the image extensions of a ROSA FITS file.
+
+		Parameters
+		----------
+		file : str
+			Path to the FITS file.
+
+		Returns
+		-------
+		int
+		"""
+		index=self.rosa_zyla_file_index(file)
+		if index is not None:
+			return len(index)
+		with fits.open(file) as hdu:
+			return len(hdu)-1
+
 	def rosa_zyla_detect_rosa_dims(self, header):
 		"""
 		Detects data and image dimensions in ROSA FITS image file headers.
@@ -435,6 +1156,97 @@ class rosaZylaCal:
 		self.logger.info("Auto-detected image dimensions "
 				"(rows, cols): {0}".format(self.imageShape))
 
+	def rosa_zyla_detect_zyla_geometry(self, file):
+		"""
+		Detects the data and image dimensions of a Zyla unformatted
+		binary image file from its first rows and its last rows,
+		rather than the whole frame. As in rosa_zyla_detect_zyla_dims,
+		overscan pixels are assumed to be zero. The columns are
+		found from the first zero run, the data rows from the file
+		size, and the image rows from the last non-zero pixel. The
+		image rows are cached per camera configuration (file size
+		and columns) in zylaGeometryFile.
+
+		Parameters
+		----------
+		file : str
+			Path to image file.
+
+		Returns
+		-------
+		bool
+			True if the dimensions were detected. False if the
+			file does not fit the expected layout, in which case
+			rosa_zyla_detect_zyla_dims should be used.
+		"""
+		fileSize=os.stat(file).st_size
+		nPixel=fileSize//np.dtype(np.uint16).itemsize
+		chunk=65536
+		with open(file, mode='rb') as imageFile:
+			## Read until the first zero run has ended.
+			head=np.empty(0, dtype=np.uint16)
+			while True:
+				block=np.fromfile(imageFile, dtype=np.uint16, count=chunk)
+				head=np.concatenate((head, block))
+				iszero=np.concatenate(([0], np.equal(head, 0).view(np.int8), [0]))
+				ovrScn=np.where(np.abs(np.diff(iszero)) == 1)[0]
+				if len(ovrScn) >= 2 and ovrScn[1] < head.size:
+					break
+				if block.size < chunk:
+					return False
+			rowPixel=ovrScn[1]
+			if ovrScn[0] == 0 or nPixel%rowPixel:
+				return False
+			datDim=(np.uint16(nPixel/rowPixel), rowPixel)
+			geometryKey='{0}:{1}:{2}'.format(fileSize, rowPixel, ovrScn[0])
+			geometryCache={}
+			if os.path.exists(self.zylaGeometryFile):
+				try:
+					with open(self.zylaGeometryFile, mode='r') as f:
+						geometryCache=json.load(f)
+				except ValueError:
+					geometryCache={}
+			if geometryKey in geometryCache:
+				self.logger.info("Using cached image rows for camera "
+						"configuration: {0}".format(geometryKey)
+						)
+				endRow=geometryCache[geometryKey]
+			else:
+				## Read back from the end to the last non-zero pixel.
+				row=int(datDim[0])
+				endRow=None
+				while row > 0:
+					start=max(0, row-16)
+					imageFile.seek(start*int(rowPixel)*np.dtype(np.uint16).itemsize)
+					block=np.fromfile(imageFile, dtype=np.uint16,
+							count=(row-start)*int(rowPixel)
+							)
+					nonZero=np.flatnonzero(block)
+					if nonZero.size:
+						endRow=start+int(nonZero[-1])//int(rowPixel)+1
+						break
+					row=start
+				if endRow is None:
+					return False
+				geometryCache[geometryKey]=endRow
+				tmpFile='{0}.{1}.tmp'.format(self.zylaGeometryFile, os.getpid())
+				try:
+					os.makedirs(os.path.dirname(self.zylaGeometryFile), exist_ok=True)
+					with open(tmpFile, mode='w') as f:
+						json.dump(geometryCache, f)
+					os.replace(tmpFile, self.zylaGeometryFile)
+				except OSError as err:
+					self.logger.warning("Could not save Zyla geometry cache: "
+							"{0}: {1}".format(self.zylaGeometryFile, err)
+							)
+		self.dataShape=datDim
+		self.imageShape=(np.uint16(endRow), ovrScn[0])
+		self.logger.info("Auto-detected data dimensions "
+				"(rows, cols): {0}".format(self.dataShape))
+		self.logger.info("Auto-detected image dimensions "
+				"(rows, cols): {0}".format(self.imageShape))
+		return True
+
 	def rosa_zyla_display_image(self,im):
 		"""
 		Displays image data.
@@ -450,98 +1262,573 @@ class rosaZylaCal:
 				)
 		plt.show()
 
-	def rosa_zyla_get_cal_images(self):
-		"""
-		Reads average dark, average flat, and gain files and store as class
-		attributes if exist. If these files do not exist, compute the average
-		dark, average flat, and gain images and store as class attributes.
+	def rosa_zyla_file_index(self, file):
 		"""
-		if os.path.exists(self.darkFile):
-			self.logger.info("Average dark file found: {0}".format(self.darkFile))
-			self.logger.info("Reading average dark.")
-			with fits.open(self.darkFile) as hdu:
-				self.avgDark=hdu[0].data
-		else:
-			self.avgDark=self.rosa_zyla_average_image_from_list(
-					self.darkList
-					)
-		if os.path.exists(self.flatFile):
-			self.logger.info("Average flat file found: {0}".format(self.flatFile))
-			self.logger.info("Reading average flat.")
-			with fits.open(self.flatFile) as hdu:
-				self.avgFlat=hdu[0].data
-		else:
-			self.avgFlat=self.rosa_zyla_average_image_from_list(
-					self.flatList
-					)
-		if os.path.exists(self.gainFile):
-			self.logger.info("Gain file found: {0}".format(self.gainFile))
-			self.logger.info("Reading gain file.")
-			with fits.open(self.gainFile) as hdu:
-				self.gain=hdu[0].data
-		else:
-			self.rosa_zyla_compute_gain()
+		Returns the extension index of a ROSA FITS file, from
+		rosa_zyla_fits_index.
 
+		Parameters
+		----------
+		file : str
+			Path to the FITS file.
 
-	def rosa_zyla_get_file_lists(self):
-		"""
-		Construct darkList, dataList, and flatList attributes, which
-		are lists of respective file types.
+		Returns
+		-------
+		fitsIndex or None
+			None if useFitsIndex is off or the file cannot be
+			indexed, in which case the file is read with
+			astropy instead.
 		"""
-		def rosa_zyla_assert_file_list(fList):
-			assert(len(fList)!=0), "List contains no matches."
-
-		self.logger.info("Searching for darks, flats, and data files.")
-		self.logger.info("Searching for dark image files: {0}".format(self.darkBase))
-		self.darkList=glob.glob(
-			os.path.join(self.darkBase, self.darkFilePattern)
-			)
-		try:
-			rosa_zyla_assert_file_list(self.darkList)
-		except AssertionError as err:
-			self.logger.critical("Error: darkList: {0}".format(err))
-			raise
-		else:
-			self.logger.info("Files in darkList: {0}".format(len(self.darkList)))
-
-		self.logger.info("Searching for data image files: {0}".format(self.dataBase))
-		self.dataList=glob.glob(
-				os.path.join(self.dataBase, self.dataFilePattern)
-				)
-		try:
-			rosa_zyla_assert_file_list(self.dataList)
-		except AssertionError as err:
-			self.logger.critical("Error: dataList: {0}".format(err))
-			raise
-		else:
-			self.logger.info("Files in dataList: {0}".format(len(self.dataList)))
-
-		self.logger.info("Searching for flat image files: {0}".format(self.flatBase))
-		self.flatList=glob.glob(
-				os.path.join(self.flatBase, self.flatFilePattern)
-				)
+		if not self.useFitsIndex:
+			return None
 		try:
-			rosa_zyla_assert_file_list(self.flatList)
-		except AssertionError as err:
-			self.logger.critical("Error: flatList: {0}".format(err))
-			raise
-		else:
-			self.logger.info("Files in flatList: {0}".format(len(self.flatList)))
+			return self.rosa_zyla_fits_index(file)
+		except ValueError as err:
+			self.logger.warning("Could not index FITS file, reading it "
+					"with astropy: {0}".format(err)
+					)
+			return None
 
-	def rosa_zyla_get_data_image_shapes(self, file):
+	def rosa_zyla_fits_index(self, file):
 		"""
-		The main data and image shape detection method.
+		Returns the extension index of a ROSA FITS file, building
+		it on first use and keeping it under fitsIndexBase. Indices
+		are kept for the lifetime of this instance, so a file is
+		indexed once per run rather than for every burst. An index
+		is built afresh if the file has changed since, e.g. while
+		it is still being written during a follow run.
 
 		Parameters
 		----------
 		file : str
-			Path to image file.
-		"""
-		self.logger.info("Detecting image and data dimensions in "
-				"file: {0}".format(file)
+			Path to the FITS file.
+
+		Returns
+		-------
+		fitsIndex
+
+		Raises
+		------
+		ValueError
+			If the file cannot be indexed.
+		"""
+		indexKey=os.path.abspath(file)
+		index=self.fitsIndices.get(indexKey)
+		st=os.stat(file)
+		if index is None or index.fileStat != [st.st_size, st.st_mtime_ns]:
+			index=fitsIndex(file, self.fitsIndexBase, self.logger)
+			self.fitsIndices[indexKey]=index
+		return index
+
+	def rosa_zyla_file_order_key(self, name):
+		"""
+		Returns the sort key of a level-0 file name. Zyla files
+		begin with their sequence number, least-significant digit
+		first. ROSA files sort by name.
+
+		Parameters
+		----------
+		name : str
+			File name, without directory.
+
+		Returns
+		-------
+		int, str, or None
+			The Zyla sequence number, or None if the name does
+			not begin with digits, or the ROSA file name.
+		"""
+		if 'ZYLA' in self.instrument:
+			match=re.match('[0-9]+', name)
+			if match:
+				return int(match.group()[::-1])
+			return None
+		return name
+
+	def rosa_zyla_fits_done(self, fitsFile, sources):
+		"""
+		Checks whether a FITS file made from despeckled images is
+		up to date: recorded in the run manifest against the
+		current images, or, without a manifest, newer than all of
+		them.
+
+		Parameters
+		----------
+		fitsFile : str
+			Path to the FITS file.
+		sources : list
+			Paths to the despeckled (.final) images it is made
+			from.
+
+		Returns
+		-------
+		bool
+		"""
+		if self.manifest is not None:
+			return self.manifest.manifest_is_done('fits', fitsFile,
+					self.rosa_zyla_fits_params(sources)
+					)
+		try:
+			return os.path.getmtime(fitsFile) >= max(
+					os.path.getmtime(file) for file in sources
+					)
+		except OSError:
+			return False
+
+	def rosa_zyla_fits_params(self, sources):
+		"""
+		Fingerprints the FITS output settings and the list of
+		images a FITS file is made from, for the run manifest.
+
+		Parameters
+		----------
+		sources : list
+			Paths to the despeckled (.final) images.
+
+		Returns
+		-------
+		str
+		"""
+		return manifest_fingerprint(self.postSpeckleCube,
+				self.postSpeckleCompression,
+				self.postSpeckleQuantizeLevel,
+				sources
+				)
+
+	def rosa_zyla_flatfield_frame(self, data, out):
+		"""
+		Flat-fields one frame, out=gain*(data-avgDark), in place in
+		out. No temporary frames are allocated. Requires
+		rosa_zyla_prepare_flatfield to have been called.
+
+		Parameters
+		----------
+		data : numpy.ndarray or array-like
+			Raw frame of shape imageShape. Any numerical dtype,
+			e.g. a uint16 Zyla view or ROSA FITS extension data.
+		out : numpy.ndarray
+			np.float32 array of shape imageShape, typically a
+			slice of a burst cube.
+
+		Returns
+		-------
+		numpy.ndarray
+			out.
+		"""
+		np.subtract(data, self.flatfieldDark, out=out, casting='unsafe')
+		np.multiply(out, self.flatfieldGain, out=out)
+		return out
+
+	def rosa_zyla_frame_quality(self, cube):
+		"""
+		Computes image quality metrics of flat-fielded frames, for
+		frame selection and the run metadata store, over all
+		frames at once. Every qualityStride-th row is sampled,
+		which keeps the cost of the metrics, and the size of
+		their temporary arrays, a fraction of flat-fielding.
+
+		Parameters
+		----------
+		cube : numpy.ndarray
+			np.float32 frames of shape (nFrames,)+imageShape.
+
+		Returns
+		-------
+		numpy.ndarray
+			np.float64 array of shape (nFrames, 3): the mean of
+			each frame, its RMS contrast, the RMS over the mean,
+			and its sharpness, the mean squared difference
+			between neighbouring pixels along rows and columns
+			over the squared mean. Contrast and sharpness are 0
+			for frames with a mean of 0.
+		"""
+		stride=self.qualityStride
+		quality=np.zeros((cube.shape[0], 3), dtype=np.float64)
+		rows=cube[:, ::stride]
+		nPixels=rows.shape[1]*rows.shape[2]
+		quality[:, 0]=rows.sum(axis=(1, 2), dtype=np.float64)/nPixels
+		mean=quality[:, 0]
+		nonZero=mean != 0
+		## Sums of squares over contiguous (nFrames, pixels) views.
+		centred=(rows-mean.astype(np.float32)[:, None, None]).reshape(len(cube), -1)
+		variance=np.einsum('ij,ij->i', centred, centred)/nPixels
+		np.divide(np.sqrt(variance), np.abs(mean), out=quality[:, 1], where=nonZero)
+		del centred
+		dx=(rows[:, :, 1:]-rows[:, :, :-1]).reshape(len(cube), -1)
+		dxSquares=np.einsum('ij,ij->i', dx, dx)/max(dx.shape[1], 1)
+		del dx
+		## Column differences pair each sampled row with the next.
+		dy=(cube[:, 1::stride]-cube[:, :-1:stride]).reshape(len(cube), -1)
+		dySquares=np.einsum('ij,ij->i', dy, dy)/max(dy.shape[1], 1)
+		np.divide(dxSquares+dySquares, mean**2, out=quality[:, 2], where=nonZero)
+		return quality
+
+	def rosa_zyla_follow_bursts(self, batchCallback=None):
+		"""
+		Saves burst cubes while data files are still being written,
+		during observing. dataBase is polled every followInterval
+		seconds for new files matching dataFilePattern, and each
+		burst is flat-fielded and saved as soon as all of its frames
+		are on disk. Bursts and batches are numbered exactly as a
+		rosa_zyla_save_bursts run over the same files would number
+		them, and bursts already recorded in the run manifest are
+		not saved again.
+
+		Data files are used in order, once they match the detected
+		data shape: Zyla files, in sequence number order without
+		gaps, once they reach full size, and ROSA files once a
+		later file appears or the file has not changed for
+		followSettle seconds. A burst is thus saved within about
+		followInterval seconds of its last frame, plus followSettle
+		seconds for a ROSA burst ending in the newest file. A file
+		that is followed by later files and still does not match
+		the data shape after followSettle seconds stops the run,
+		as rosa_zyla_check_dark_data_flat_shapes would.
+
+		Following ends when followStopFile exists, when no new data
+		has arrived for followIdleTimeout seconds, or on a
+		KeyboardInterrupt between polls. The files complete at that
+		point are used, any others are logged and left out, and
+		the last batch is completed. Frames left over after the
+		last full burst are not used.
+
+		Parameters
+		----------
+		batchCallback : callable
+			Optional function called with the batch number as
+			soon as the last burst of that batch is saved.
+		"""
+		with self.metrics.metrics_stage('follow_bursts') as record:
+			self.logger.info("Following data directory: {0}: for files "
+					"matching: {1}: polling every {2} s. Create {3} "
+					"to stop.".format(
+						self.dataBase, self.dataFilePattern,
+						self.followInterval, self.followStopFile
+						)
+					)
+			self.rosa_zyla_prepare_flatfield()
+			dataIndex=self.rosa_zyla_index_directory(self.dataBase, self.dataFilePattern)
+			self.dataList=[]
+			frames=[]
+			fileStats={}
+			nextBurst=0
+			batch=-1
+			batchComplete=True
+			lastData=time.monotonic()
+			stopping=False
+			try:
+				while True:
+					if not stopping and os.path.exists(self.followStopFile):
+						self.logger.info("Stop file found: {0}: finishing "
+								"follow run.".format(self.followStopFile)
+								)
+						stopping=True
+					if (not stopping and self.followIdleTimeout > 0
+							and time.monotonic()-lastData > self.followIdleTimeout):
+						self.logger.info("No new data for {0} s, finishing "
+								"follow run.".format(self.followIdleTimeout)
+								)
+						stopping=True
+
+					## Take the next data files, in order, up to the
+					## first one that is not ready.
+					dataIndex.index_update()
+					entries=dataIndex.index_entries()
+					try:
+						assert([f for f, size, mtime, key in entries[:len(self.dataList)]]
+								== self.dataList), (
+								"Data files removed or added out of order "
+								"in: {0}".format(self.dataBase)
+								)
+					except AssertionError as err:
+						self.logger.critical("Fatal: {0}".format(err))
+						raise
+					pending=entries[len(self.dataList):]
+					newFiles=[]
+					problem=None
+					now=time.monotonic()
+					for i, (file, size, mtime, key) in enumerate(pending):
+						fileNumber=len(self.dataList)+len(newFiles)
+						if 'ZYLA' in self.instrument and key != fileNumber:
+							problem="{0}: Zyla file number {1} is missing".format(
+									self.dataBase, fileNumber
+									)
+							break
+						try:
+							st=os.stat(file)
+						except OSError as err:
+							problem="{0}: {1}".format(file, err)
+							break
+						if fileStats.get(file, [None, None])[:2] != [st.st_size, st.st_mtime_ns]:
+							fileStats[file]=[st.st_size, st.st_mtime_ns, now]
+							lastData=now
+						later=i+1 < len(pending)
+						settled=now-fileStats[file][2] >= self.followSettle
+						if 'ROSA' in self.instrument and not (later or settled or stopping):
+							problem="{0}: may still be written".format(file)
+							break
+						problem=self.rosa_zyla_check_file_shape(file)
+						if problem is not None:
+							try:
+								assert(stopping or not (later and settled)), (
+										"Data file does not match the detected "
+										"data shape: {0}".format(problem)
+										)
+							except AssertionError as err:
+								self.logger.critical("Fatal: {0}".format(err))
+								raise
+							break
+						newFiles.append(file)
+						del fileStats[file]
+					if newFiles:
+						self.dataList.extend(newFiles)
+						frames.extend(self.rosa_zyla_plan_frames(newFiles))
+						self.logger.info("Data files ready: {0}: frames: "
+								"{1}".format(len(self.dataList), len(frames))
+								)
+
+					for burstEntry in self.rosa_zyla_plan_bursts(frames, nextBurst):
+						nextBurst=burstEntry['burst']+1
+						if burstEntry['batch'] != batch:
+							batch=burstEntry['batch']
+							batchComplete=False
+							(self.batchList).append(batch)
+						if self.rosa_zyla_burst_done(burstEntry):
+							self.logger.info("Run manifest: burst already "
+									"complete, skipping: {0}".format(burstEntry['file'])
+									)
+						else:
+							burstFile, headerText, timestamp, quality=self.rosa_zyla_save_burst(burstEntry)
+							self.rosa_zyla_record_burst(burstEntry, headerText, timestamp, quality)
+							record['frames']+=len(burstEntry['frames'])
+							record['bytesWritten']+=os.path.getsize(burstFile)
+							self.logger.info("Saved burst file {0:0.1f} s after its "
+									"last frame was written: {1}".format(
+										time.time()-os.stat(burstEntry['frames'][-1][0]).st_mtime,
+										burstFile
+										)
+									)
+						if burstEntry['index'] == 999:
+							self.rosa_zyla_complete_batch(batch, batchCallback)
+							batchComplete=True
+					self.rosa_zyla_get_metadata().metadata_commit()
+
+					if stopping:
+						if problem is not None:
+							self.logger.error("{0} data files not used, first: "
+									"{1}".format(len(pending)-len(newFiles), problem)
+									)
+						break
+					try:
+						time.sleep(self.followInterval)
+					except KeyboardInterrupt:
+						self.logger.info("Interrupted, finishing follow run.")
+						stopping=True
+				if not batchComplete:
+					self.rosa_zyla_complete_batch(batch, batchCallback)
+			finally:
+				self.rosa_zyla_get_metadata().metadata_commit()
+				record['files']=len(self.dataList)
+				record['bytesRead']=sum(os.path.getsize(f) for f in self.dataList)
+
+			self.logger.info("Follow run finished: {0} data files, {1} bursts, "
+					"{2} frames after the last full burst not used.".format(
+						len(self.dataList), nextBurst,
+						len(frames)-nextBurst*max(self.burstNumber, self.qualityCandidates)
+						)
+					)
+			self.logger.info("Burst files complete: {0}".format(self.preSpeckleBase))
+
+	def rosa_zyla_get_cal_image(self, product, file, computeImage, sources=None):
+		"""
+		Gets one calibration image. The copy in workBase is used if
+		its CALKEY matches the current inputs. Otherwise the image
+		is taken from the calibration store, if configured, or
+		computed and added to the store.
+
+		Parameters
+		----------
+		product : str
+			Calibration product: 'dark', 'flat', or 'gain'.
+		file : str
+			Path to the workBase copy of the image.
+		computeImage : callable
+			Function computing the image if it is not found.
+		sources : list
+			Optional paths to the image files computeImage
+			averages, for the stage metrics.
+
+		Returns
+		-------
+		numpy.ndarray
+		"""
+		with self.metrics.metrics_stage(product, frames=1, files=1) as record:
+			key=self.calKeys[product]
+			fileKey=self.rosa_zyla_read_cal_key(file)
+			if fileKey == key:
+				self.logger.info("Calibration {0} file found: {1}".format(product, file))
+				self.logger.info("Reading {0} file.".format(product))
+				record['source']='workBase'
+				record['bytesRead']=os.path.getsize(file)
+				return self.rosa_zyla_read_fits_image(file)
+			if os.path.exists(file):
+				self.logger.info("Calibration {0} file {1} does not match the "
+						"current inputs, not reusing it.".format(product, file)
+						)
+			if self.calStore is not None:
+				image=self.calStore.cal_store_get(product, key)
+				if image is not None:
+					record['source']='calStore'
+					return image
+			record['source']='computed'
+			if sources:
+				record['files']=len(sources)
+				record['frames']=len(sources)
+				if 'ROSA' in self.instrument:
+					record['frames']*=self.rosa_zyla_count_extensions(sources[0])
+				record['bytesRead']=sum(os.path.getsize(f) for f in sources)
+			image=computeImage()
+			if self.calStore is not None:
+				self.calStore.cal_store_put(product, key, image)
+			return image
+
+	def rosa_zyla_get_cal_images(self):
+		"""
+		Gets the average dark, average flat, and gain images and
+		stores them as class attributes. Each image is keyed on the
+		instrument, image shape, exposure time, and the dark and
+		flat files it is computed from. An image is reused from
+		workBase or from the calibration store only if its key
+		matches, and computed otherwise.
+		"""
+		def rosa_zyla_compute_gain_image():
+			self.rosa_zyla_compute_gain()
+			return self.gain
+
+		self.rosa_zyla_get_cal_keys()
+		if self.calStoreBase:
+			self.calStore=calStore(self.calStoreBase, self.instrument, self.logger)
+		self.avgDark=self.rosa_zyla_get_cal_image('dark', self.darkFile,
+				lambda: self.rosa_zyla_average_image_from_list(self.darkList),
+				sources=self.darkList
+				)
+		self.avgFlat=self.rosa_zyla_get_cal_image('flat', self.flatFile,
+				lambda: self.rosa_zyla_average_image_from_list(self.flatList),
+				sources=self.flatList
+				)
+		self.gain=self.rosa_zyla_get_cal_image('gain', self.gainFile,
+				rosa_zyla_compute_gain_image
+				)
+
+	def rosa_zyla_get_cal_keys(self):
+		"""
+		Computes the keys identifying the inputs of the average
+		dark, average flat, and gain images. The gain key is
+		derived from the dark and flat keys, and the noise key
+		from the gain key and burstNumber.
+		"""
+		calInputs=[self.instrument,
+				[int(n) for n in self.imageShape],
+				[int(n) for n in self.dataShape],
+				self.expTimems
+				]
+		self.calKeys={}
+		self.calKeys['dark']=manifest_fingerprint('dark', calInputs,
+				manifest_file_stats(self.darkList)
+				)
+		self.calKeys['flat']=manifest_fingerprint('flat', calInputs,
+				manifest_file_stats(self.flatList)
+				)
+		self.calKeys['gain']=manifest_fingerprint('gain',
+				self.calKeys['dark'],
+				self.calKeys['flat']
+				)
+		self.calKeys['noise']=manifest_fingerprint('noise',
+				self.calKeys['gain'],
+				int(self.burstNumber)
+				)
+
+	def rosa_zyla_get_file_lists(self, dataFiles=True):
+		"""
+		Construct darkList, dataList, and flatList attributes, which
+		are lists of respective file types.
+
+		Parameters
+		----------
+		dataFiles : bool
+			Default True. Set to False to leave dataList empty,
+			e.g. for a follow run, where data files are found
+			as they are written.
+		"""
+		def rosa_zyla_assert_file_list(fList):
+			assert(len(fList)!=0), "List contains no matches."
+
+		self.logger.info("Searching for darks, flats, and data files.")
+		self.logger.info("Searching for dark image files: {0}".format(self.darkBase))
+		self.darkList=self.rosa_zyla_list_files('dark', self.darkBase, self.darkFilePattern)
+		try:
+			rosa_zyla_assert_file_list(self.darkList)
+		except AssertionError as err:
+			self.logger.critical("Error: darkList: {0}".format(err))
+			raise
+		else:
+			self.logger.info("Files in darkList: {0}".format(len(self.darkList)))
+
+		if dataFiles:
+			self.logger.info("Searching for data image files: {0}".format(self.dataBase))
+			self.dataList=self.rosa_zyla_list_files('data', self.dataBase, self.dataFilePattern)
+			try:
+				rosa_zyla_assert_file_list(self.dataList)
+			except AssertionError as err:
+				self.logger.critical("Error: dataList: {0}".format(err))
+				raise
+			else:
+				self.logger.info("Files in dataList: {0}".format(len(self.dataList)))
+		else:
+			self.dataList=[]
+
+		self.logger.info("Searching for flat image files: {0}".format(self.flatBase))
+		self.flatList=self.rosa_zyla_list_files('flat', self.flatBase, self.flatFilePattern)
+		try:
+			rosa_zyla_assert_file_list(self.flatList)
+		except AssertionError as err:
+			self.logger.critical("Error: flatList: {0}".format(err))
+			raise
+		else:
+			self.logger.info("Files in flatList: {0}".format(len(self.flatList)))
+
+	def rosa_zyla_get_metadata(self):
+		"""
+		Returns the run metadata store, which holds the header
+		text, timestamp and cube path of every burst. Opened on
+		first use.
+
+		Returns
+		-------
+		runMetadata
+		"""
+		if self.metadata is None:
+			self.metadata=runMetadata(self.metadataFile, self.logger)
+		return self.metadata
+
+	def rosa_zyla_get_data_image_shapes(self, file):
+		"""
+		The main data and image shape detection method.
+
+		Parameters
+		----------
+		file : str
+			Path to image file.
+		"""
+		self.logger.info("Detecting image and data dimensions in "
+				"file: {0}".format(file)
 				)
 		if 'ZYLA' in self.instrument:
 			try:
+				if self.rosa_zyla_detect_zyla_geometry(file):
+					return
+				self.logger.info("Fast geometry detection failed, "
+						"reading the whole frame."
+						)
 				with open(file, mode='rb') as imageFile:
 					imageData=np.fromfile(imageFile,
 							dtype=np.uint16
@@ -554,8 +1841,12 @@ class rosaZylaCal:
 			self.rosa_zyla_detect_zyla_dims(imageData)
 		if 'ROSA' in self.instrument:
 			try:
-				with fits.open(file) as hdu:
-					header=hdu[1].header
+				index=self.rosa_zyla_file_index(file)
+				if index is not None:
+					header=index.index_header(1)
+				else:
+					with fits.open(file) as hdu:
+						header=hdu[1].header
 			except Exception as err:
 				self.logger.critical("Could not get image or data "
 						"shapes: {0}".format(err)
@@ -564,14 +1855,276 @@ class rosaZylaCal:
 			self.rosa_zyla_detect_rosa_dims(header)
 
 
-	def rosa_zyla_order_files(self):
+	def rosa_zyla_index_directory(self, directory, pattern, persist=True, level0=True):
+		"""
+		Returns an up-to-date dirIndex of the files in a directory
+		matching a pattern. The index is kept for the lifetime of
+		this instance and, if persist is True, saved under
+		workBase/dirIndex so that later runs only examine new
+		files.
+
+		Parameters
+		----------
+		directory : str
+			Directory to index.
+		pattern : str
+			fnmatch pattern the file names must match.
+		persist : bool
+			Default True saves the index to disk.
+		level0 : bool
+			Default True orders the files by
+			rosa_zyla_file_order_key. Set to False to order
+			them by name.
+
+		Returns
+		-------
+		dirIndex
+		"""
+		indexKey=(os.path.abspath(directory), pattern)
+		if indexKey in self.dirIndices:
+			self.dirIndices[indexKey].index_update()
+			return self.dirIndices[indexKey]
+		indexFile=None
+		if persist:
+			indexFile=os.path.join(self.workBase, 'dirIndex', '{0}.{1}.json'.format(
+				os.path.basename(os.path.normpath(directory)),
+				manifest_fingerprint(*indexKey)[:8]
+				))
+		self.dirIndices[indexKey]=dirIndex(directory, pattern,
+				orderKey=self.rosa_zyla_file_order_key if level0 else None,
+				indexFile=indexFile,
+				logger=self.logger
+				)
+		return self.dirIndices[indexKey]
+
+	def rosa_zyla_iter_file_frames(self, fileList):
+		"""
+		Iterates over the frames of a list of image files, file by
+		file. With prefetchDepth greater than 0, upcoming files are
+		read ahead on a pool of I/O threads.
+
+		Parameters
+		----------
+		fileList : list
+			A list of file paths.
+
+		Yields
+		------
+		tuple
+			(file, frames), where frames is a sequence of 2-D
+			arrays in the file's raw data type, shape imageShape.
+		"""
+		if self.prefetchDepth > 0 and len(fileList) > 1:
+			yield from self.rosa_zyla_prefetch(fileList)
+			return
+		for file in fileList:
+			if 'ZYLA' in self.instrument:
+				yield file, [self.rosa_zyla_map_binary_image(file)]
+			if 'ROSA' in self.instrument:
+				index=self.rosa_zyla_file_index(file)
+				if index is not None:
+					yield file, index
+					continue
+				with fits.open(file) as hdu:
+					yield file, (ext.data for ext in hdu[1:])
+
+	def rosa_zyla_list_files(self, listName, directory, pattern):
+		"""
+		Lists the files in a directory matching a pattern. With
+		useDirIndex, the list comes from a persistent dirIndex and
+		is already in order. Otherwise the directory is globbed and
+		the list is ordered by rosa_zyla_order_files.
+
+		Parameters
+		----------
+		listName : str
+			'dark', 'data', or 'flat'.
+		directory : str
+			Directory to search.
+		pattern : str
+			Shell-style file name pattern.
+
+		Returns
+		-------
+		list
+			Paths to the matching files.
+		"""
+		if self.useDirIndex:
+			return self.rosa_zyla_index_directory(directory, pattern).index_files()
+		return glob.glob(os.path.join(directory, pattern))
+
+	def rosa_zyla_load_file_frames(self, file, preload=False):
+		"""
+		Loads the frames of one image file: the single frame of a
+		Zyla file or the extensions of a ROSA FITS file.
+
+		Parameters
+		----------
+		file : str
+			Path to the image file.
+		preload : bool
+			Default False memory-maps the data, so it is read
+			when first used. Set to True to read it into memory
+			now, e.g. on a prefetch thread.
+
+		Returns
+		-------
+		sequence
+			2-D arrays in the file's raw data type, shape
+			imageShape. For ROSA with useFitsIndex, a fitsIndex
+			giving frames on demand, or a 3-D array if
+			preloaded.
+		"""
+		if 'ZYLA' in self.instrument:
+			frame=self.rosa_zyla_map_binary_image(file)
+			if preload:
+				frame=np.array(frame)
+			return [frame]
+		if 'ROSA' in self.instrument:
+			index=self.rosa_zyla_file_index(file)
+			if index is not None:
+				if preload:
+					return index.index_read_frames(0, len(index))
+				return index
+			with fits.open(file, memmap=not preload) as hdu:
+				return [ext.data for ext in hdu[1:]]
+
+	def rosa_zyla_map_binary_image(self, file, dataShape=None, imageShape=None, dtype=np.uint16):
+		"""
+		Memory-maps an unformatted binary file and returns the
+		region s[i] ~ 0:imageShape[i] as a read-only view. Only the
+		rows spanned by imageShape are mapped, so trailing overscan
+		rows are never read from disk.
+
+		Parameters
+		----------
+		file : str
+			Path to binary image file.
+		dataShape : tuple
+			Shape of the image or cube.
+		imageShape : tuple
+			Shape of sub-image or region of interest.
+		dtype : Numpy numerical data type.
+			Default is numpy.uint16.
+
+		Returns
+		-------
+		numpy.memmap : dtype dtype, shape imageShape.
+		"""
+		if dataShape is None:
+			dataShape=self.dataShape
+
+		if imageShape is None:
+			imageShape=self.imageShape
+
+		try:
+			im=np.memmap(file, dtype=dtype, mode='r',
+					shape=(imageShape[0],)+tuple(dataShape[1:])
+					)
+		except Exception as err:
+			self.logger.critical("Could not open/read binary image file: "
+					"{0}".format(err)
+					)
+			raise
+
+		## Generate a tuple of slice objects, s[i]~ 0:imageShape[i]
+		s=tuple()
+		for t in imageShape:
+			s=s+np.index_exp[0:t]
+		return im[s]
+
+	def rosa_zyla_open_burst_queue(self):
+		"""
+		Returns the work queue of a distributed burst run, kept in
+		queueDir under workBase.
+
+		Returns
+		-------
+		burstQueue
+		"""
+		return burstQueue(self.queueDir,
+				claimTimeout=self.queueClaimTimeout,
+				logger=self.logger
+				)
+
+	def rosa_zyla_open_manifest(self):
+		"""
+		Opens the run manifest in workBase, which records completed
+		bursts, KISIP batches, and FITS files so that an
+		interrupted run can be resumed. The manifest is
+		fingerprinted with the configuration, the dark and flat
+		files, and the calibration image keys. If any of these
+		changed since the manifest was written, all work is redone.
+		Each burst is recorded with the data files it is built
+		from, and is redone if any of them changed, so the
+		manifest does not depend on the full data list, which a
+		follow run does not know in advance. Does nothing if
+		resumeRun is False.
+		"""
+		if not self.resumeRun:
+			self.logger.info("resumeRun set to False, not using a "
+					"run manifest.")
+			return
+		config=configparser.ConfigParser()
+		config.read(self.configFile)
+		runConfig={key : config[self.instrument].get(key) for key in [
+			'burstNumber', 'burstFileForm', 'darkBase', 'dataBase',
+			'darkFilePattern', 'dataFilePattern', 'flatFilePattern',
+			'flatBase', 'noiseFile', 'obsDate', 'obsTime', 'expTimems',
+			'speckledFileForm'
+			]}
+		## Frame selection changes the bursts; without it the
+		## fingerprint is that of earlier runs.
+		if self.qualityCandidates > self.burstNumber:
+			runConfig.update(qualityCandidates=self.qualityCandidates,
+					qualityMetric=self.qualityMetric,
+					qualityStride=self.qualityStride,
+					qualityThreshold=self.qualityThreshold
+					)
+		self.logger.info("Fingerprinting run inputs for manifest: "
+				"{0}".format(self.manifestFile)
+				)
+		fingerprint=manifest_fingerprint(
+				runConfig,
+				self.dataShape,
+				self.imageShape,
+				manifest_file_stats(self.darkList),
+				manifest_file_stats(self.flatList),
+				self.calKeys
+				)
+		self.manifest=runManifest(self.manifestFile, fingerprint, self.logger)
+
+	def rosa_zyla_order_files(self, dataFiles=True):
 		"""
 		Orders sequentially numbered file names in numerical order.
 		Contains a special provision for ordering Zyla files, which 
 		begin with the least-significant digit.
+
+		Parameters
+		----------
+		dataFiles : bool
+			Default True. Set to False to leave dataList as it
+			is.
 		"""
-		def rosa_zyla_order_file_list(fList):
-			if 'ZYLA' in self.instrument:
+		def rosa_zyla_order_file_list(fList, directory, pattern):
+			if self.useDirIndex:
+				## Already ordered by the directory index, which
+				## holds the parsed sequence numbers. Zyla
+				## sequence numbers must run from 0 without gaps.
+				entries=self.rosa_zyla_index_directory(directory,
+						pattern
+						).index_entries()
+				orderList=[f for f, size, mtime, key in entries]
+				if 'ZYLA' in self.instrument:
+					for f, size, mtime, key in entries:
+						if key is None:
+							self.logger.error(
+									"Unexpected filename format: "
+									"{0}".format(f)
+									)
+					if [key for f, size, mtime, key in entries] != list(range(len(entries))):
+						orderList=['']
+			elif 'ZYLA' in self.instrument:
 				orderList=['']*len(fList) ## List length same as fList
 				ptrn='[0-9]+'	#Match any digit one or more times.
 				p=re.compile(ptrn)
@@ -586,7 +2139,7 @@ class rosaZylaCal:
 								"Unexpected filename format: "
 								"{0}".format(f)
 								)
-			if 'ROSA' in self.instrument:
+			elif 'ROSA' in self.instrument:
 				fList.sort()
 				orderList=fList
 			try:
@@ -598,13 +2151,202 @@ class rosaZylaCal:
 				return orderList
 
 		self.logger.info("Sorting darkList.")
-		self.darkList=rosa_zyla_order_file_list(self.darkList)
+		self.darkList=rosa_zyla_order_file_list(self.darkList,
+				self.darkBase, self.darkFilePattern
+				)
 		self.logger.info("Sorting flatList.")
-		self.flatList=rosa_zyla_order_file_list(self.flatList)
-		self.logger.info("Sorting dataList.")
-		self.dataList=rosa_zyla_order_file_list(self.dataList)
+		self.flatList=rosa_zyla_order_file_list(self.flatList,
+				self.flatBase, self.flatFilePattern
+				)
+		if dataFiles:
+			self.logger.info("Sorting dataList.")
+			self.dataList=rosa_zyla_order_file_list(self.dataList,
+					self.dataBase, self.dataFilePattern
+					)
+
+	def rosa_zyla_parse_header_text(self, headerText):
+		"""
+		Parses the keywords of a burst's header text, as kept in
+		the run metadata store. Where a keyword appears more than
+		once, e.g. in both the ROSA extension and primary headers,
+		the first value is kept.
+
+		Parameters
+		----------
+		headerText : str
+			Header text produced by rosa_zyla_build_burst.
+
+		Returns
+		-------
+		dict
+			Keyword values, as bool, int, float or str, in header
+			order. Structural, COMMENT and HISTORY keywords are
+			left out.
+		"""
+		skip=re.compile(r'^(SIMPLE|BITPIX|NAXIS\d*|EXTEND|XTENSION|PCOUNT|'
+				r'GCOUNT|BZERO|BSCALE|COMMENT|HISTORY|END|)$'
+				)
+		keywords={}
+		for line in headerText.splitlines():
+			if '=' not in line:
+				continue
+			key, value=line.split('=', 1)
+			key=key.strip()
+			if skip.match(key) or key in keywords:
+				continue
+			value=value.strip()
+			if value.startswith("'"):
+				value=value[1:].split("'")[0].strip()
+			else:
+				value=value.split('/')[0].strip()
+			if value in ('T', 'F'):
+				value=(value == 'T')
+			else:
+				for convert in (int, float):
+					try:
+						value=convert(value)
+					except ValueError:
+						continue
+					break
+			keywords[key]=value
+		return keywords
+
+	def rosa_zyla_plan_bursts(self, frames=None, firstBurst=0):
+		"""
+		Lays out the burst cubes to be built from dataList. Bursts
+		are numbered in the order of dataList and grouped into
+		batches of 1000. Frames left over after the last full burst
+		are not used.
+
+		Parameters
+		----------
+		frames : list
+			Optional (file, extension) tuples of the frames to
+			lay out, from rosa_zyla_plan_frames. Default None
+			uses every frame of dataList.
+		firstBurst : int
+			Number of the first burst returned. Earlier bursts
+			are numbered but left out, so that a plan can be
+			extended as frames are added. Default 0.
+
+		Returns
+		-------
+		list
+			One dict per burst with keys 'burst', 'batch',
+			'index', 'file', 'frames', and 'header'. 'frames'
+			is a list of (file, extension) tuples, with
+			extension None for Zyla. 'header' is the
+			(file, extension) holding the ROSA header written
+			alongside the burst, or None for Zyla.
+		"""
+		if frames is None:
+			frames=self.rosa_zyla_plan_frames(self.dataList)
+		## With frame selection, each burst is chosen from
+		## qualityCandidates consecutive frames.
+		burstFrameCount=max(self.burstNumber, self.qualityCandidates)
+		burstPlan=[]
+		headerIndex=0
+		for burst in range(len(frames)//burstFrameCount):
+			header=None
+			if 'ROSA' in self.instrument:
+				## ROSA files hold 256 extensions. The header
+				## written with a burst is taken from the
+				## extension counter, wrapped once per file.
+				headerIndex+=burstFrameCount
+				if headerIndex >= 257: headerIndex=headerIndex-256
+			if burst < firstBurst:
+				continue
+			burstFrames=frames[burst*burstFrameCount:(burst+1)*burstFrameCount]
+			burstThsnds=burst//1000
+			burstHndrds=burst%1000
+			if 'ROSA' in self.instrument:
+				header=(burstFrames[-1][0], headerIndex)
+			burstPlan.append({
+				'burst' : burst,
+				'batch' : burstThsnds,
+				'index' : burstHndrds,
+				'file' : os.path.join(
+					self.preSpeckleBase,
+					(self.burstFileForm).format(
+						self.obsDate,
+						self.obsTime,
+						burstThsnds,
+						burstHndrds
+						)
+					),
+				'frames' : burstFrames,
+				'header' : header
+				})
+		return burstPlan
+
+	def rosa_zyla_plan_frames(self, fileList):
+		"""
+		Lists the frames held in a list of data files, in order.
+
+		Parameters
+		----------
+		fileList : list
+			Paths to data files, in order.
+
+		Returns
+		-------
+		list
+			(file, extension) tuple of each frame, with
+			extension None for Zyla.
+		"""
+		frames=[]
+		if 'ZYLA' in self.instrument:
+			frames=[(file, None) for file in fileList]
+		if 'ROSA' in self.instrument:
+			for file in fileList:
+				nExt=self.rosa_zyla_count_extensions(file)
+				frames.extend((file, ext) for ext in range(1, nExt+1))
+		return frames
+
+	def rosa_zyla_prefetch(self, fileList):
+		"""
+		Starts reading image files ahead on a pool of I/O threads,
+		according to the prefetchDepth, prefetchThreads, and
+		prefetchMaxMB configuration values.
+
+		Parameters
+		----------
+		fileList : list
+			A list of file paths, in the order they will be used.
+
+		Returns
+		-------
+		framePrefetcher
+			Yields (file, frames) in the order of fileList.
+		"""
+		def rosa_zyla_prefetch_load(file):
+			with self.rosa_zyla_shared_slot('io'):
+				return self.rosa_zyla_load_file_frames(file, preload=True)
+
+		return framePrefetcher(fileList,
+				rosa_zyla_prefetch_load,
+				depth=self.prefetchDepth,
+				nThreads=self.prefetchThreads,
+				maxBytes=self.prefetchMaxMB*2**20
+				)
+
+	def rosa_zyla_prepare_flatfield(self):
+		"""
+		Prepares the flat-field tables used by
+		rosa_zyla_flatfield_frame. The average dark and gain are
+		converted once per run to C-contiguous, native-endian
+		np.float32, so the per-frame arithmetic runs without
+		byte-swapping or type conversion of the tables. Dark and
+		gain read back from FITS files are big-endian.
+		"""
+		self.flatfieldDark=np.ascontiguousarray(self.avgDark,
+				dtype=np.float32
+				)
+		self.flatfieldGain=np.ascontiguousarray(self.gain,
+				dtype=np.float32
+				)
 
-	def rosa_zyla_read_binary_image(self, file, dataShape=None, imageShape=None, dtype=np.uint16):
+	def rosa_zyla_read_binary_image(self, file, dataShape=None, imageShape=None, dtype=np.uint16, out=None):
 		"""
 		Reads an unformatted binary file. Slices the image as
 		s[i] ~ 0:imageShape[i].
@@ -619,37 +2361,133 @@ class rosaZylaCal:
 			Shape of sub-image or region of interest.
 		dtype : Numpy numerical data type.
 			Default is numpy.uint16.
+		out : numpy.ndarray
+			Optional np.float32 buffer of shape imageShape to read
+			into. Default None allocates a new array.
 
 		Returns
 		-------
 		numpy.ndarray : np.float32, shape imageShape.
 		"""
-		if dataShape is None:
-			dataShape=self.dataShape
-		
-		if imageShape is None:
-			imageShape=self.imageShape
+		im=self.rosa_zyla_map_binary_image(file,
+				dataShape=dataShape,
+				imageShape=imageShape,
+				dtype=dtype
+				)
+		if out is None:
+			out=np.empty(im.shape, dtype=np.float32)
+		np.copyto(out, im, casting='unsafe')
+		return out
+
+	def rosa_zyla_quality_rows(self, burstEntry, quality, keep):
+		"""
+		Lays out the quality of a burst's candidate frames for the
+		run metadata store.
+
+		Parameters
+		----------
+		burstEntry : dict
+			One entry of rosa_zyla_plan_bursts.
+		quality : numpy.ndarray
+			Metrics of the candidate frames, from
+			rosa_zyla_frame_quality.
+		keep : sequence
+			Positions of the frames kept in the burst.
+
+		Returns
+		-------
+		list
+			One list per candidate frame: position, file,
+			extension, mean, contrast, sharpness, and whether
+			the frame was kept. JSON-serializable, for
+			distributed runs.
+		"""
+		keep=set(int(position) for position in keep)
+		return [[position, file, ext, float(quality[position, 0]),
+				float(quality[position, 1]), float(quality[position, 2]),
+				position in keep
+				] for position, (file, ext) in enumerate(burstEntry['frames'])
+				]
+
+	def rosa_zyla_read_cal_key(self, file):
+		"""
+		Reads the CALKEY header keyword of a calibration image file.
+
+		Parameters
+		----------
+		file : str
+			Path to the FITS file.
 
+		Returns
+		-------
+		str or None
+			The key, or None if the file or keyword is missing.
+		"""
 		try:
-			with open(file, mode='rb') as imageFile:
-				imageData=np.fromfile(imageFile,
-						dtype=dtype
-						)
-		except Exception as err:
-			self.logger.critical("Could not open/read binary image file: "
-					"{0}".format(err)
-					)
-			raise
+			return fits.getval(file, 'CALKEY')
+		except (OSError, KeyError):
+			return None
 
-		im=imageData.reshape((dataShape))
-		## Generate a tuple of slice objects, s[i]~ 0:imageShape[i]
-		s=tuple()
-		for t in imageShape:
-			s=s+np.index_exp[0:t]
-		im=im[s]
-		return np.float32(im)
+	def rosa_zyla_read_fits_image(self, file):
+		"""
+		Reads the image of a FITS file written by
+		rosa_zyla_save_fits_image, compressed or not.
+
+		Parameters
+		----------
+		file : str
+			Path to the FITS file.
+
+		Returns
+		-------
+		numpy.ndarray
+			Data of the first HDU holding an image.
+		"""
+		with fits.open(file) as hdu:
+			for ext in hdu:
+				if ext.is_image and ext.data is not None:
+					return ext.data
+
+	def rosa_zyla_record_burst(self, burstEntry, headerText, timestamp=None, quality=None):
+		"""
+		Records a saved burst in the run metadata store and the run
+		manifest. The manifest entry lists the data files the
+		burst is built from.
 
-	def rosa_zyla_run_calibration(self, saveBursts=True):
+		Parameters
+		----------
+		burstEntry : dict
+			One entry of the burst plan produced by
+			rosa_zyla_plan_bursts.
+		headerText : str
+			Header text of the burst.
+		timestamp : str
+			Optional timestamp of the burst.
+		quality : list
+			Optional quality of the burst's candidate frames,
+			from rosa_zyla_quality_rows.
+		"""
+		self.rosa_zyla_get_metadata().metadata_put(burstEntry['batch'],
+				burstEntry['index'],
+				burstEntry['burst'],
+				burstEntry['file'],
+				headerText,
+				timestamp
+				)
+		if quality is not None:
+			self.rosa_zyla_get_metadata().metadata_put_quality(burstEntry['batch'],
+					burstEntry['index'],
+					quality
+					)
+		if self.manifest is not None:
+			self.manifest.manifest_record('burst', burstEntry['file'],
+					[burstEntry['file']],
+					sources=list(dict.fromkeys(
+						f for f, ext in burstEntry['frames']
+						))
+					)
+
+	def rosa_zyla_run_calibration(self, saveBursts=True, batchCallback=None, follow=False):
 		"""
 		The main calibration method for standard ROSA or Zyla data.
 
@@ -659,17 +2497,45 @@ class rosaZylaCal:
 		saveBursts : bool
 			Default True. Set to True to save burst cubes.
 			Set to False to skip saving burst cubes.
+		batchCallback : callable
+			Optional function passed to rosa_zyla_save_bursts,
+			called with each batch number as its bursts are
+			completed.
+		follow : bool
+			Default False. Set to True to calibrate data files
+			as they are written, during observing. dataBase is
+			not searched up front, and bursts are saved by
+			rosa_zyla_follow_bursts instead of
+			rosa_zyla_save_bursts.
 		"""
 		self.rosa_zyla_configure_run()
 		self.logger.info("Starting standard {0} calibration.".format(self.instrument)
 				)
-		self.rosa_zyla_get_file_lists()
-		self.rosa_zyla_order_files()
-		self.rosa_zyla_get_data_image_shapes(self.flatList[0])
+		if self.distributedBursts and not follow:
+			## Burst workers joining while the plan is prepared wait
+			## for it, rather than stop at the previous run's. Bursts
+			## may be saved later, e.g. by kisip_despeckle_pipelined.
+			self.rosa_zyla_open_burst_queue().queue_prepare()
+		with self.metrics.metrics_stage('file_discovery') as record:
+			self.rosa_zyla_get_file_lists(dataFiles=not follow)
+			self.rosa_zyla_order_files(dataFiles=not follow)
+			record['files']=len(self.darkList)+len(self.flatList)+(
+					0 if follow else len(self.dataList)
+					)
+		with self.metrics.metrics_stage('shape_detection', frames=1, files=1):
+			self.rosa_zyla_get_data_image_shapes(self.flatList[0])
+		with self.metrics.metrics_stage('shape_check') as record:
+			self.rosa_zyla_check_dark_data_flat_shapes()
+			record['files']=len(self.darkList)+len(self.flatList)+len(self.dataList)
 		self.rosa_zyla_get_cal_images()
 		self.rosa_zyla_save_cal_images()
-		if saveBursts:
-			self.rosa_zyla_save_bursts()
+		if self.computeNoise:
+			self.rosa_zyla_compute_noise_file()
+		self.rosa_zyla_open_manifest()
+		if saveBursts and follow:
+			self.rosa_zyla_follow_bursts(batchCallback=batchCallback)
+		elif saveBursts:
+			self.rosa_zyla_save_bursts(batchCallback=batchCallback)
 		else:
 			self.logger.info("SaveBursts set to {0}. "
 					"Skipping the save bursts step.".format(saveBursts)
@@ -707,133 +2573,322 @@ class rosaZylaCal:
 		dt = TimeDelta(0.001 * int(self.expTimems) * int(self.burstNumber) * file_number,format = 'sec')
 		return (t + dt)
 
-	def rosa_zyla_save_bursts(self):
+	def rosa_zyla_save_burst(self, burstEntry, burstCube=None, fileFrames=None):
 		"""
-		Main method to save burst cubes formatted for KISIP.
+		Flat-fields the frames of a single burst and saves the burst
+		cube.
+
+		Parameters
+		----------
+		burstEntry : dict
+			One entry of the burst plan produced by
+			rosa_zyla_plan_bursts.
+		burstCube : numpy.ndarray
+			Optional np.float32 buffer of shape
+			(burstNumber,)+imageShape to build the burst in.
+			Default None reuses the buffer held in the
+			burstCube attribute.
+		fileFrames : callable
+			Optional function returning the list of frames in a
+			file. Default None uses rosa_zyla_load_file_frames.
+
+		Returns
+		-------
+		tuple
+			(path to the saved burst cube, header text,
+			timestamp, frame quality).
+		"""
+		if burstCube is None:
+			burstShape=(self.burstNumber,)+self.imageShape
+			if self.burstCube is None or self.burstCube.shape != burstShape:
+				self.burstCube=np.empty(burstShape, dtype=np.float32)
+			burstCube=self.burstCube
+		headerText, timestamp, quality=self.rosa_zyla_build_burst(burstEntry,
+				burstCube, fileFrames
+				)
+		self.rosa_zyla_save_binary_image_cube(
+				burstCube,
+				burstEntry['file']
+				)
+		return burstEntry['file'], headerText, timestamp, quality
+
+	def rosa_zyla_save_bursts(self, burstWorkers=None, batchCallback=None):
 		"""
-		def rosa_zyla_flatfield_correction(data):
-			corrected=self.gain*(data-self.avgDark)
-			return corrected
+		Main method to save burst cubes formatted for KISIP.
 
+		Parameters
+		----------
+		burstWorkers : int
+			Number of worker processes used to build bursts.
+			Default None uses the burstWorkers configuration
+			value. A value of 1 builds bursts serially. Not
+			used if distributedBursts is set, when bursts are
+			built by this process and any burst workers through
+			rosa_zyla_save_bursts_distributed.
+		batchCallback : callable
+			Optional function called with the batch number as
+			soon as the last burst of that batch is saved, while
+			the following batches are still being built.
+		"""
 		def rosa_zyla_print_progress_save_bursts():
 			self.logger.info("Progress: {:0.2%} "
 					"with file: {:s}".format(
 						burst/lastBurst,
-						burstFile
+						burstEntry['file']
 						)
 					)
 
-		burstShape=(self.burstNumber,)+self.imageShape
-		self.logger.info("Preparing burst files, saving in directory: "
-				"{0}".format(self.preSpeckleBase)
-				)
-		self.logger.info("Number of files to be read: "
-				"{0}".format(len(self.dataList))
-				)
-		self.logger.info("Flat-fielding and saving data to burst files "
-				"with burst number: {0}: shape: {1}".format(
-					self.burstNumber, burstShape
+		with self.metrics.metrics_stage('save_bursts') as record:
+			if burstWorkers is None:
+				burstWorkers=self.burstWorkers
+			burstShape=(self.burstNumber,)+self.imageShape
+			self.logger.info("Preparing burst files, saving in directory: "
+					"{0}".format(self.preSpeckleBase)
 					)
-				)
-		burstCube=np.zeros(burstShape, dtype=np.float32)
-		burst=0
-		batch=-1
-		if 'ZYLA' in self.instrument:
-			lastBurst=len(self.dataList)//self.burstNumber
-			lastFile=lastBurst*self.burstNumber
-			i=0
-			for file in self.dataList[:lastFile]:
-				data=self.rosa_zyla_read_binary_image(file)
-				burstCube[i, :, :]=rosa_zyla_flatfield_correction(data)
-				i+=1
-				if i==self.burstNumber:
-					burstThsnds=burst//1000
-					burstHndrds=burst%1000
-					burstFile=os.path.join(
-						self.preSpeckleBase,
-						(self.burstFileForm).format(
-								self.obsDate,
-								self.obsTime,
-								burstThsnds,
-								burstHndrds
+			self.logger.info("Number of files to be read: "
+					"{0}".format(len(self.dataList))
+					)
+			self.logger.info("Flat-fielding and saving data to burst files "
+					"with burst number: {0}: shape: {1}".format(
+						self.burstNumber, burstShape
+						)
+					)
+			self.rosa_zyla_prepare_flatfield()
+			burstPlan=self.rosa_zyla_plan_bursts()
+			lastBurst=len(burstPlan)
+			burstTodo=[burstEntry for burstEntry in burstPlan
+					if not self.rosa_zyla_burst_done(burstEntry)
+					]
+			if len(burstTodo) < lastBurst:
+				self.logger.info("Run manifest: {0} of {1} bursts already "
+						"complete, skipping them.".format(
+							lastBurst-len(burstTodo), lastBurst
 							)
 						)
-					text_file = open(burstFile+'.txt', "w")
-					text_file.write('DATE    ='+ self.zyla_time(1000*burstThsnds+burstHndrds).fits + "\n")
-					text_file.write('EXPOSURE='+ self.expTimems)
-					text_file.close()
-					self.rosa_zyla_save_binary_image_cube(
-							burstCube,
-							burstFile
+			todoFiles=list(dict.fromkeys(f for burstEntry in burstTodo
+				for f, ext in burstEntry['frames']
+				))
+			record['files']=len(todoFiles)
+			record['bytesRead']=sum(os.path.getsize(f) for f in todoFiles)
+			prefetcher=None
+			if self.distributedBursts and len(burstTodo) > 0:
+				self.logger.info("Building bursts through the distributed "
+						"burst queue: {0}".format(self.queueDir)
+						)
+				burstFiles=self.rosa_zyla_save_bursts_distributed(burstTodo)
+			elif burstWorkers > 1 and len(burstTodo) > 1:
+				self.logger.info("Building bursts with {0} worker "
+						"processes.".format(burstWorkers)
 						)
-					i=0
-					burst+=1
-					rosa_zyla_print_progress_save_bursts()
-					if burstThsnds != batch:
-						batch=burstThsnds
-						(self.batchList).append(batch)
-					burstCube=np.zeros(burstShape,
-							dtype=np.float32
+				burstFiles=self.rosa_zyla_save_bursts_parallel(burstTodo,
+						burstWorkers
+						)
+			else:
+				fileFrames=None
+				if self.prefetchDepth > 0:
+					prefetcher=self.rosa_zyla_prefetch(todoFiles)
+					fileFrames=prefetcher.prefetch_get
+				if self.burstWriteBuffers > 1:
+					burstFiles=self.rosa_zyla_save_bursts_async(burstTodo,
+							self.burstWriteBuffers,
+							fileFrames
 							)
-		if 'ROSA' in self.instrument:
-			i=0
-			header_index = 0
-			for file in self.dataList:
-				with fits.open(file) as hdu:
-					for hduExt in hdu[1:]:
-						if (burst == 0) and (i == 0):
-							lastBurst=len(self.dataList)*len(hdu[1:])//self.burstNumber
-						burstCube[i, :, :]=rosa_zyla_flatfield_correction(hduExt.data)
-						i+=1
-						header_index+=1
-						if i==self.burstNumber:
-							burstThsnds=burst//1000
-							burstHndrds=burst%1000
-							burstFile=os.path.join(
-								self.preSpeckleBase,
-								(self.burstFileForm).format(
-									self.obsDate,
-									self.obsTime,
-									burstThsnds,
-									burstHndrds
-									)
-								)
-                            #here I should embed a line writting txt file with header
-                            #this could probably make another module
-							text_file = open(burstFile+'.txt', "w")
-							if header_index >= 257:	header_index = header_index - 256 
-							text_file.write(repr(hdu[header_index].header)+"\n")
-							text_file.write("\n")
-							text_file.write(repr(hdu[0].header))
-							#print(burstFile)
-							#keywords = list(hdu[burstThsnds].header.keys())
-							#for L in range (len(keywords)):
-								#text_file.writelines(keywords[L])
-#								text_file.writelines(hdu[burstThsnds].header[L])
-							text_file.close()
-                            #the end of my alternations related to a header export
-							self.rosa_zyla_save_binary_image_cube(
-									burstCube,
-									burstFile
+				else:
+					burstFiles=(self.rosa_zyla_save_burst(burstEntry,
+							fileFrames=fileFrames
+							) for burstEntry in burstTodo
+							)
+			metadata=self.rosa_zyla_get_metadata()
+			burst=0
+			batch=-1
+			try:
+				## Walk the plan in order as bursts are saved. Bursts that
+				## were already complete are passed over in between, and
+				## after the last saved burst.
+				burstEntries=iter(burstPlan)
+				planIndex={burstEntry['file'] : i for i, burstEntry in enumerate(burstPlan)}
+				for burstFile, headerText, timestamp, quality in itertools.chain(burstFiles,
+						[(None, None, None, None)]
+						):
+					try:
+						assert(burstFile is None or planIndex.get(burstFile, -1) >= burst), (
+								"Saved burst is not among the bursts still "
+								"to come in the plan: {0}".format(burstFile)
 								)
-							i=0
-							burst+=1
-							rosa_zyla_print_progress_save_bursts()
-							if burstThsnds != batch:
-								batch=burstThsnds
-								(self.batchList).append(batch)
-							burstCube=np.zeros(burstShape,
-										dtype=np.float32
-										)
-	
-		self.logger.info("Burst files complete: {0}".format(self.preSpeckleBase))
+					except AssertionError as err:
+						self.logger.critical("Fatal: {0}".format(err))
+						raise
+					for burstEntry in burstEntries:
+						burst+=1
+						rosa_zyla_print_progress_save_bursts()
+						if burstEntry['file'] == burstFile:
+							self.rosa_zyla_record_burst(burstEntry,
+									headerText,
+									timestamp,
+									quality
+									)
+							record['frames']+=len(burstEntry['frames'])
+							record['bytesWritten']+=int(np.prod(burstShape))*4
+						if burstEntry['batch'] != batch:
+							batch=burstEntry['batch']
+							(self.batchList).append(batch)
+						if burst == lastBurst or burstPlan[burst]['batch'] != batch:
+							self.rosa_zyla_complete_batch(batch, batchCallback)
+						if burstEntry['file'] == burstFile:
+							break
+			finally:
+				metadata.metadata_commit()
+				if prefetcher is not None:
+					prefetcher.prefetch_close()
+
+			self.logger.info("Burst files complete: {0}".format(self.preSpeckleBase))
+
+	def rosa_zyla_save_bursts_async(self, burstPlan, nBuffers, fileFrames=None):
+		"""
+		Saves burst cubes in this process, handing each finished
+		cube to a background burstWriter, so that the next burst
+		is assembled while the previous one is written.
+
+		Parameters
+		----------
+		burstPlan : list
+			Burst plan produced by rosa_zyla_plan_bursts.
+		nBuffers : int
+			Number of burst buffers shared with the writer.
+		fileFrames : callable
+			Optional function returning the list of frames in a
+			file. Default None uses rosa_zyla_load_file_frames.
+
+		Yields
+		------
+		tuple
+			(path to the burst cube, header text, timestamp,
+			frame quality) for each burst once its cube is on
+			disk, in burst order.
+		"""
+		writer=burstWriter((self.burstNumber,)+self.imageShape,
+				nBuffers=nBuffers,
+				logger=self.logger
+				)
+		burstHeaders={}
+		try:
+			for burstEntry in burstPlan:
+				burstCube=writer.writer_get_buffer()
+				burstHeaders[burstEntry['file']]=self.rosa_zyla_build_burst(
+						burstEntry, burstCube, fileFrames
+						)
+				writer.writer_submit(burstCube, burstEntry['file'])
+				for burstFile in writer.writer_completed():
+					yield (burstFile,)+burstHeaders.pop(burstFile)
+		finally:
+			writer.writer_close()
+		for burstFile in writer.writer_completed():
+			yield (burstFile,)+burstHeaders.pop(burstFile)
+
+	def rosa_zyla_save_bursts_distributed(self, burstPlan):
+		"""
+		Saves burst cubes through a work queue on the shared
+		workBase filesystem, so that burst workers on any number of
+		nodes, see rosa_zyla_burst_worker, build them alongside this
+		process. The plan is split into tasks of queueBurstsPerTask
+		bursts and published with the flat-field tables, which the
+		workers load rather than compute. This process claims tasks
+		like any worker, recovers the tasks of workers that died,
+		and closes the queue once every task is done, so that
+		workers still polling it, or joining later, stop.
+
+		Parameters
+		----------
+		burstPlan : list
+			Burst plan produced by rosa_zyla_plan_bursts.
+
+		Yields
+		------
+		tuple
+			(path to the burst cube, header text, timestamp,
+			frame quality) for each burst, in burst order, once it
+			and all earlier bursts are saved.
+		"""
+		queue=self.rosa_zyla_open_burst_queue()
+		queue.queue_prepare()
+		os.makedirs(self.queueDir, exist_ok=True)
+		setup={'dataShape' : [int(n) for n in self.dataShape],
+			'imageShape' : [int(n) for n in self.imageShape],
+			'calKeys' : self.calKeys
+			}
+		for name in ['flatfieldDark', 'flatfieldGain']:
+			setup[name]=os.path.join(self.queueDir, '{0}.npy'.format(name))
+			tmpFile='{0}.{1}.tmp'.format(setup[name], os.getpid())
+			with open(tmpFile, mode='wb') as f:
+				np.save(f, getattr(self, name))
+			os.replace(tmpFile, setup[name])
+		burstsPerTask=max(1, self.queueBurstsPerTask)
+		tasks=[burstPlan[i:i+burstsPerTask] for i in range(0, len(burstPlan), burstsPerTask)]
+		queue.queue_publish(tasks, setup)
+		nextTask=0
+		while nextTask < len(tasks):
+			result=queue.queue_result(nextTask)
+			if result is not None:
+				for burstFile, headerText, timestamp, quality in result:
+					yield burstFile, headerText, timestamp, quality
+				nextTask+=1
+				continue
+			claim=queue.queue_claim()
+			if claim is not None:
+				self.rosa_zyla_work_burst_task(queue, *claim)
+				continue
+			if queue.queue_recover() == 0:
+				status=queue.queue_status()
+				self.logger.info("Burst queue: waiting for workers: {0} tasks "
+						"claimed, {1} done of {2}.".format(
+							status['claimed'], status['done'], len(tasks)
+							)
+						)
+				time.sleep(self.queuePollInterval)
+		queue.queue_close()
+
+	def rosa_zyla_save_bursts_parallel(self, burstPlan, burstWorkers):
+		"""
+		Saves burst cubes on a pool of worker processes. The
+		flat-field tables are placed in shared memory once and
+		attached by each worker, rather than being sent with every
+		burst.
+
+		Parameters
+		----------
+		burstPlan : list
+			Burst plan produced by rosa_zyla_plan_bursts.
+		burstWorkers : int
+			Number of worker processes.
+
+		Yields
+		------
+		tuple
+			(path to the saved burst cube, header text,
+			timestamp, frame quality) for each burst, in burst
+			order.
+		"""
+		chunkSize=max(1, len(burstPlan)//(4*burstWorkers))
+		try:
+			with self.rosa_zyla_worker_pool(burstWorkers,
+					['flatfieldDark', 'flatfieldGain']
+					) as pool:
+				yield from pool.imap(_rosa_zyla_pool_call,
+						[('rosa_zyla_save_burst', burstEntry)
+							for burstEntry in burstPlan],
+						chunkSize
+						)
+		except Exception as err:
+			self.logger.critical("Parallel burst run failed: {0}".format(err))
+			raise
 
 	def rosa_zyla_save_cal_images(self):
 		"""
-		Saves average dark, average flat, gain, and noise images
-		in FITS format.
+		Saves average dark, average flat, and gain images in FITS
+		format. The noise cube is saved by
+		rosa_zyla_compute_noise_file.
 		"""
-		if os.path.exists(self.darkFile):
+		if self.rosa_zyla_read_cal_key(self.darkFile) == self.calKeys['dark']:
 			self.logger.info("Dark file already exists: {}".format(self.darkFile))
 		else:
 			self.logger.info("Saving average dark: "
@@ -848,9 +2903,12 @@ class rosaZylaCal:
 					os.path.join(
 						self.workBase,
 						self.darkFile
-						)
+						),
+					compression=self.calCompression,
+					quantizeLevel=self.calQuantizeLevel
 					)
-		if os.path.exists(self.flatFile):
+			self.rosa_zyla_write_cal_key(self.darkFile, self.calKeys['dark'])
+		if self.rosa_zyla_read_cal_key(self.flatFile) == self.calKeys['flat']:
 			self.logger.info("Flat file already exists: {0}".format(self.flatFile))
 		else:
 			self.logger.info("Saving average flat: "
@@ -865,9 +2923,12 @@ class rosaZylaCal:
 					os.path.join(
 						self.workBase,
 						self.flatFile
-						)
+						),
+					compression=self.calCompression,
+					quantizeLevel=self.calQuantizeLevel
 					)
-		if os.path.exists(self.gainFile):
+			self.rosa_zyla_write_cal_key(self.flatFile, self.calKeys['flat'])
+		if self.rosa_zyla_read_cal_key(self.gainFile) == self.calKeys['gain']:
 			self.logger.info("Gain file already exists: {0}".format(self.gainFile))
 		else:
 			self.logger.info("Saving gain: "
@@ -882,88 +2943,310 @@ class rosaZylaCal:
 					os.path.join(
 						self.workBase,
 						self.gainFile
+						),
+					compression=self.calCompression,
+					quantizeLevel=self.calQuantizeLevel
+					)
+			self.rosa_zyla_write_cal_key(self.gainFile, self.calKeys['gain'])
+
+	def rosa_zyla_save_despeckled_as_fits(self, batch=None, fitsWorkers=None):
+		"""
+		Saves despeckled (processed unformatted binary) KISIP images as
+		FITS images. Images whose FITS file is already up to date
+		are skipped, so this can be called for each batch as KISIP
+		finishes it and again at the end of the run.
+
+		Parameters
+		----------
+		batch : int
+			Optional KISIP batch number. Default None converts the
+			images of all batches.
+		fitsWorkers : int
+			Number of worker processes. Default None uses the
+			fitsWorkers configuration value.
+		"""
+		with self.metrics.metrics_stage('fits_conversion', batch=batch) as record:
+			if fitsWorkers is None:
+				fitsWorkers=self.fitsWorkers
+			if batch is None:
+				self.logger.info("Saving despeckled binary image files to FITS.")
+				filePattern=self.speckledFileForm.format(
+						self.obsDate, self.obsTime, 0, 0
+						)[:-7]+'*.final'
+			else:
+				self.logger.info("Saving despeckled binary image files of batch "
+						"{0} to FITS.".format(batch)
 						)
+				filePattern=self.speckledFileForm.format(
+						self.obsDate, self.obsTime, batch, 0
+						)[:-3]+'[0-9][0-9][0-9].final'
+			self.logger.info("Searching for files: "
+					"{0}".format(os.path.join(self.speckleBase, filePattern))
 					)
-		if os.path.exists(self.noiseFileFits):
-			self.logger.info("Noise FITS file already exists: {0}".format(self.noiseFileFits))
-		else:
-			self.logger.info("Saving noise: "
-					"{0}".format(
-						os.path.join(
-							self.workBase,
-							self.noiseFileFits
+			if self.useDirIndex:
+				fList=self.rosa_zyla_index_directory(self.speckleBase, '*.final',
+						persist=False, level0=False
+						).index_files(filePattern)
+			else:
+				fList=sorted(glob.glob(os.path.join(self.speckleBase, filePattern)))
+			metadata=self.rosa_zyla_get_metadata()
+		
+			try:
+				assert(len(fList) != 0)
+			except Exception as err:
+				self.logger.critical("CRITICAL: no files found: {0}".format(err))
+				raise
+			else:
+				self.logger.info("Found {0} files.".format(len(fList)))
+			if self.postSpeckleCube != 'none':
+				if self.postSpeckleCube == 'run':
+					if batch is not None:
+						self.logger.info("postSpeckleCube set to run, the cube "
+								"is written once all batches are done."
+								)
+						return
+					cubeFiles={os.path.join(self.postSpeckleBase,
+						'{0}_{1}_{2}.cube.fits'.format(
+							self.obsDate, self.obsTime, self.instrument.lower()
 							)
+						) : fList}
+				else:
+					cubeFiles={}
+					for file in fList:
+						cubeFiles.setdefault(os.path.join(self.postSpeckleBase,
+							os.path.basename(file).rsplit('.', 2)[0]+'.cube.fits'
+							), []).append(file)
+				for cubeFile, cubeList in cubeFiles.items():
+					if self.rosa_zyla_fits_done(cubeFile, cubeList):
+						self.logger.info("FITS cube already up to date, "
+								"skipped: {0}".format(cubeFile)
+								)
+						continue
+					if not self.rosa_zyla_save_despeckled_cube(cubeList, cubeFile):
+						continue
+					record['frames']+=len(cubeList)
+					record['files']+=len(cubeList)
+					record['bytesRead']+=sum(os.path.getsize(f) for f in cubeList)
+					record['bytesWritten']+=os.path.getsize(cubeFile)
+					if self.manifest is not None:
+						self.manifest.manifest_record('fits', cubeFile, [cubeFile],
+								sources=cubeList,
+								params=self.rosa_zyla_fits_params(cubeList)
+								)
+				self.logger.info("Finished saving despeckled images as FITS "
+						"cubes in directory: {0}".format(self.postSpeckleBase))
+				return
+			fitsTodo=[]
+			for file in fList:
+				fitsFile=os.path.join(self.postSpeckleBase,
+						os.path.basename(file)+'.fits'
 						)
-					)
-			self.rosa_zyla_save_fits_image(self.noise,
-					os.path.join(
-						self.workBase,
-						self.noiseFileFits
+				if self.rosa_zyla_fits_done(fitsFile, [file]):
+					continue
+				batchIndex=file.split('speckle.batch.')[1].split('.')
+				burstMeta=metadata.metadata_get(int(batchIndex[0]), int(batchIndex[1]))
+				if burstMeta is None:
+					self.logger.warning("No header found in run metadata for: "
+							"{0}".format(file)
+							)
+					header=''
+				else:
+					header=burstMeta['header'].splitlines(keepends=True)
+				fitsTodo.append((file, fitsFile, header))
+			if len(fitsTodo) < len(fList):
+				self.logger.info("{0} of {1} FITS files already up to date, "
+						"skipped.".format(len(fList)-len(fitsTodo), len(fList))
 						)
-					)
+			fitsWorkers=min(fitsWorkers, len(fitsTodo))
+			if fitsWorkers > 1:
+				self.logger.info("Saving FITS files with {0} worker "
+						"processes.".format(fitsWorkers)
+						)
+				with self.rosa_zyla_worker_pool(fitsWorkers) as pool:
+					pool.map(_rosa_zyla_pool_call,
+							[('rosa_zyla_save_despeckled_image',)+task
+								for task in fitsTodo],
+							max(1, len(fitsTodo)//(4*fitsWorkers))
+							)
+			else:
+				for task in fitsTodo:
+					self.rosa_zyla_save_despeckled_image(*task)
+			for (file, fitsFile, header) in fitsTodo:
+				if os.path.exists(fitsFile):
+					record['frames']+=1
+					record['files']+=1
+					record['bytesRead']+=os.path.getsize(file)
+					record['bytesWritten']+=os.path.getsize(fitsFile)
+			if self.manifest is not None:
+				for (file, fitsFile, header) in fitsTodo:
+					if os.path.exists(fitsFile):
+						self.manifest.manifest_record('fits', fitsFile, [fitsFile],
+								sources=[file],
+								params=self.rosa_zyla_fits_params([file])
+								)
+			self.logger.info("Finished saving despeckled images as FITS "
+					"in directory: {0}".format(self.postSpeckleBase))
 
-	def rosa_zyla_save_despeckled_as_fits(self):
+	def rosa_zyla_save_despeckled_cube(self, fileList, cubeFile):
 		"""
-		Saves despeckled (processed unformatted binary) KISIP images as
-		FITS images.
-		"""
-		self.logger.info("Saving despeckled binary image files to FITS.")
-		self.logger.info("Searching for files: "
-				"{0}".format(
-					os.path.join(self.speckleBase,
-						self.speckledFileForm.format(
-							self.obsDate, self.obsTime, 0, 0
-							)[:-7]+'*.final'
+		Saves despeckled KISIP images as one time-series FITS cube.
+		The images are streamed into the primary HDU one at a time,
+		so the cube is never held in memory. A binary table
+		extension, FRAMES, holds one row per frame with its source
+		file, batch, index, burst number, and timestamp, plus a
+		column for each burst header keyword whose value changes
+		from frame to frame. Keywords with the same value in every
+		frame go to the primary header.
+
+		Parameters
+		----------
+		fileList : list
+			Paths to the despeckled (.final) images, in time
+			order.
+		cubeFile : str
+			Path to the FITS cube to save to.
+
+		Returns
+		-------
+		bool
+			True if the cube was written. False if writing it
+			failed, in which case cubeFile is left as it was.
+		"""
+		self.logger.info("Saving {0} despeckled images to FITS cube: "
+				"{1}".format(len(fileList), cubeFile)
+				)
+		metadata=self.rosa_zyla_get_metadata()
+		frameMeta=[]
+		for file in fileList:
+			batchIndex=file.split('speckle.batch.')[1].split('.')
+			burstMeta=metadata.metadata_get(int(batchIndex[0]), int(batchIndex[1]))
+			if burstMeta is None:
+				self.logger.warning("No header found in run metadata for: "
+						"{0}".format(file)
 						)
-					)
+				burstMeta={'batch' : int(batchIndex[0]),
+					'index' : int(batchIndex[1]),
+					'burst' : -1,
+					'timestamp' : None,
+					'header' : ''
+					}
+			frameMeta.append((burstMeta,
+				self.rosa_zyla_parse_header_text(burstMeta['header'])
+				))
+		## Keywords found in every frame's header are either
+		## constant, for the primary header, or per-frame columns.
+		keywords=[key for key in frameMeta[0][1]
+				if all(key in keys for meta, keys in frameMeta)
+				]
+		constant=[key for key in keywords
+				if all(keys[key] == frameMeta[0][1][key] for meta, keys in frameMeta)
+				]
+		varying=[key for key in keywords if key not in constant]
+
+		header=fits.Header()
+		header['SIMPLE']=True
+		header['BITPIX']=-32
+		header['NAXIS']=3
+		header['NAXIS1']=self.imageShape[1]
+		header['NAXIS2']=self.imageShape[0]
+		header['NAXIS3']=len(fileList)
+		header['EXTEND']=True
+		for key in constant:
+			try:
+				header[key]=frameMeta[0][1][key]
+			except ValueError:
+				self.logger.warning("Could not copy keyword to FITS cube "
+						"header: {0}".format(key)
+						)
+		columns=[
+			fits.Column(name='FILE', format='A{0}'.format(
+				max(len(os.path.basename(file)) for file in fileList)),
+				array=[os.path.basename(file) for file in fileList]
+				),
+			fits.Column(name='BATCH', format='J',
+				array=[meta['batch'] for meta, keys in frameMeta]
+				),
+			fits.Column(name='INDEX', format='J',
+				array=[meta['index'] for meta, keys in frameMeta]
+				),
+			fits.Column(name='BURST', format='J',
+				array=[meta['burst'] for meta, keys in frameMeta]
+				),
+			fits.Column(name='TIMESTAMP', format='A32',
+				array=[meta['timestamp'] or '' for meta, keys in frameMeta]
 				)
-		fList=glob.glob(os.path.join(self.speckleBase, 
-			self.speckledFileForm.format(
-				self.obsDate, self.obsTime, 0, 0
-				)[:-7]+'*.final'
-			)
-			)
-		fListOrder = []
-		for b in range (len(fList)):
-			proxy1 = fList[b].split('speckle.batch.')
-			proxy2 = proxy1[1].split('.')
-			fListOrder.append(proxy2[0]+proxy2[1])
-		fListOrder = [int(s) for s in fListOrder]
-		header_prefix = self.preSpeckleBase+'/'+self.obsDate+'_'+self.obsTime
-		headerList = glob.glob(header_prefix+'*.txt')
-		headerListOrder = []
-		for b in range (len(headerList)):
-			proxy1 = headerList[b].split('raw.batch.')
-			proxy2 = proxy1[1].split('.')
-			headerListOrder.append(proxy2[0]+proxy2[1])
-		headerListOrder = [int(s) for s in headerListOrder]
-		
+			]
+		for key in varying:
+			values=[keys[key] for meta, keys in frameMeta]
+			if all(isinstance(value, bool) for value in values):
+				columnFormat='L'
+			elif all(isinstance(value, int) and not isinstance(value, bool)
+					for value in values):
+				columnFormat='K'
+			elif all(isinstance(value, (int, float)) and not isinstance(value, bool)
+					for value in values):
+				columnFormat='D'
+			else:
+				values=[str(value) for value in values]
+				columnFormat='A{0}'.format(max(1, max(len(value) for value in values)))
+			columns.append(fits.Column(name=key, format=columnFormat, array=values))
+		frameTable=fits.BinTableHDU.from_columns(columns)
+		frameTable.header['EXTNAME']='FRAMES'
+
+		tmpFile='{0}.{1}.tmp'.format(cubeFile, os.getpid())
 		try:
-			assert(len(fList) != 0)
-		except Exception as err:
-			self.logger.critical("CRITICAL: no files found: {0}".format(err))
-			raise
-		else:
-			self.logger.info("Found {0} files.".format(len(fList)))
-		for i in range(len(fList)):
-			im=self.rosa_zyla_read_binary_image(fList[i],
+			cube=fits.StreamingHDU(tmpFile, header)
+			for file in fileList:
+				cube.write(self.rosa_zyla_map_binary_image(file,
 					imageShape=self.imageShape,
 					dataShape=self.imageShape,
 					dtype=np.float32
+					))
+			cube.close()
+			with fits.open(tmpFile, mode='append') as hdul:
+				hdul.append(frameTable)
+			os.replace(tmpFile, cubeFile)
+		except Exception as err:
+			self.logger.warning("Could not write FITS cube: "
+					"{0}: {1}".format(cubeFile, err)
 					)
-			fName=os.path.basename(fList[i])
-			my_file_index = headerListOrder.index(fListOrder[i])
-			headerFile = open(headerList[my_file_index], "r")
-			self.rosa_zyla_save_fits_image(im, os.path.join( 
-				self.postSpeckleBase,
-				fName+'.fits'
-				), headerFile.readlines()
+			if os.path.exists(tmpFile):
+				os.remove(tmpFile)
+			return False
+		return True
+
+	def rosa_zyla_save_despeckled_image(self, file, fitsFile, header=''):
+		"""
+		Saves one despeckled KISIP image as a FITS image. The image
+		is memory-mapped rather than copied.
+
+		Parameters
+		----------
+		file : str
+			Path to the despeckled (.final) image.
+		fitsFile : str
+			Path to the FITS file to save to.
+		header : list
+			Header lines, passed to rosa_zyla_save_fits_image.
+
+		Returns
+		-------
+		str
+			Path to the FITS file.
+		"""
+		im=self.rosa_zyla_map_binary_image(file,
+				imageShape=self.imageShape,
+				dataShape=self.imageShape,
+				dtype=np.float32
+				)
+		self.rosa_zyla_save_fits_image(im, fitsFile, header,
+				compression=self.postSpeckleCompression,
+				quantizeLevel=self.postSpeckleQuantizeLevel
 				)
-			headerFile.close()
-		self.logger.info("Finished saving despeckled images as FITS "
-				"in directory: {0}".format(self.postSpeckleBase))
+		return fitsFile
 
-	def rosa_zyla_save_fits_image(self, image, file, header='', clobber=True):
+	def rosa_zyla_save_fits_image(self, image, file, header='', clobber=True,
+			compression='none', quantizeLevel=16):
 		"""
 		Saves 2-dimensional image data to a FITS file.
 
@@ -975,6 +3258,15 @@ class rosaZylaCal:
 			Path to file to save to.
 		clobber : bool
 			Overwrite existing file if True, otherwise do not overwrite. 
+		compression : str
+			FITS tile compression type, e.g. 'RICE_1' or 'GZIP_2'.
+			Default 'none' writes an uncompressed primary HDU.
+			Compressed images are written to the first extension,
+			after an empty primary HDU.
+		quantizeLevel : float
+			Quantization level of floating-point data for tile
+			compression. 0 with GZIP compresses losslessly.
+			Default 16.
 		"""
 		#for i in range(len(header)): header[i].translate({ord("'"): None})
 		#print(header)
@@ -1012,8 +3304,16 @@ class rosaZylaCal:
 				hdr['comment'] = 'WARNING: Timestamps were reconstructed during the data reduction.' 
 				hdr['comment'] = 'Timestamp = start time + burst number * time exposure * file number'
 			hdul = fits.HDUList([hdu])
+		if compression != 'none':
+			hdul=fits.HDUList([fits.PrimaryHDU(),
+				fits.CompImageHDU(hdu.data,
+					header=hdu.header,
+					compression_type=compression,
+					quantize_level=quantizeLevel
+					)
+				])
 		try:
-			hdul.writeto(file, clobber=clobber)
+			hdul.writeto(file, overwrite=clobber)
 		except Exception as err:
 			self.logger.warning("Could not write FITS file: "
 					"{0}".format(file)
@@ -1021,5 +3321,259 @@ class rosaZylaCal:
 			self.logger.warning("FITS write warning: continuing, but "
 					"this could cause problems later."
 					)
-			
 
+	def rosa_zyla_select_frames(self, quality, burstEntry):
+		"""
+		Selects the best burstNumber of a burst's candidate frames
+		by qualityMetric. Frames at or above qualityThreshold rank
+		first; if fewer than burstNumber pass, the best of the rest
+		fill the burst and a warning is logged, so that burst
+		numbering stays contiguous for KISIP.
+
+		Parameters
+		----------
+		quality : numpy.ndarray
+			Metrics of the candidate frames, from
+			rosa_zyla_frame_quality.
+		burstEntry : dict
+			One entry of rosa_zyla_plan_bursts.
+
+		Returns
+		-------
+		numpy.ndarray
+			Positions of the frames kept, in time order.
+		"""
+		metric=quality[:, 1 if self.qualityMetric == 'contrast' else 2]
+		passing=metric >= self.qualityThreshold
+		## Passing frames first, then best metric, then earliest.
+		order=np.lexsort((np.arange(len(metric)), -metric, ~passing))
+		if np.count_nonzero(passing) < self.burstNumber:
+			self.logger.warning("Burst {0}: {1} of {2} candidate frames have "
+					"{3} at least {4}.".format(burstEntry['burst'],
+						np.count_nonzero(passing), len(metric),
+						self.qualityMetric, self.qualityThreshold
+						)
+					)
+		return np.sort(order[:self.burstNumber])
+
+	def rosa_zyla_shared_slot(self, kind):
+		"""
+		Context manager holding one of the worker slots shared
+		between the channels of a multi-channel run, see
+		rosaZylaMultiCal. Does nothing in a single-channel run.
+
+		Parameters
+		----------
+		kind : str
+			'cpu' for a task on a worker process, 'io' for a
+			file read on an I/O thread, or 'kisip' for a KISIP
+			batch.
+
+		Returns
+		-------
+		context manager
+		"""
+		slots=self.sharedSlots.get(kind) if self.sharedSlots else None
+		if slots is None:
+			return contextlib.nullcontext()
+		return slots.slots_slot()
+
+	def rosa_zyla_stream_fits_cube(self, cube, file, cards=None):
+		"""
+		Saves a 3-dimensional np.float32 cube to an uncompressed
+		FITS file one frame at a time, e.g. from a memory map,
+		without holding the cube in memory. The file is written
+		under a temporary name and renamed.
+
+		Parameters
+		----------
+		cube : numpy.ndarray or array-like
+			Cube of shape (frames, rows, cols).
+		file : str
+			Path to file to save to.
+		cards : dict
+			Optional header keywords and values.
+		"""
+		header=fits.Header()
+		header['SIMPLE']=True
+		header['BITPIX']=-32
+		header['NAXIS']=3
+		header['NAXIS1']=cube.shape[2]
+		header['NAXIS2']=cube.shape[1]
+		header['NAXIS3']=cube.shape[0]
+		if cards is None:
+			cards={}
+		for key, value in cards.items():
+			header[key]=value
+		tmpFile='{0}.{1}.tmp'.format(file, os.getpid())
+		try:
+			hdu=fits.StreamingHDU(tmpFile, header)
+			for i in range(cube.shape[0]):
+				hdu.write(np.asarray(cube[i], dtype=np.float32))
+			hdu.close()
+			os.replace(tmpFile, file)
+		except Exception as err:
+			self.logger.warning("Could not write FITS file: "
+					"{0}: {1}".format(file, err)
+					)
+			if os.path.exists(tmpFile):
+				os.remove(tmpFile)
+
+	def rosa_zyla_sum_image_from_list(self, fileList, numImg=None):
+		"""
+		Sums all frames in a list of image files into a
+		double-precision image, in place.
+
+		Parameters
+		----------
+		fileList : list
+			A list of file paths to the images to be summed.
+		numImg : int
+			Number of frames expected in total, used for progress
+			messages. Default None logs no progress.
+
+		Returns
+		-------
+		tuple
+			(numpy.ndarray with dtype np.float64, number of
+			frames summed).
+		"""
+		def rosa_zyla_print_sum_image_progress():
+			if numImg and not fNum % 100:
+				self.logger.info("Progress: "
+						"{:0.1%}.".format(fNum/numImg)
+						)
+
+		sumIm=np.zeros(self.imageShape, dtype=np.float64)
+		fNum=0
+		for file, frames in self.rosa_zyla_iter_file_frames(fileList):
+			for frame in frames:
+				sumIm+=frame
+				fNum+=1
+				rosa_zyla_print_sum_image_progress()
+		return sumIm, fNum
+
+	def rosa_zyla_work_burst_task(self, queue, taskId, burstPlan):
+		"""
+		Builds and saves the bursts of one task claimed from the
+		distributed burst queue, with the prefetcher and burst
+		writer as configured, touching the claim after each burst,
+		and records the task's result in the queue.
+
+		Parameters
+		----------
+		queue : burstQueue
+			The burst queue.
+		taskId : int
+			Task ID returned by burstQueue.queue_claim.
+		burstPlan : list
+			The task's part of the burst plan.
+		"""
+		taskFiles=list(dict.fromkeys(f for burstEntry in burstPlan
+			for f, ext in burstEntry['frames']
+			))
+		with self.metrics.metrics_stage('burst_task', task=taskId,
+				files=len(taskFiles),
+				bytesRead=sum(os.path.getsize(f) for f in taskFiles)
+				) as record:
+			prefetcher=None
+			fileFrames=None
+			if self.prefetchDepth > 0:
+				prefetcher=self.rosa_zyla_prefetch(taskFiles)
+				fileFrames=prefetcher.prefetch_get
+			results=[]
+			try:
+				if self.burstWriteBuffers > 1:
+					burstFiles=self.rosa_zyla_save_bursts_async(burstPlan,
+							self.burstWriteBuffers,
+							fileFrames
+							)
+				else:
+					burstFiles=(self.rosa_zyla_save_burst(burstEntry,
+							fileFrames=fileFrames
+							) for burstEntry in burstPlan
+							)
+				for burstEntry, (burstFile, headerText, timestamp, quality) in zip(
+						burstPlan, burstFiles):
+					results.append([burstFile, headerText, timestamp, quality])
+					queue.queue_heartbeat(taskId)
+					record['frames']+=len(burstEntry['frames'])
+					record['bytesWritten']+=os.path.getsize(burstFile)
+			finally:
+				if prefetcher is not None:
+					prefetcher.prefetch_close()
+			queue.queue_complete(taskId, results)
+		self.logger.info("Burst queue: task {0} done: {1} bursts.".format(
+			taskId, len(results)
+			))
+
+	@contextlib.contextmanager
+	def rosa_zyla_worker_pool(self, nWorkers, sharedNames=None):
+		"""
+		Context manager providing a multiprocessing pool whose
+		workers each hold a copy of this instance. Large image
+		attributes are not copied. Those named in sharedNames are
+		placed in shared memory once and attached by every worker.
+		Tasks are submitted as (method name, arguments...) tuples
+		through _rosa_zyla_pool_call. In a multi-channel run the
+		pool has no more workers than there are shared CPU slots.
+
+		Parameters
+		----------
+		nWorkers : int
+			Number of worker processes.
+		sharedNames : list
+			Names of np.ndarray attributes to share with workers.
+			Default None shares none.
+
+		Yields
+		------
+		multiprocessing.pool.Pool
+		"""
+		if self.sharedSlots and 'cpu' in self.sharedSlots:
+			nWorkers=min(nWorkers, self.sharedSlots['cpu'].nSlots)
+		if sharedNames is None:
+			sharedNames=[]
+		sharedArrays={}
+		sharedMemory=[]
+		try:
+			for name in sharedNames:
+				arr=np.ascontiguousarray(getattr(self, name))
+				shm=shared_memory.SharedMemory(create=True, size=arr.nbytes)
+				sharedMemory.append(shm)
+				np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...]=arr
+				sharedArrays[name]=(shm.name, arr.shape, arr.dtype.str)
+			workerCal=copy.copy(self)
+			for name in ['avgDark', 'avgFlat', 'gain', 'noise', 'burstCube',
+					'flatfieldDark', 'flatfieldGain', 'manifest', 'metadata',
+					'dirIndices', 'metrics', 'qualityCube']:
+				setattr(workerCal, name, None)
+			workerCal.fitsIndices={}
+			with multiprocessing.Pool(nWorkers,
+					initializer=_rosa_zyla_pool_init,
+					initargs=(workerCal, sharedArrays)
+					) as pool:
+				yield pool
+		finally:
+			for shm in sharedMemory:
+				shm.close()
+				shm.unlink()
+
+	def rosa_zyla_write_cal_key(self, file, key):
+		"""
+		Writes the CALKEY header keyword of a calibration image
+		file, so that later runs can tell whether it is current.
+
+		Parameters
+		----------
+		file : str
+			Path to the FITS file.
+		key : str
+			Key identifying the image's inputs.
+		"""
+		try:
+			fits.setval(file, 'CALKEY', value=key)
+		except Exception as err:
+			self.logger.warning("Could not write CALKEY to: {0}: "
+					"{1}".format(file, err)
+					)
@@ -0,0 +1,232 @@
+import configparser
+import multiprocessing
+import multiprocessing.connection
+import os
+import time
+from .kisipWrapper import kisipWrapper
+from .rosaZylaCal import rosaZylaCal
+from .workerSlots import workerSlots
+
+class rosaZylaMultiCal:
+	"""
+	Calibrates several ROSA and Zyla channels from one configuration
+	file at the same time, sharing a bounded number of CPU, I/O, and
+	KISIP workers between them.
+
+	-----------------------------------------------------------------
+
+	Each channel, an instrument section of the configuration file,
+	is calibrated and despeckled in its own process, as
+	standardCalScript.py would do it, with its own log file, stage
+	metrics, and outputs under its own workBase. Its worker pools
+	and I/O threads are sized from its own section, as usual, but
+	every task holds one of the slots shared between the channels
+	while it runs:
+
+		cpuWorkers slots for tasks on worker processes: burst
+		cubes, dark and flat partial sums, and FITS conversion,
+
+		ioWorkers slots for files read on I/O threads, by the
+		prefetcher and the shape check,
+
+		kisipBatches slots for KISIP batches.
+
+	See workerSlots: while several channels have work, they share
+	the slots evenly, and a channel may use all of them while the
+	others are in serial phases, such as computing the noise cube.
+	Worker pools are capped at cpuWorkers processes. The serial
+	work of each channel's own process is not counted against the
+	slots.
+
+	Slot counts not given are read from the MULTI_CAL section of
+	the configuration file.
+
+	-----------------------------------------------------------------
+
+	Parameters
+	----------
+	instruments : list
+		Instrument names: any of ROSA_3500, ROSA_4170, ROSA_CAK,
+		ROSA_GBAND, and ZYLA.
+	configFile : str
+		Path to the configuration file.
+	cpuWorkers : int
+		Number of worker process tasks that may run at once.
+		Default None uses the cpuWorkers configuration value, or
+		the number of CPUs.
+	ioWorkers : int
+		Number of file reads that may run at once. Default None
+		uses the ioWorkers configuration value, or 16.
+	kisipBatches : int
+		Number of KISIP batches that may run at once. Default None
+		uses the kisipBatches configuration value, or 1.
+	pipeline : bool
+		Start KISIP on each batch as soon as it is complete, as
+		standardCalScript.py --pipeline. Default False.
+	follow : bool
+		Calibrate data files as they are written, as
+		standardCalScript.py --follow. Default False.
+
+	-----------------------------------------------------------------
+
+	Example
+	-------
+
+		m=ssosoft.rosaZylaMultiCal(['ZYLA', 'ROSA_3500', 'ROSA_4170',
+				'ROSA_CAK', 'ROSA_GBAND'], 'config.ini')
+		exitCodes=m.multi_cal_run()
+	"""
+
+	def __init__(self, instruments, configFile, cpuWorkers=None, ioWorkers=None,
+			kisipBatches=None, pipeline=False, follow=False):
+		"""
+		Parameters
+		----------
+		instruments : list
+			Instrument names.
+		configFile : str
+			Path to the configuration file.
+		cpuWorkers : int
+			Number of worker process tasks that may run at once.
+			Default None uses the configuration file.
+		ioWorkers : int
+			Number of file reads that may run at once. Default
+			None uses the configuration file.
+		kisipBatches : int
+			Number of KISIP batches that may run at once.
+			Default None uses the configuration file.
+		pipeline : bool
+			Start KISIP on each batch as soon as it is complete.
+			Default False.
+		follow : bool
+			Calibrate data files as they are written. Default
+			False.
+		"""
+		self.configFile=configFile
+		self.cpuWorkers=cpuWorkers
+		self.follow=follow
+		self.instruments=[instrument.upper() for instrument in instruments]
+		self.ioWorkers=ioWorkers
+		self.kisipBatches=kisipBatches
+		self.pipeline=pipeline
+		self.sharedSlots={}
+
+		self.multi_cal_configure()
+
+	def multi_cal_channel(self, channel, instrument):
+		"""
+		Calibrates and despeckles one channel, in its own process,
+		holding the shared slots of that channel.
+
+		Parameters
+		----------
+		channel : int
+			Channel number, its index in instruments.
+		instrument : str
+			Instrument name.
+		"""
+		r=rosaZylaCal(instrument, self.configFile)
+		r.sharedSlots={kind : slots.slots_channel(channel)
+				for kind, slots in self.sharedSlots.items()
+				}
+		if self.pipeline:
+			r.rosa_zyla_run_calibration(saveBursts=False, follow=self.follow)
+			k=kisipWrapper(r)
+			k.kisip_despeckle_pipelined(
+					r.rosa_zyla_follow_bursts if self.follow else r.rosa_zyla_save_bursts,
+					batchCallback=r.rosa_zyla_save_despeckled_as_fits
+					)
+		else:
+			r.rosa_zyla_run_calibration(follow=self.follow)
+			k=kisipWrapper(r)
+			k.kisip_despeckle_all_batches(batchCallback=r.rosa_zyla_save_despeckled_as_fits)
+		r.rosa_zyla_save_despeckled_as_fits()
+
+	def multi_cal_configure(self):
+		"""
+		Checks the instrument list and reads the slot counts not
+		given from the MULTI_CAL section of the configuration
+		file.
+		"""
+		for instrument in self.instruments:
+			if instrument not in ['ZYLA', 'ROSA_3500', 'ROSA_4170', 'ROSA_CAK',
+					'ROSA_GBAND']:
+				raise ValueError("Allowed values for <instrument>: ZYLA, ROSA_3500, "
+						"ROSA_4170, ROSA_CAK, ROSA_GBAND: {0}".format(instrument)
+						)
+		if len(set(self.instruments)) != len(self.instruments):
+			raise ValueError("Instruments given more than once: "
+					"{0}".format(self.instruments)
+					)
+		config=configparser.ConfigParser()
+		if not config.read(self.configFile):
+			raise FileNotFoundError("Cannot read configuration file: "
+					"{0}".format(self.configFile)
+					)
+		for instrument in self.instruments:
+			if not config.has_section(instrument):
+				raise ValueError("No section {0} in configuration file: "
+						"{1}".format(instrument, self.configFile)
+						)
+		if not config.has_section('MULTI_CAL'):
+			config.add_section('MULTI_CAL')
+		if self.cpuWorkers is None:
+			self.cpuWorkers=config['MULTI_CAL'].getint('cpuWorkers',
+					fallback=os.cpu_count() or 1
+					)
+		if self.ioWorkers is None:
+			self.ioWorkers=config['MULTI_CAL'].getint('ioWorkers', fallback=16)
+		if self.kisipBatches is None:
+			self.kisipBatches=config['MULTI_CAL'].getint('kisipBatches', fallback=1)
+
+	def multi_cal_run(self):
+		"""
+		Runs all channels at the same time and waits for them to
+		finish. A channel that fails does not stop the others.
+
+		Returns
+		-------
+		dict
+			Exit code of each channel's process, by instrument:
+			0 on success.
+		"""
+		self.sharedSlots={
+			'cpu' : workerSlots(self.cpuWorkers, len(self.instruments)),
+			'io' : workerSlots(self.ioWorkers, len(self.instruments)),
+			'kisip' : workerSlots(self.kisipBatches, len(self.instruments))
+			}
+		print("{0}: calibrating {1} on {2} CPU, {3} I/O, and {4} KISIP "
+				"slots.".format(__name__, ', '.join(self.instruments),
+					self.cpuWorkers, self.ioWorkers, self.kisipBatches
+					)
+				)
+		t0=time.perf_counter()
+		processes={}
+		exitCodes={}
+		try:
+			for channel, instrument in enumerate(self.instruments):
+				process=multiprocessing.Process(target=self.multi_cal_channel,
+						args=(channel, instrument),
+						name=instrument
+						)
+				process.start()
+				processes[process.sentinel]=(channel, instrument, process)
+			while processes:
+				for sentinel in multiprocessing.connection.wait(list(processes)):
+					channel, instrument, process=processes.pop(sentinel)
+					process.join()
+					for slots in self.sharedSlots.values():
+						slots.slots_reset(channel)
+					exitCodes[instrument]=process.exitcode
+					print("{0}: {1} finished with exit code {2} after {3:0.1f} s, "
+							"see its log file.".format(__name__, instrument,
+								process.exitcode, time.perf_counter()-t0
+								)
+							)
+		except BaseException:
+			for channel, instrument, process in processes.values():
+				process.terminate()
+			for channel, instrument, process in processes.values():
+				process.join()
+			raise
+		return {instrument : exitCodes[instrument] for instrument in self.instruments}
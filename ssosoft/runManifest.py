@@ -0,0 +1,223 @@
+import hashlib
+import json
+import os
+import threading
+
+def manifest_fingerprint(*items):
+	"""
+	Computes a fingerprint of JSON-serializable items, e.g.
+	configuration values or file statistics.
+
+	Parameters
+	----------
+	*items : JSON-serializable objects
+		Items to fingerprint.
+
+	Returns
+	-------
+	str
+		Hexadecimal SHA-1 digest.
+	"""
+	digest=hashlib.sha1()
+	for item in items:
+		digest.update(json.dumps(item, sort_keys=True, default=str).encode('utf-8'))
+	return digest.hexdigest()
+
+def manifest_file_stats(fileList):
+	"""
+	Collects size and modification time of files.
+
+	Parameters
+	----------
+	fileList : list
+		Paths to files.
+
+	Returns
+	-------
+	list
+		[path, size, mtime in ns] for each file, with size and
+		mtime None if the file does not exist.
+	"""
+	stats=[]
+	for file in fileList:
+		try:
+			st=os.stat(file)
+		except OSError:
+			stats.append([file, None, None])
+		else:
+			stats.append([file, st.st_size, st.st_mtime_ns])
+	return stats
+
+class runManifest:
+	"""
+	A persistent record of the work completed in a calibration run,
+	used to resume an interrupted run without redoing finished work.
+
+	-----------------------------------------------------------------
+
+	The manifest is an append-only file of JSON lines kept in the
+	run's workBase. The first line holds a fingerprint of the run
+	configuration and inputs. Each following line records one
+	completed unit of work (a burst cube, a KISIP batch, a
+	postSpeckle FITS file) together with the size of every file
+	it produced and, optionally, the size and modification time of
+	the files it was made from.
+
+	A unit of work counts as done only while its output files still
+	exist with the recorded sizes, its source files are unchanged,
+	and its parameters fingerprint matches. If the run fingerprint
+	changes, the manifest is started afresh and all work is redone.
+
+	-----------------------------------------------------------------
+
+	Parameters
+	----------
+	manifestFile : str
+		Path to the manifest file.
+	fingerprint : str
+		Fingerprint of the run configuration and inputs.
+	logger : logging.Logger
+		Logger for informative messages.
+	"""
+
+	def __init__(self, manifestFile, fingerprint, logger):
+		"""
+		Parameters
+		----------
+		manifestFile : str
+			Path to the manifest file.
+		fingerprint : str
+			Fingerprint of the run configuration and inputs.
+		logger : logging.Logger
+			Logger for informative messages.
+		"""
+		self.fingerprint=fingerprint
+		self.lock=threading.Lock()
+		self.logger=logger
+		self.manifestFile=manifestFile
+		self.records={}
+
+		if os.path.exists(self.manifestFile):
+			self.manifest_load()
+		if self.records:
+			self.logger.info("Resuming run from manifest: {0}: {1} "
+					"completed items.".format(
+						self.manifestFile, len(self.records)
+						)
+					)
+			self.manifestHandle=open(self.manifestFile, mode='a')
+		else:
+			self.manifestHandle=open(self.manifestFile, mode='w')
+			self.manifest_write({'fingerprint' : self.fingerprint})
+
+	def manifest_close(self):
+		"""
+		Closes the manifest file.
+		"""
+		with self.lock:
+			self.manifestHandle.close()
+
+	def manifest_is_done(self, stage, key, params=None):
+		"""
+		Checks whether a unit of work is recorded as complete and
+		is still valid.
+
+		Parameters
+		----------
+		stage : str
+			Name of the pipeline stage, e.g. 'burst'.
+		key : str
+			Identifier of the unit of work within the stage.
+		params : str
+			Optional fingerprint of the parameters the work
+			depends on. Must match the recorded value.
+
+		Returns
+		-------
+		bool
+		"""
+		record=self.records.get((stage, str(key)))
+		if record is None or record['params'] != params:
+			return False
+		for file, size in record['files']:
+			try:
+				if os.path.getsize(file) != size:
+					return False
+			except OSError:
+				return False
+		return manifest_file_stats(
+				[file for file, size, mtime in record['sources']]
+				) == record['sources']
+
+	def manifest_load(self):
+		"""
+		Reads the records of a previous run. Records are discarded
+		if the run fingerprint has changed.
+		"""
+		with open(self.manifestFile, mode='r') as f:
+			lines=f.readlines()
+		try:
+			header=json.loads(lines[0])
+		except (IndexError, ValueError):
+			header={}
+		if header.get('fingerprint') != self.fingerprint:
+			self.logger.info("Run configuration or inputs changed since "
+					"manifest was written, starting a new manifest: "
+					"{0}".format(self.manifestFile)
+					)
+			return
+		if not lines[-1].endswith('\n'):
+			## A run killed mid-write leaves a partial last line.
+			## It is cut off, so that the records appended on
+			## resuming start on a line of their own.
+			with open(self.manifestFile, mode='r+b') as f:
+				f.truncate(sum(len(line.encode('utf-8')) for line in lines[:-1]))
+			lines=lines[:-1]
+		for line in lines[1:]:
+			try:
+				record=json.loads(line)
+			except ValueError:
+				continue
+			self.records[(record['stage'], record['key'])]=record
+
+	def manifest_record(self, stage, key, files, sources=None, params=None):
+		"""
+		Records a completed unit of work.
+
+		Parameters
+		----------
+		stage : str
+			Name of the pipeline stage, e.g. 'burst'.
+		key : str
+			Identifier of the unit of work within the stage.
+		files : list
+			Paths to the files produced.
+		sources : list
+			Optional paths to files the work was made from. The
+			work is invalidated if any of them changes.
+		params : str
+			Optional fingerprint of the parameters the work
+			depends on.
+		"""
+		record={
+			'stage' : stage,
+			'key' : str(key),
+			'files' : [[file, os.path.getsize(file)] for file in files],
+			'sources' : manifest_file_stats(sources or []),
+			'params' : params
+			}
+		with self.lock:
+			self.records[(stage, str(key))]=record
+			self.manifest_write(record)
+
+	def manifest_write(self, record):
+		"""
+		Appends one record to the manifest file.
+
+		Parameters
+		----------
+		record : dict
+			JSON-serializable record.
+		"""
+		self.manifestHandle.write(json.dumps(record)+"\n")
+		self.manifestHandle.flush()
@@ -0,0 +1,219 @@
+import sqlite3
+import threading
+
+class runMetadata:
+	"""
+	A per-run store of burst metadata: the header text, timestamp,
+	and burst cube path of every burst, and the quality metrics of
+	its frames, indexed by batch and index.
+
+	-----------------------------------------------------------------
+
+	The store is a single SQLite file in the run's workBase, in
+	place of one header text file per burst. Rows are looked up by
+	(batch, index) in constant time, so matching despeckled images
+	to their headers needs neither a directory listing nor parsing
+	of file names. Writes are committed by metadata_commit, e.g. once
+	per batch, rather than once per burst.
+
+	The frame_quality table holds one row per candidate frame of a
+	burst, from rosaZylaCal.rosa_zyla_frame_quality, with whether
+	the frame was kept, for choosing seeing thresholds after a run.
+
+	-----------------------------------------------------------------
+
+	Parameters
+	----------
+	metadataFile : str
+		Path to the SQLite file. Created if it does not exist.
+	logger : logging.Logger
+		Logger for informative messages.
+	"""
+
+	def __init__(self, metadataFile, logger):
+		"""
+		Parameters
+		----------
+		metadataFile : str
+			Path to the SQLite file. Created if it does not exist.
+		logger : logging.Logger
+			Logger for informative messages.
+		"""
+		self.lock=threading.Lock()
+		self.logger=logger
+		self.metadataFile=metadataFile
+
+		self.connection=sqlite3.connect(self.metadataFile,
+				check_same_thread=False
+				)
+		self.connection.execute("CREATE TABLE IF NOT EXISTS bursts ("
+				"batch INTEGER NOT NULL, "
+				"burstIndex INTEGER NOT NULL, "
+				"burst INTEGER NOT NULL, "
+				"file TEXT NOT NULL, "
+				"timestamp TEXT, "
+				"header TEXT NOT NULL, "
+				"PRIMARY KEY (batch, burstIndex))"
+				)
+		self.connection.execute("CREATE TABLE IF NOT EXISTS frame_quality ("
+				"batch INTEGER NOT NULL, "
+				"burstIndex INTEGER NOT NULL, "
+				"position INTEGER NOT NULL, "
+				"file TEXT NOT NULL, "
+				"ext INTEGER, "
+				"mean REAL NOT NULL, "
+				"contrast REAL NOT NULL, "
+				"sharpness REAL NOT NULL, "
+				"selected INTEGER NOT NULL, "
+				"PRIMARY KEY (batch, burstIndex, position))"
+				)
+		self.connection.commit()
+		self.logger.info("Using run metadata store: {0}".format(self.metadataFile))
+
+	def metadata_close(self):
+		"""
+		Commits pending writes and closes the store.
+		"""
+		with self.lock:
+			self.connection.commit()
+			self.connection.close()
+
+	def metadata_commit(self):
+		"""
+		Commits pending writes.
+		"""
+		with self.lock:
+			self.connection.commit()
+
+	def metadata_get(self, batch, index):
+		"""
+		Looks up the metadata of one burst.
+
+		Parameters
+		----------
+		batch : int
+			Batch number of the burst.
+		index : int
+			Index of the burst within its batch.
+
+		Returns
+		-------
+		dict or None
+			Keys 'batch', 'index', 'burst', 'file', 'timestamp',
+			and 'header', or None if the burst is not stored.
+		"""
+		with self.lock:
+			row=self.connection.execute("SELECT burst, file, timestamp, header "
+					"FROM bursts WHERE batch=? AND burstIndex=?",
+					(batch, index)
+					).fetchone()
+		if row is None:
+			return None
+		return {
+			'batch' : batch,
+			'index' : index,
+			'burst' : row[0],
+			'file' : row[1],
+			'timestamp' : row[2],
+			'header' : row[3]
+			}
+
+	def metadata_get_quality(self, batch, index=None):
+		"""
+		Looks up the frame quality of one burst, or of a batch.
+
+		Parameters
+		----------
+		batch : int
+			Batch number.
+		index : int
+			Index of the burst within its batch. Default None
+			returns every burst of the batch.
+
+		Returns
+		-------
+		list
+			One dict per frame, in burst and frame order, with
+			keys 'batch', 'index', 'position', 'file', 'ext',
+			'mean', 'contrast', 'sharpness', and 'selected'.
+		"""
+		query=("SELECT batch, burstIndex, position, file, ext, mean, contrast, "
+				"sharpness, selected FROM frame_quality WHERE batch=?"
+				)
+		args=(batch,)
+		if index is not None:
+			query+=" AND burstIndex=?"
+			args=(batch, index)
+		with self.lock:
+			rows=self.connection.execute(query+" ORDER BY burstIndex, position",
+					args
+					).fetchall()
+		return [{
+			'batch' : row[0],
+			'index' : row[1],
+			'position' : row[2],
+			'file' : row[3],
+			'ext' : row[4],
+			'mean' : row[5],
+			'contrast' : row[6],
+			'sharpness' : row[7],
+			'selected' : bool(row[8])
+			} for row in rows]
+
+	def metadata_put(self, batch, index, burst, file, header, timestamp=None):
+		"""
+		Stores the metadata of one burst, replacing any earlier
+		entry for the same batch and index. Not committed until
+		metadata_commit or metadata_close.
+
+		Parameters
+		----------
+		batch : int
+			Batch number of the burst.
+		index : int
+			Index of the burst within its batch.
+		burst : int
+			Burst number within the run.
+		file : str
+			Path to the burst cube.
+		header : str
+			Header text of the burst.
+		timestamp : str
+			Optional timestamp of the burst.
+		"""
+		with self.lock:
+			self.connection.execute("INSERT OR REPLACE INTO bursts "
+					"(batch, burstIndex, burst, file, timestamp, header) "
+					"VALUES (?, ?, ?, ?, ?, ?)",
+					(batch, index, burst, file, timestamp, header)
+					)
+
+	def metadata_put_quality(self, batch, index, rows):
+		"""
+		Stores the frame quality of one burst, replacing any
+		earlier rows for the same batch and index. Not committed
+		until metadata_commit or metadata_close.
+
+		Parameters
+		----------
+		batch : int
+			Batch number of the burst.
+		index : int
+			Index of the burst within its batch.
+		rows : list
+			One sequence per frame: position, file, extension,
+			mean, contrast, sharpness, and whether the frame
+			was selected.
+		"""
+		with self.lock:
+			self.connection.execute("DELETE FROM frame_quality "
+					"WHERE batch=? AND burstIndex=?",
+					(batch, index)
+					)
+			self.connection.executemany("INSERT INTO frame_quality "
+					"(batch, burstIndex, position, file, ext, mean, contrast, "
+					"sharpness, selected) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+					[(batch, index, int(row[0]), row[1], row[2], row[3], row[4],
+						row[5], int(bool(row[6]))
+						) for row in rows]
+					)
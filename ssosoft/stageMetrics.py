@@ -0,0 +1,291 @@
+import contextlib
+import json
+import os
+import resource
+import socket
+import threading
+import time
+
+class stageMetrics:
+	"""
+	Structured performance records of the stages of a calibration
+	run, written as JSON lines and, optionally, as a Prometheus
+	textfile for the node exporter's textfile collector.
+
+	-----------------------------------------------------------------
+
+	Each stage is measured by entering metrics_stage. When the stage
+	ends, one JSON line is appended to metricsFile with its wall
+	time, the CPU time of this process and of the child processes
+	it waited for, the frames, files, and bytes read and written
+	that the stage reported, throughputs, and peak resident set
+	size. A stage that raises is recorded with status 'error'.
+
+	The peak RSS of this process is reset at the start of a stage,
+	on Linux, when no other stage is running, so that it is the
+	peak of that stage alone; otherwise it is the peak of the
+	process so far, as shown by peakRssScope. CPU time is that of
+	the whole process, so it is shared by stages that overlap, such
+	as KISIP batches run while bursts are saved. The child peak RSS
+	is the largest of any child process waited for so far, unless
+	the stage measures its own child, as a KISIP batch does.
+
+	promFile, if given, is rewritten after every stage with the
+	totals of each stage so far in this process: runs, errors,
+	seconds, CPU seconds, frames, and bytes, as counters, and the
+	largest peak RSS, as a gauge.
+
+	-----------------------------------------------------------------
+
+	Parameters
+	----------
+	metricsFile : str
+		Path to the JSON lines file. Default '' writes none.
+	promFile : str
+		Path to the Prometheus textfile. Default '' writes none.
+	labels : dict
+		Fields added to every record and labels added to every
+		Prometheus sample, e.g. the instrument and observation.
+	logger : logging.Logger
+		Logger for a summary line of each stage.
+
+	-----------------------------------------------------------------
+
+	Example
+	-------
+
+		metrics=stageMetrics('run.metrics.jsonl',
+				labels={'instrument' : 'ZYLA'})
+		with metrics.metrics_stage('dark', files=len(darkList)) as record:
+			avgDark=averageImages(darkList)
+			record['frames']=len(darkList)
+	"""
+
+	def __init__(self, metricsFile='', promFile='', labels=None, logger=None):
+		"""
+		Parameters
+		----------
+		metricsFile : str
+			Path to the JSON lines file. Default '' writes none.
+		promFile : str
+			Path to the Prometheus textfile. Default '' writes
+			none.
+		labels : dict
+			Fields added to every record and labels added to
+			every Prometheus sample.
+		logger : logging.Logger
+			Logger for a summary line of each stage.
+		"""
+		self.host=socket.gethostname()
+		self.labels=dict(labels or {})
+		self.lock=threading.Lock()
+		self.logger=logger
+		self.metricsFile=metricsFile
+		self.openStages=0
+		self.promFile=promFile
+		self.totals={}
+
+	def metrics_enabled(self):
+		"""
+		Returns whether any records are written.
+
+		Returns
+		-------
+		bool
+		"""
+		return bool(self.metricsFile or self.promFile)
+
+	def metrics_peak_rss(self):
+		"""
+		Returns the peak resident set size of this process.
+
+		Returns
+		-------
+		int
+			Bytes. VmHWM from /proc where available, which
+			metrics_reset_peak_rss can reset, and ru_maxrss
+			otherwise.
+		"""
+		try:
+			with open('/proc/self/status', mode='r') as f:
+				for line in f:
+					if line.startswith('VmHWM:'):
+						return int(line.split()[1])*1024
+		except OSError:
+			pass
+		## ru_maxrss is in kilobytes on Linux.
+		return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+	@contextlib.contextmanager
+	def metrics_stage(self, stage, **fields):
+		"""
+		Context manager measuring one stage. The record of the
+		stage is yielded, for the stage to fill in its counts, and
+		written when the stage ends.
+
+		Parameters
+		----------
+		stage : str
+			Name of the stage.
+		**fields
+			Initial record fields: 'frames', 'files',
+			'bytesRead', and 'bytesWritten', all 0 by default,
+			and any others, e.g. 'batch'. A stage measuring
+			its own child processes sets 'childCpuSeconds' and
+			'childPeakRssMB'.
+
+		Yields
+		------
+		dict
+			The record of the stage.
+		"""
+		record=dict(self.labels, stage=stage, frames=0, files=0,
+				bytesRead=0, bytesWritten=0
+				)
+		record.update(fields)
+		if not self.metrics_enabled():
+			yield record
+			return
+		with self.lock:
+			stagePeak=self.openStages == 0 and self.metrics_reset_peak_rss()
+			self.openStages+=1
+		children0=resource.getrusage(resource.RUSAGE_CHILDREN)
+		start=time.time()
+		cpu0=time.process_time()
+		t0=time.perf_counter()
+		status='error'
+		try:
+			yield record
+			status='ok'
+		finally:
+			seconds=time.perf_counter()-t0
+			cpuSeconds=time.process_time()-cpu0
+			children=resource.getrusage(resource.RUSAGE_CHILDREN)
+			with self.lock:
+				self.openStages-=1
+			record.setdefault('childCpuSeconds', max(0.0,
+					children.ru_utime+children.ru_stime
+					-children0.ru_utime-children0.ru_stime
+					))
+			record.setdefault('childPeakRssMB', children.ru_maxrss/1024)
+			record.update({
+				'status' : status,
+				'start' : time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(start)),
+				'seconds' : seconds,
+				'cpuSeconds' : cpuSeconds,
+				'framesPerSecond' : record['frames']/seconds if seconds > 0 else None,
+				'readMBPerSecond' : record['bytesRead']/2**20/seconds if seconds > 0 else None,
+				'writeMBPerSecond' : record['bytesWritten']/2**20/seconds if seconds > 0 else None,
+				'peakRssMB' : self.metrics_peak_rss()/2**20,
+				'peakRssScope' : 'stage' if stagePeak else 'process',
+				'host' : self.host,
+				'pid' : os.getpid()
+				})
+			self.metrics_write(record)
+
+	def metrics_reset_peak_rss(self):
+		"""
+		Resets the peak resident set size of this process to its
+		current size, where the kernel supports it (Linux 4.0 and
+		later).
+
+		Returns
+		-------
+		bool
+			True if the peak was reset.
+		"""
+		try:
+			with open('/proc/self/clear_refs', mode='w') as f:
+				f.write('5')
+		except OSError:
+			return False
+		return True
+
+	def metrics_write(self, record):
+		"""
+		Writes one stage record to metricsFile, adds it to the
+		totals, and rewrites promFile.
+
+		Parameters
+		----------
+		record : dict
+			Record of a finished stage.
+		"""
+		with self.lock:
+			total=self.totals.setdefault(record['stage'], {
+				'runs' : 0, 'errors' : 0, 'seconds' : 0, 'cpuSeconds' : 0,
+				'childCpuSeconds' : 0, 'frames' : 0, 'bytesRead' : 0,
+				'bytesWritten' : 0, 'peakRssBytes' : 0
+				})
+			total['runs']+=1
+			total['errors']+=record['status'] != 'ok'
+			for key in ['seconds', 'cpuSeconds', 'childCpuSeconds', 'frames',
+					'bytesRead', 'bytesWritten']:
+				total[key]+=record[key]
+			total['peakRssBytes']=max(total['peakRssBytes'],
+					int(record['peakRssMB']*2**20)
+					)
+			try:
+				if self.metricsFile:
+					with open(self.metricsFile, mode='a') as f:
+						f.write(json.dumps(record, default=str)+"\n")
+				if self.promFile:
+					self.metrics_write_prom()
+			except OSError as err:
+				if self.logger is not None:
+					self.logger.warning("Could not write stage metrics: "
+							"{0}".format(err)
+							)
+		if self.logger is not None:
+			self.logger.info("Stage {0}: {1}: {2:0.2f} s, {3:0.2f} s CPU, "
+					"{4:0.2f} s child CPU, {5} frames, {6:0.1f} MB read, "
+					"{7:0.1f} MB written, peak RSS {8:0.1f} MB.".format(
+						record['stage'], record['status'], record['seconds'],
+						record['cpuSeconds'], record['childCpuSeconds'],
+						record['frames'], record['bytesRead']/2**20,
+						record['bytesWritten']/2**20, record['peakRssMB']
+						)
+					)
+
+	def metrics_write_prom(self):
+		"""
+		Rewrites promFile with the totals of each stage. The file
+		is written under a temporary name and renamed, so the
+		collector never reads a partial file. Called with the lock
+		held.
+		"""
+		def metrics_label_value(value):
+			return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+		lines=[]
+		for name, key, metricType, helpText in [
+				('ssosoft_stage_runs_total', 'runs', 'counter',
+					'Number of times the stage ran.'),
+				('ssosoft_stage_errors_total', 'errors', 'counter',
+					'Number of times the stage raised an error.'),
+				('ssosoft_stage_seconds_total', 'seconds', 'counter',
+					'Wall time spent in the stage.'),
+				('ssosoft_stage_cpu_seconds_total', 'cpuSeconds', 'counter',
+					'CPU time of this process during the stage.'),
+				('ssosoft_stage_child_cpu_seconds_total', 'childCpuSeconds', 'counter',
+					'CPU time of child processes waited for by the stage.'),
+				('ssosoft_stage_frames_total', 'frames', 'counter',
+					'Frames processed by the stage.'),
+				('ssosoft_stage_read_bytes_total', 'bytesRead', 'counter',
+					'Bytes of input files read by the stage.'),
+				('ssosoft_stage_written_bytes_total', 'bytesWritten', 'counter',
+					'Bytes of output files written by the stage.'),
+				('ssosoft_stage_peak_rss_bytes', 'peakRssBytes', 'gauge',
+					'Largest peak resident set size of the stage.')
+				]:
+			lines.append("# HELP {0} {1}".format(name, helpText))
+			lines.append("# TYPE {0} {1}".format(name, metricType))
+			for stage, total in sorted(self.totals.items()):
+				labels=','.join('{0}="{1}"'.format(label, metrics_label_value(value))
+						for label, value in sorted(dict(self.labels, stage=stage).items())
+						)
+				lines.append("{0}{{{1}}} {2}".format(name, labels, total[key]))
+		tmpFile='{0}.{1}.tmp'.format(self.promFile, os.getpid())
+		with open(tmpFile, mode='w') as f:
+			f.write("\n".join(lines)+"\n")
+		os.replace(tmpFile, self.promFile)
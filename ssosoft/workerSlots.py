@@ -0,0 +1,161 @@
+import contextlib
+import copy
+import multiprocessing
+import time
+
+class workerSlots:
+	"""
+	A bounded number of worker slots shared between the channels of
+	a multi-channel run, and handed out fairly between them.
+
+	-----------------------------------------------------------------
+
+	A task holds a slot while it runs, so that no more than nSlots
+	tasks run at once across all channels, however many worker
+	processes and threads each channel has started. A slot that
+	comes free goes to a waiting task of the channel holding the
+	fewest slots, the lowest channel number first among equals.
+	Channels with work thus share the slots evenly, and a channel
+	that alone has work, e.g. while the others are in serial
+	phases, takes all of them.
+
+	The counts are kept in shared memory, guarded by a lock held
+	only to read or change them. Waiting tasks look for their turn
+	every pollInterval seconds rather than sleeping on a condition,
+	so that a process killed while waiting, e.g. by Pool.terminate,
+	leaves nothing for the others to wait on. Its channel's counts
+	are cleared by slots_reset. Like other multiprocessing
+	synchronization primitives, an instance is passed to other
+	processes by inheritance: as an argument of a new Process, or of
+	a Pool initializer. slots_channel gives a view of the same slots
+	for one channel.
+
+	-----------------------------------------------------------------
+
+	Parameters
+	----------
+	nSlots : int
+		Number of tasks that may run at once.
+	nChannels : int
+		Number of channels sharing the slots. Default 1.
+	pollInterval : float
+		Seconds between looks for a free slot. Default 0.005.
+
+	-----------------------------------------------------------------
+
+	Example
+	-------
+
+		slots=workerSlots(16, nChannels=5)
+		zylaSlots=slots.slots_channel(0)
+		with zylaSlots.slots_slot():
+			saveBurst(burst)
+	"""
+
+	def __init__(self, nSlots, nChannels=1, pollInterval=0.005):
+		"""
+		Parameters
+		----------
+		nSlots : int
+			Number of tasks that may run at once.
+		nChannels : int
+			Number of channels sharing the slots. Default 1.
+		pollInterval : float
+			Seconds between looks for a free slot. Default
+			0.005.
+		"""
+		self.channel=0
+		self.lock=multiprocessing.Lock()
+		self.nSlots=max(1, int(nSlots))
+		self.pollInterval=pollInterval
+		self.running=multiprocessing.RawArray('i', max(1, int(nChannels)))
+		self.waiting=multiprocessing.RawArray('i', max(1, int(nChannels)))
+
+	def slots_acquire(self):
+		"""
+		Waits for a slot and takes it for this channel.
+		"""
+		with self.lock:
+			self.waiting[self.channel]+=1
+		try:
+			while True:
+				with self.lock:
+					if self.slots_turn():
+						self.running[self.channel]+=1
+						return
+				time.sleep(self.pollInterval)
+		finally:
+			with self.lock:
+				## Cleared by slots_reset if the channel was reset
+				## while this task waited.
+				self.waiting[self.channel]=max(0, self.waiting[self.channel]-1)
+
+	def slots_channel(self, channel):
+		"""
+		Returns a view of these slots for one channel.
+
+		Parameters
+		----------
+		channel : int
+			Channel number, from 0 to nChannels-1.
+
+		Returns
+		-------
+		workerSlots
+		"""
+		if not 0 <= channel < len(self.running):
+			raise IndexError("No channel {0} of {1}.".format(channel, len(self.running)))
+		view=copy.copy(self)
+		view.channel=channel
+		return view
+
+	def slots_release(self):
+		"""
+		Gives back a slot held by this channel.
+		"""
+		with self.lock:
+			self.running[self.channel]=max(0, self.running[self.channel]-1)
+
+	def slots_reset(self, channel):
+		"""
+		Frees the slots held by a channel and forgets its waiting
+		tasks, e.g. once its process has exited, whether or not
+		its tasks gave the slots back or stopped waiting. A
+		channel left with waiting tasks would otherwise stay next
+		in line and hold up the others.
+
+		Parameters
+		----------
+		channel : int
+			Channel number.
+		"""
+		with self.lock:
+			self.running[channel]=0
+			self.waiting[channel]=0
+
+	@contextlib.contextmanager
+	def slots_slot(self):
+		"""
+		Context manager holding a slot of this channel.
+		"""
+		self.slots_acquire()
+		try:
+			yield
+		finally:
+			self.slots_release()
+
+	def slots_turn(self):
+		"""
+		Returns whether a slot is free and this channel is next in
+		line for it. Called with the lock held.
+
+		Returns
+		-------
+		bool
+		"""
+		if sum(self.running) >= self.nSlots:
+			return False
+		waiting=[channel for channel in range(len(self.waiting))
+				if self.waiting[channel] > 0 or channel == self.channel
+				]
+		return min(waiting, key=lambda channel: (self.running[channel], channel)) == self.channel
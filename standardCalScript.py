@@ -9,7 +9,7 @@ datasets.
 Usage
 -----
 
-	standardCalScript.py <instrument name> <configuration file>
+	standardCalScript.py [--pipeline] [--follow] [--burst-worker] <instrument name> <configuration file>
 
 	instrument name : any of the following: ROSA_3500, ROSA_4170,
 		ROSA_CAK, ROSA_GBAND, ZYLA.
@@ -18,6 +18,22 @@ Usage
 		Consult the ssosoft documents for more information about
 		this file.
 
+	--pipeline : optional. Start KISIP on each batch of bursts as
+		soon as it is complete, while later batches are still
+		being calibrated.
+
+	--follow : optional. Calibrate data files as they are written,
+		during observing, until the stop file is created or no
+		new data arrives. See rosaZylaCal.rosa_zyla_follow_bursts.
+
+	--burst-worker : optional. Only build bursts for a run of the
+		same instrument and configuration file started elsewhere
+		with distributedBursts=True, taking them from its work
+		queue in workBase, then exit. Start any number of these,
+		on any nodes sharing workBase, once the run has started:
+		a worker finding only the previous run, finished, exits
+		at once. See rosaZylaCal.rosa_zyla_burst_worker.
+
 -------------------------------------------------------------------------
 
 This script completes all the steps necessary for an end-to-end
@@ -48,11 +64,32 @@ Website
 import ssosoft
 import sys
 
-assert len(sys.argv)==3, "Usage: {0} <instrument> <config file>".format(sys.argv[0])
-
-r=ssosoft.rosaZylaCal(*sys.argv[1:])
-r.rosa_zyla_run_calibration()
-k=ssosoft.kisipWrapper(r)
-k.kisip_despeckle_all_batches()
+pipeline='--pipeline' in sys.argv[1:]
+follow='--follow' in sys.argv[1:]
+burstWorker='--burst-worker' in sys.argv[1:]
+args=[arg for arg in sys.argv[1:] if arg not in ['--pipeline', '--follow', '--burst-worker']]
+assert len(args)==2, ("Usage: {0} [--pipeline] [--follow] [--burst-worker] <instrument> "
+		"<config file>".format(sys.argv[0])
+		)
+
+r=ssosoft.rosaZylaCal(*args)
+if burstWorker:
+	r.rosa_zyla_burst_worker()
+	sys.exit(0)
+if pipeline:
+	r.rosa_zyla_run_calibration(saveBursts=False, follow=follow)
+	k=ssosoft.kisipWrapper(r)
+	k.kisip_despeckle_pipelined(
+			r.rosa_zyla_follow_bursts if follow else r.rosa_zyla_save_bursts,
+			batchCallback=r.rosa_zyla_save_despeckled_as_fits
+			)
+elif follow:
+	r.rosa_zyla_run_calibration(follow=True)
+	k=ssosoft.kisipWrapper(r)
+	k.kisip_despeckle_all_batches(batchCallback=r.rosa_zyla_save_despeckled_as_fits)
+else:
+	r.rosa_zyla_run_calibration()
+	k=ssosoft.kisipWrapper(r)
+	k.kisip_despeckle_all_batches(batchCallback=r.rosa_zyla_save_despeckled_as_fits)
 r.rosa_zyla_save_despeckled_as_fits()
 
@@ -0,0 +1,84 @@
+import configparser
+import os
+
+import numpy as np
+import pytest
+
+## Synthetic Zyla spool files: an image with a band of zero overscan
+## on the bottom and right, as the camera writes them.
+IMAGE_SHAPE=(24, 20)
+OVERSCAN=(8, 8)
+FRAMES={'dark' : 16, 'flat' : 16, 'data' : 64}
+LEVELS={'dark' : 100, 'flat' : 2000, 'data' : 1500}
+
+def _write_spools(directory, nFrames, level, rng):
+	os.makedirs(directory)
+	spool=np.zeros((IMAGE_SHAPE[0]+OVERSCAN[0], IMAGE_SHAPE[1]+OVERSCAN[1]),
+			dtype=np.uint16
+			)
+	for k in range(nFrames):
+		spool[:IMAGE_SHAPE[0], :IMAGE_SHAPE[1]]=rng.integers(level, level+100,
+				size=IMAGE_SHAPE
+				)
+		## Zyla file numbers are written least significant digit
+		## first.
+		spool.tofile(os.path.join(directory,
+			'{0:010d}'.format(k)[::-1]+'spool.dat'
+			))
+
+@pytest.fixture
+def zylaConfig(tmp_path):
+	"""
+	Synthetic ZYLA dark, flat and data files under tmp_path, and a
+	function writing a configuration file for them. The function
+	takes the name of the run, which is also its workBase, and
+	settings overriding those of the instrument section, and
+	returns the path to the configuration file.
+	"""
+	rng=np.random.default_rng(0)
+	for kind in ['dark', 'flat', 'data']:
+		_write_spools(str(tmp_path/kind), FRAMES[kind], LEVELS[kind], rng)
+
+	def write_config(name, **settings):
+		workBase=str(tmp_path/name)
+		os.makedirs(workBase, exist_ok=True)
+		config=configparser.ConfigParser(interpolation=None)
+		config.optionxform=str
+		config['ZYLA']={
+			'darkBase' : str(tmp_path/'dark'),
+			'dataBase' : str(tmp_path/'data'),
+			'flatBase' : str(tmp_path/'flat'),
+			'workBase' : workBase,
+			'burstNumber' : '8',
+			'burstFileForm' : '{:s}_{:s}_test_kisip.raw.batch.{:02d}.{:03d}',
+			'obsDate' : '20240101',
+			'obsTime' : '120000',
+			'expTimems' : '10',
+			'speckledFileForm' : '{:s}_{:s}_test_kisip.speckle.batch.{:02d}.{:03d}',
+			'darkFilePattern' : '*spool.dat',
+			'dataFilePattern' : '*spool.dat',
+			'flatFilePattern' : '*spool.dat',
+			'noiseFile' : 'kisip.test.noise'
+			}
+		for key, value in settings.items():
+			config['ZYLA'][key]=str(value)
+		config['loggers']={'keys' : 'root'}
+		config['handlers']={'keys' : 'testHand'}
+		config['formatters']={'keys' : 'testForm'}
+		config['logger_root']={'level' : 'INFO', 'handlers' : 'testHand'}
+		config['handler_testHand']={
+			'class' : 'FileHandler',
+			'level' : 'INFO',
+			'formatter' : 'testForm',
+			'args' : "('%(logfilename)s', 'a')"
+			}
+		config['formatter_testForm']={
+			'format' : '%(asctime)s %(name)s %(levelname)s %(message)s',
+			'datefmt' : ''
+			}
+		configFile=str(tmp_path/'{0}.ini'.format(name))
+		with open(configFile, mode='w') as f:
+			config.write(f)
+		return configFile
+
+	return write_config
@@ -0,0 +1,59 @@
+import os
+import subprocess
+import sys
+
+from ssosoft.burstQueue import burstQueue
+
+TASKS=[['a'], ['b'], ['c']]
+
+def test_queue_claims_each_task_once(tmp_path):
+	coordinator=burstQueue(str(tmp_path))
+	coordinator.queue_publish(TASKS, {'shape' : [2, 2]})
+	worker=burstQueue(str(tmp_path))
+	assert worker.queue_wait(1, 0.01)
+	assert worker.plan['setup'] == {'shape' : [2, 2]}
+	claims=[worker.queue_claim(), coordinator.queue_claim(), worker.queue_claim()]
+	assert sorted(taskId for taskId, task in claims) == [0, 1, 2]
+	assert worker.queue_claim() is None
+	for queue, (taskId, task) in zip([worker, coordinator, worker], claims):
+		assert not queue.queue_finished()
+		queue.queue_complete(taskId, task+['done'])
+	assert worker.queue_finished()
+	assert [coordinator.queue_result(i) for i in range(3)] == [['a', 'done'],
+			['b', 'done'], ['c', 'done']
+			]
+	assert coordinator.queue_status() == {'todo' : 0, 'claimed' : 0, 'done' : 3}
+
+def test_queue_recovers_claim_of_dead_process(tmp_path):
+	burstQueue(str(tmp_path)).queue_publish(TASKS)
+	## A process that claims a task and exits without completing it.
+	subprocess.run([sys.executable, '-c',
+		"from ssosoft.burstQueue import burstQueue\n"
+		"q=burstQueue({0!r})\n"
+		"q.queue_load()\n"
+		"q.queue_claim()\n".format(str(tmp_path))
+		], check=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+	queue=burstQueue(str(tmp_path))
+	queue.queue_load()
+	assert queue.queue_status()['claimed'] == 1
+	assert queue.queue_recover() == 1
+	assert sorted(queue.queue_claim()[0] for i in range(3)) == [0, 1, 2]
+
+def test_closed_queue_stops_late_workers(tmp_path):
+	coordinator=burstQueue(str(tmp_path))
+	coordinator.queue_publish(TASKS)
+	while True:
+		claim=coordinator.queue_claim()
+		if claim is None:
+			break
+		coordinator.queue_complete(*claim)
+	coordinator.queue_close()
+	lateWorker=burstQueue(str(tmp_path))
+	assert lateWorker.queue_wait(1, 0.01)
+	assert lateWorker.queue_finished()
+	## The next run removes the finished one, so workers wait for it,
+	## and republishing the same plan does not reuse its results.
+	coordinator.queue_prepare()
+	assert not burstQueue(str(tmp_path)).queue_wait(0.05, 0.01)
+	coordinator.queue_publish(TASKS)
+	assert coordinator.queue_status() == {'todo' : 3, 'claimed' : 0, 'done' : 0}
@@ -0,0 +1,56 @@
+import glob
+import os
+
+import numpy as np
+
+from ssosoft.rosaZylaCal import rosaZylaCal
+
+def _cal_images(configFile):
+	## Runs the calibration up to the burst cubes, counting the
+	## averages that had to be computed.
+	r=rosaZylaCal('ZYLA', configFile)
+	averaged=[]
+	average=r.rosa_zyla_average_image_from_list
+	def counted_average(fileList, *args, **kwargs):
+		averaged.append(fileList)
+		return average(fileList, *args, **kwargs)
+	r.rosa_zyla_average_image_from_list=counted_average
+	r.rosa_zyla_run_calibration(saveBursts=False)
+	return r, len(averaged)
+
+def test_cal_store_reused_across_runs(tmp_path, zylaConfig):
+	calStoreBase=str(tmp_path/'store')
+	first, averaged=_cal_images(zylaConfig('first', calStoreBase=calStoreBase))
+	assert averaged == 2
+	assert len(glob.glob(os.path.join(calStoreBase, 'ZYLA', '*.fits'))) >= 3
+
+	## A run in another workBase takes every image from the store.
+	second, averaged=_cal_images(zylaConfig('second', calStoreBase=calStoreBase))
+	assert averaged == 0
+	for name in ['avgDark', 'avgFlat', 'gain']:
+		assert np.array_equal(getattr(first, name), getattr(second, name))
+	assert second.calKeys == first.calKeys
+
+	## Changing a dark file changes the dark and gain keys, so the
+	## dark is averaged again while the flat still comes from the
+	## store.
+	darkFile=first.darkList[0]
+	with open(darkFile, mode='r+b') as f:
+		f.write(np.full(8, 150, dtype=np.uint16).tobytes())
+	os.utime(darkFile, ns=(0, 0))
+	third, averaged=_cal_images(zylaConfig('third', calStoreBase=calStoreBase))
+	assert averaged == 1
+	assert third.calKeys['dark'] != first.calKeys['dark']
+	assert third.calKeys['gain'] != first.calKeys['gain']
+	assert third.calKeys['flat'] == first.calKeys['flat']
+	assert not np.array_equal(third.avgDark, first.avgDark)
+	assert np.array_equal(third.avgFlat, first.avgFlat)
+
+def test_work_base_images_reused_when_keys_match(zylaConfig):
+	configFile=zylaConfig('rerun')
+	first, averaged=_cal_images(configFile)
+	assert averaged == 2
+	assert first.calStore is None
+	second, averaged=_cal_images(configFile)
+	assert averaged == 0
+	assert np.array_equal(first.gain, second.gain)
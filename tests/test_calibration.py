@@ -0,0 +1,170 @@
+import glob
+import os
+
+import astropy.io.fits as fits
+import numpy as np
+import pytest
+
+from ssosoft.rosaZylaBenchmark import rosaZylaBenchmark
+from ssosoft.rosaZylaCal import rosaZylaCal
+
+SERIAL={'averageWorkers' : 1, 'burstWorkers' : 1, 'burstWriteBuffers' : 1,
+	'checkWorkers' : 1, 'prefetchDepth' : 0
+	}
+
+VARIANTS={
+	'async' : {'burstWriteBuffers' : 2, 'prefetchDepth' : 4, 'checkWorkers' : 4},
+	'parallel' : {'averageWorkers' : 2, 'burstWorkers' : 3, 'fitsWorkers' : 2},
+	'distributed' : {'distributedBursts' : True, 'queueBurstsPerTask' : 2,
+		'queuePollInterval' : 0.01
+		}
+	}
+
+## ROSA files hold 256 frames, as the ROSA header lookup expects.
+DATA_FRAMES={'ZYLA' : 80, 'ROSA_GBAND' : 320}
+
+def _run(tmp_path, instrument, name, overrides):
+	## Synthetic data are generated once per instrument and shared by
+	## the runs, each in its own workBase.
+	workBase=str(tmp_path/instrument/name)
+	os.makedirs(workBase, exist_ok=True)
+	b=rosaZylaBenchmark(str(tmp_path), instrument, imageShape=(24, 20),
+			darkFrames=16, flatFrames=16, dataFrames=DATA_FRAMES[instrument],
+			framesPerFile=256, burstNumber=8,
+			configOverrides=dict(SERIAL, workBase=workBase, **overrides)
+			)
+	b.bench_generate()
+	b.bench_write_config()
+	r=rosaZylaCal(instrument, b.configFile)
+	r.rosa_zyla_run_calibration()
+	cubes={}
+	for file in sorted(glob.glob(os.path.join(r.preSpeckleBase, '*'))):
+		with open(file, mode='rb') as f:
+			cubes[os.path.basename(file)]=f.read()
+	return r, cubes
+
+def _despeckle(r):
+	## Stand in for KISIP, as rosaZylaBenchmark does: the first frame
+	## of each burst.
+	frameCount=r.imageShape[0]*r.imageShape[1]
+	for burstEntry in r.rosa_zyla_plan_bursts():
+		np.fromfile(burstEntry['file'], dtype=np.float32, count=frameCount
+				).tofile(os.path.join(r.speckleBase,
+					r.speckledFileForm.format(r.obsDate, r.obsTime,
+						burstEntry['batch'], burstEntry['index']
+						)+'.final'
+					))
+	r.rosa_zyla_save_despeckled_as_fits()
+	images={}
+	for file in sorted(glob.glob(os.path.join(r.postSpeckleBase, '*'))):
+		with fits.open(file) as hdul:
+			images[os.path.basename(file)]=hdul[0].data.copy()
+	return images
+
+@pytest.mark.parametrize('instrument', ['ZYLA', 'ROSA_GBAND'])
+def test_despeckled_fits_match_serial(tmp_path, instrument):
+	r, cubes=_run(tmp_path, instrument, 'serial', {})
+	serial=_despeckle(r)
+	assert len(serial) == DATA_FRAMES[instrument]//8
+	r, cubes=_run(tmp_path, instrument, 'parallel', VARIANTS['parallel'])
+	parallel=_despeckle(r)
+	assert sorted(parallel) == sorted(serial)
+	for file in serial:
+		assert np.array_equal(parallel[file], serial[file]), file
+
+@pytest.mark.parametrize('postSpeckleCube', ['batch', 'run'])
+def test_despeckled_cube_matches_images(tmp_path, monkeypatch, postSpeckleCube):
+	r, cubes=_run(tmp_path, 'ZYLA', 'images', {})
+	images=_despeckle(r)
+	r, cubes=_run(tmp_path, 'ZYLA', postSpeckleCube,
+			{'postSpeckleCube' : postSpeckleCube, 'resumeRun' : True}
+			)
+
+	## A cube that cannot be written is neither left behind nor
+	## recorded as done.
+	def fail_map(*args, **kwargs):
+		raise OSError("No space left on device")
+	with monkeypatch.context() as m:
+		m.setattr(r, 'rosa_zyla_map_binary_image', fail_map)
+		assert _despeckle(r) == {}
+	assert not any(stage == 'fits' for stage, key in r.manifest.records)
+
+	cube=_despeckle(r)
+	assert len(cube) == 1
+	cubeFile,=cube
+	assert cubeFile.endswith('.cube.fits')
+	assert np.array_equal(cube[cubeFile], np.stack([images[file] for file in sorted(images)]))
+	assert ('fits', os.path.join(r.postSpeckleBase, cubeFile)) in r.manifest.records
+	with fits.open(os.path.join(r.postSpeckleBase, cubeFile)) as hdul:
+		assert list(hdul['FRAMES'].data['INDEX']) == list(range(len(images)))
+
+@pytest.mark.parametrize('instrument', ['ZYLA', 'ROSA_GBAND'])
+def test_burst_cubes_match_serial(tmp_path, instrument):
+	r, serial=_run(tmp_path, instrument, 'serial', {})
+	assert r.batchList == [0]
+	assert len(serial) == DATA_FRAMES[instrument]//8
+	burst=np.fromfile(os.path.join(r.preSpeckleBase, sorted(serial)[0]), dtype=np.float32)
+	assert burst.size == 8*24*20 and np.all(np.isfinite(burst))
+	for name, overrides in VARIANTS.items():
+		r, cubes=_run(tmp_path, instrument, name, overrides)
+		assert sorted(cubes) == sorted(serial), name
+		for file in serial:
+			assert cubes[file] == serial[file], (name, file)
+
+@pytest.mark.parametrize('instrument', ['ZYLA', 'ROSA_GBAND'])
+def test_frame_selection_matches_serial(tmp_path, instrument):
+	selection={'qualityCandidates' : 16}
+	r, serial=_run(tmp_path, instrument, 'serial', selection)
+	nBursts=DATA_FRAMES[instrument]//16
+	assert len(serial) == nBursts
+	quality=r.rosa_zyla_get_metadata().metadata_get_quality(0)
+	assert len(quality) == nBursts*16
+	assert sum(row['selected'] for row in quality) == nBursts*8
+	r, parallel=_run(tmp_path, instrument, 'parallel',
+			dict(selection, **VARIANTS['parallel'])
+			)
+	assert parallel == serial
+
+def test_distributed_rerun_saving_bursts_later(tmp_path):
+	## As kisip_despeckle_pipelined does: calibrate without saving
+	## bursts, then save them, in the workBase of a finished run.
+	r, serial=_run(tmp_path, 'ZYLA', 'distributed', VARIANTS['distributed'])
+	queue=r.rosa_zyla_open_burst_queue()
+	assert queue.queue_load() and queue.queue_closed()
+	for file in glob.glob(os.path.join(r.preSpeckleBase, '*')):
+		os.remove(file)
+	r=rosaZylaCal('ZYLA', r.configFile)
+	r.rosa_zyla_run_calibration(saveBursts=False)
+	assert not os.path.exists(os.path.join(r.queueDir, 'plan.json'))
+	r.rosa_zyla_save_bursts()
+	cubes={}
+	for file in glob.glob(os.path.join(r.preSpeckleBase, '*')):
+		with open(file, mode='rb') as f:
+			cubes[os.path.basename(file)]=f.read()
+	assert cubes == serial
+	queue=r.rosa_zyla_open_burst_queue()
+	assert queue.queue_load() and queue.queue_closed()
+
+def test_burst_outside_plan_stops_run(tmp_path):
+	r, serial=_run(tmp_path, 'ZYLA', 'serial', {})
+	r=rosaZylaCal('ZYLA', r.configFile)
+	r.rosa_zyla_run_calibration(saveBursts=False)
+	saveBurst=r.rosa_zyla_save_burst
+	def save_burst(burstEntry, *args, **kwargs):
+		burstFile, headerText, timestamp, quality=saveBurst(burstEntry, *args, **kwargs)
+		if burstEntry['burst'] == 2:
+			burstFile=burstFile+'.misnamed'
+		return burstFile, headerText, timestamp, quality
+	r.rosa_zyla_save_burst=save_burst
+	recordBurst=r.rosa_zyla_record_burst
+	recorded=[]
+	def record_burst(burstEntry, *args, **kwargs):
+		recorded.append(burstEntry['burst'])
+		recordBurst(burstEntry, *args, **kwargs)
+	r.rosa_zyla_record_burst=record_burst
+	batchCalls=[]
+	with pytest.raises(AssertionError, match='not among the bursts'):
+		r.rosa_zyla_save_bursts(batchCallback=batchCalls.append)
+	assert batchCalls == []
+	assert r.batchList == [0]
+	assert recorded == [0, 1]
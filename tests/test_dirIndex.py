@@ -0,0 +1,95 @@
+import os
+import re
+
+from ssosoft.dirIndex import dirIndex
+from ssosoft.rosaZylaCal import rosaZylaCal
+
+def _zyla_order(name):
+	match=re.match('[0-9]+', name)
+	return int(match.group()[::-1]) if match else None
+
+def _touch(directory, names):
+	for name in names:
+		with open(os.path.join(directory, name), mode='wb') as f:
+			f.write(b'\0'*len(name))
+
+def test_index_order(tmp_path):
+	_touch(str(tmp_path), ['01spool.dat', '2spool.dat', '11spool.dat',
+		'1spool.dat', 'bspool.dat', 'aspool.dat', 'notes.txt'
+		])
+	index=dirIndex(str(tmp_path), '*spool.dat', orderKey=_zyla_order)
+	## Sequence numbers 1, 2, 10, 11, then names without one.
+	assert [os.path.basename(file) for file in index.index_files()] == [
+			'1spool.dat', '2spool.dat', '01spool.dat', '11spool.dat',
+			'aspool.dat', 'bspool.dat'
+			]
+	assert index.index_files('1*') == [os.path.join(str(tmp_path), name)
+			for name in ['1spool.dat', '11spool.dat']
+			]
+	file, size, mtime, key=index.index_entries()[2]
+	assert (os.path.basename(file), size, key) == ('01spool.dat', 11, 10)
+	assert mtime == os.stat(file).st_mtime_ns
+
+	index=dirIndex(str(tmp_path), '*')
+	assert [os.path.basename(file) for file in index.index_files()] == sorted(
+			os.listdir(str(tmp_path))
+			)
+
+def test_index_persistence(tmp_path):
+	dataDir=tmp_path/'data'
+	dataDir.mkdir()
+	_touch(str(dataDir), ['{0}spool.dat'.format(k) for k in range(5)])
+	## A directory modified well before it is listed need not be
+	## listed again.
+	os.utime(str(dataDir), ns=(0, 0))
+	indexFile=str(tmp_path/'index'/'data.json')
+	first=dirIndex(str(dataDir), '*spool.dat', orderKey=_zyla_order,
+			indexFile=indexFile
+			)
+	assert os.path.exists(indexFile)
+
+	parsed=[]
+	def counted_order(name):
+		parsed.append(name)
+		return _zyla_order(name)
+	second=dirIndex(str(dataDir), '*spool.dat', orderKey=counted_order,
+			indexFile=indexFile
+			)
+	assert parsed == []
+	assert second.index_entries() == first.index_entries()
+	assert second.index_update() == []
+
+	## Only new files are examined, and gone files are dropped.
+	_touch(str(dataDir), ['5spool.dat'])
+	os.remove(str(dataDir/'0spool.dat'))
+	assert second.index_update() == [str(dataDir/'5spool.dat')]
+	assert parsed == ['5spool.dat']
+	assert [os.path.basename(file) for file in second.index_files()] == [
+			'{0}spool.dat'.format(k) for k in range(1, 6)
+			]
+	third=dirIndex(str(dataDir), '*spool.dat', orderKey=counted_order,
+			indexFile=indexFile
+			)
+	assert third.index_files() == second.index_files()
+
+	## A saved index for another pattern is not used.
+	parsed.clear()
+	other=dirIndex(str(dataDir), '[1-3]spool.dat', orderKey=counted_order,
+			indexFile=indexFile
+			)
+	assert sorted(parsed) == ['1spool.dat', '2spool.dat', '3spool.dat']
+	assert len(other.index_files()) == 3
+
+def test_indexed_lists_match_globbed(zylaConfig):
+	runs=[]
+	for name, useDirIndex in [('indexed', True), ('globbed', False)]:
+		r=rosaZylaCal('ZYLA', zylaConfig(name, useDirIndex=useDirIndex))
+		r.rosa_zyla_run_calibration(saveBursts=False)
+		runs.append(r)
+	indexed, globbed=runs
+	assert indexed.darkList == globbed.darkList
+	assert indexed.flatList == globbed.flatList
+	assert indexed.dataList == globbed.dataList
+	assert len(indexed.dataList) == 64
+	assert len(os.listdir(os.path.join(indexed.workBase, 'dirIndex'))) == 3
+	assert not os.path.exists(os.path.join(globbed.workBase, 'dirIndex'))
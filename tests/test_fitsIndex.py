@@ -0,0 +1,84 @@
+import logging
+import os
+
+import astropy.io.fits as fits
+import numpy as np
+import pytest
+
+from ssosoft.fitsIndex import fitsIndex
+from ssosoft.rosaZylaCal import rosaZylaCal
+
+def _write_fits(file, seed=0):
+	## Extensions of each kind astropy scales differently: plain
+	## integers and floats, the unsigned integer convention, and
+	## BSCALE/BZERO scaling.
+	rng=np.random.default_rng(seed)
+	hdul=fits.HDUList([fits.PrimaryHDU()])
+	hdul.append(fits.ImageHDU(rng.integers(-1000, 1000, size=(6, 5), dtype=np.int16)))
+	hdul.append(fits.ImageHDU(rng.integers(0, 65535, size=(6, 5), dtype=np.uint16)))
+	hdul.append(fits.ImageHDU(rng.random((6, 5), dtype=np.float32)))
+	hdul.append(fits.ImageHDU(rng.random((6, 5))))
+	scaled=fits.ImageHDU(rng.integers(-100, 100, size=(6, 5), dtype=np.int16))
+	scaled.header['BSCALE']=0.5
+	scaled.header['BZERO']=10.0
+	hdul.append(scaled)
+	hdul.append(fits.ImageHDU(rng.integers(0, 255, size=(6, 5), dtype=np.uint8)))
+	hdul.writeto(file)
+
+def test_frames_match_astropy(tmp_path):
+	file=str(tmp_path/'frames.fits')
+	_write_fits(file)
+	index=fitsIndex(file, str(tmp_path/'index'))
+	with fits.open(file) as hdul:
+		expected=[ext.data.copy() for ext in hdul[1:]]
+	assert len(index) == len(expected)
+	assert index.index_shapes() == [(6, 5)]*len(expected)
+	assert index.index_complete()
+	for k, data in enumerate(expected):
+		assert index[k].dtype == data.dtype, k
+		assert np.array_equal(index[k], data), k
+		assert np.array_equal(index.index_read_frames(k, k+1)[0], data), k
+		assert index.index_header(k+1) == fits.getheader(file, k+1)
+	out=np.empty((2, 6, 5), dtype=np.float64)
+	index.index_read_frames(2, 4, out=out)
+	assert np.array_equal(out, np.stack(expected[2:4]))
+
+	## The saved sidecar is used while the file is unchanged.
+	loaded=fitsIndex(file, str(tmp_path/'index'))
+	assert loaded.records == index.records
+	with pytest.raises(IndexError):
+		index[len(expected)]
+
+def test_truncated_file(tmp_path):
+	file=str(tmp_path/'frames.fits')
+	_write_fits(file)
+	with open(file, mode='r+b') as f:
+		f.truncate(os.path.getsize(file)-2880)
+	assert not fitsIndex(file).index_complete()
+	with open(file, mode='r+b') as f:
+		f.truncate(2880+1000)
+	with pytest.raises(ValueError):
+		fitsIndex(file)
+
+def test_indices_kept_per_file(tmp_path):
+	configFile=tmp_path/'config.ini'
+	configFile.write_text('[ROSA_GBAND]\n')
+	r=rosaZylaCal('ROSA_GBAND', str(configFile))
+	r.logger=logging.getLogger('rosa_gbandLog')
+	r.fitsIndexBase=str(tmp_path/'index')
+	file=str(tmp_path/'frames.fits')
+	_write_fits(file)
+	index=r.rosa_zyla_file_index(file)
+	assert r.rosa_zyla_file_index(file) is index
+	assert r.rosa_zyla_fits_index(os.path.join(str(tmp_path), '.', 'frames.fits')) is index
+
+	## A changed file is indexed again.
+	os.remove(file)
+	_write_fits(file, seed=1)
+	os.utime(file, ns=(0, 0))
+	changed=r.rosa_zyla_file_index(file)
+	assert changed is not index
+	with fits.open(file) as hdul:
+		assert np.array_equal(changed[0], hdul[1].data)
+	r.useFitsIndex=False
+	assert r.rosa_zyla_file_index(file) is None
@@ -0,0 +1,89 @@
+import glob
+import os
+import shutil
+import threading
+import time
+
+from ssosoft.rosaZylaCal import rosaZylaCal
+
+## One frame per burst, so that the run spans two batches of 1000.
+DATA_FRAMES=1010
+
+def _source_files(tmp_path):
+	## The synthetic data files, repeated to DATA_FRAMES files.
+	sourceDir=tmp_path/'source'
+	sourceDir.mkdir()
+	frames=sorted(glob.glob(str(tmp_path/'data'/'*spool.dat')),
+			key=lambda file: int(os.path.basename(file)[:10][::-1])
+			)
+	files=[]
+	for k in range(DATA_FRAMES):
+		file=str(sourceDir/('{0:010d}'.format(k)[::-1]+'spool.dat'))
+		shutil.copyfile(frames[k%len(frames)], file)
+		files.append(file)
+	return files
+
+def _cubes(r):
+	cubes={}
+	for file in glob.glob(os.path.join(r.preSpeckleBase, '*')):
+		with open(file, mode='rb') as f:
+			cubes[os.path.basename(file)]=f.read()
+	return cubes
+
+def test_follow_matches_batch_run(tmp_path, zylaConfig):
+	files=_source_files(tmp_path)
+	batch=rosaZylaCal('ZYLA', zylaConfig('batch', burstNumber=1,
+		dataBase=str(tmp_path/'source')
+		))
+	batchCalls=[]
+	batch.rosa_zyla_run_calibration(batchCallback=batchCalls.append)
+
+	liveDir=tmp_path/'live'
+	liveDir.mkdir()
+	stopFile=str(tmp_path/'stop')
+	r=rosaZylaCal('ZYLA', zylaConfig('follow', burstNumber=1,
+		dataBase=str(liveDir), followInterval=0.02, followSettle=0.1,
+		followIdleTimeout=60, followStopFile=stopFile
+		))
+	followCalls=[]
+	firstBatchDone=threading.Event()
+	def batch_done(batch):
+		followCalls.append(batch)
+		firstBatchDone.set()
+
+	earlyCalls=[]
+	def write_files():
+		for k, file in enumerate(files):
+			## The first batch is completed while the rest of the
+			## data is still to come.
+			if k == 1005:
+				firstBatchDone.wait(60)
+				earlyCalls.extend(followCalls)
+			with open(file, mode='rb') as f:
+				data=f.read()
+			with open(str(liveDir/os.path.basename(file)), mode='wb') as f:
+				## Some files are seen part written.
+				if k%100 == 0:
+					f.write(data[:len(data)//2])
+					f.flush()
+					time.sleep(0.05)
+					f.write(data[len(data)//2:])
+				else:
+					f.write(data)
+		open(stopFile, mode='w').close()
+
+	writer=threading.Thread(target=write_files)
+	writer.start()
+	try:
+		r.rosa_zyla_run_calibration(batchCallback=batch_done, follow=True)
+	finally:
+		open(stopFile, mode='w').close()
+		writer.join()
+
+	assert earlyCalls == [0]
+	assert followCalls == batchCalls == [0, 1]
+	assert r.batchList == batch.batchList == [0, 1]
+	assert r.dataList == [str(liveDir/os.path.basename(file)) for file in files]
+	followCubes=_cubes(r)
+	assert len(followCubes) == DATA_FRAMES
+	assert followCubes == _cubes(batch)
@@ -0,0 +1,58 @@
+import logging
+
+import numpy as np
+
+from ssosoft.rosaZylaCal import rosaZylaCal
+
+def _cal(tmp_path, burstNumber=4, stride=1):
+	configFile=tmp_path/'config.ini'
+	configFile.write_text('[ZYLA]\n')
+	r=rosaZylaCal('ZYLA', str(configFile))
+	r.logger=logging.getLogger('zylaLog')
+	r.burstNumber=burstNumber
+	r.qualityStride=stride
+	return r
+
+def _cube(amplitudes, shape=(32, 32)):
+	## Frames of mean 1000 with a checkerboard of the given amplitude:
+	## sharpness and contrast both grow with the amplitude.
+	checker=np.indices(shape).sum(axis=0)%2*2-1
+	return np.stack([1000+a*checker for a in amplitudes]).astype(np.float32)
+
+def test_frame_quality_matches_definition(tmp_path):
+	r=_cal(tmp_path, stride=3)
+	rng=np.random.default_rng(1)
+	cube=(1000+rng.normal(0, 30, (5, 31, 29))).astype(np.float32)
+	cube[2]=0
+	quality=r.rosa_zyla_frame_quality(cube)
+	for i in [0, 1, 3, 4]:
+		frame=cube[i].astype(np.float64)
+		rows=frame[::3]
+		mean=rows.mean()
+		dx=np.diff(rows, axis=1)
+		dy=frame[1::3]-frame[:-1:3]
+		assert np.allclose(quality[i], [mean, rows.std()/mean,
+				((dx**2).mean()+(dy**2).mean())/mean**2
+				], rtol=1e-5)
+	assert list(quality[2]) == [0, 0, 0]
+
+def test_select_frames_keeps_sharpest_in_time_order(tmp_path):
+	r=_cal(tmp_path, burstNumber=4)
+	r.qualityMetric='sharpness'
+	r.qualityThreshold=0.0
+	amplitudes=[5, 40, 1, 30, 2, 50, 3, 20]
+	quality=r.rosa_zyla_frame_quality(_cube(amplitudes))
+	assert list(np.argsort(-quality[:, 2])) == list(np.argsort(-np.array(amplitudes)))
+	keep=r.rosa_zyla_select_frames(quality, {'burst' : 0})
+	assert list(keep) == [1, 3, 5, 7]
+
+def test_select_frames_ranks_passing_frames_first(tmp_path):
+	r=_cal(tmp_path, burstNumber=3)
+	r.qualityMetric='contrast'
+	amplitudes=[10, 10, 50, 60, 10, 10]
+	quality=r.rosa_zyla_frame_quality(_cube(amplitudes))
+	## Only frames 2 and 3 pass; the earliest of the equal rest fills
+	## the burst.
+	r.qualityThreshold=float(quality[2, 1])
+	keep=r.rosa_zyla_select_frames(quality, {'burst' : 0})
+	assert list(keep) == [0, 2, 3]
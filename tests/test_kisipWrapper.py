@@ -0,0 +1,66 @@
+import os
+import shutil
+import threading
+
+import astropy.io.fits as fits
+import numpy as np
+
+from ssosoft.kisipStandIn import kisipStandIn
+from ssosoft.kisipWrapper import kisipWrapper
+from ssosoft.rosaZylaBenchmark import rosaZylaBenchmark
+from ssosoft.rosaZylaCal import rosaZylaCal
+
+def test_pipelined_batches_converted_while_saving(tmp_path):
+	b=rosaZylaBenchmark(str(tmp_path), 'ZYLA', imageShape=(24, 20),
+			darkFrames=16, flatFrames=16, dataFrames=80, burstNumber=8,
+			configOverrides={'burstWorkers' : 1, 'fitsWorkers' : 1}
+			)
+	b.bench_generate()
+	b.bench_write_config(kisipEnv={
+		'kisipEnvBin' : kisipStandIn().stand_in_install(str(tmp_path/'kisipStandIn')),
+		'kisipEnvMpiNproc' : 2,
+		'kisipEnvConcurrentBatches' : 2
+		})
+	r=rosaZylaCal('ZYLA', b.configFile)
+	r.rosa_zyla_run_calibration(saveBursts=False)
+	k=kisipWrapper(r)
+
+	converted=[]
+	firstConverted=threading.Event()
+	def convert(batch):
+		r.rosa_zyla_save_despeckled_as_fits(batch)
+		converted.append(batch)
+		firstConverted.set()
+
+	convertedWhileSaving=[]
+	def save_bursts(batchCallback=None):
+		r.rosa_zyla_save_bursts(batchCallback=batchCallback)
+		## The first batch is converted before the next one is
+		## saved.
+		firstConverted.wait(60)
+		convertedWhileSaving.extend(converted)
+		## A second batch, a copy of the first.
+		for index in range(10):
+			shutil.copyfile(
+					os.path.join(r.preSpeckleBase, r.burstFileForm.format(
+						r.obsDate, r.obsTime, 0, index
+						)),
+					os.path.join(r.preSpeckleBase, r.burstFileForm.format(
+						r.obsDate, r.obsTime, 1, index
+						))
+					)
+		batchCallback(1)
+
+	assert k.kisip_despeckle_pipelined(save_bursts, convert) == {0 : 0, 1 : 0}
+	assert convertedWhileSaving == [0]
+	assert converted == [0, 1]
+	images={}
+	for file in sorted(os.listdir(r.postSpeckleBase)):
+		with fits.open(os.path.join(r.postSpeckleBase, file)) as hdul:
+			images[file]=hdul[0].data.copy()
+	assert len(images) == 20
+	for index in range(10):
+		first, second=[r.speckledFileForm.format(r.obsDate, r.obsTime, batch, index)
+				+'.final.fits' for batch in [0, 1]
+				]
+		assert np.array_equal(images[first], images[second])
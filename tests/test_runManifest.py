@@ -0,0 +1,40 @@
+import json
+import logging
+
+from ssosoft.runManifest import runManifest
+
+def test_manifest_resume_after_partial_write(tmp_path):
+	manifestFile=str(tmp_path/'run.manifest')
+	logger=logging.getLogger('test')
+	outputs=[]
+	for k in range(4):
+		output=tmp_path/'burst.{0:03d}'.format(k)
+		output.write_bytes(b'\0'*(k+1))
+		outputs.append(str(output))
+	manifest=runManifest(manifestFile, 'run', logger)
+	manifest.manifest_record('burst', 0, [outputs[0]])
+	manifest.manifest_record('burst', 1, [outputs[1]])
+	manifest.manifest_close()
+	## A run killed while writing a record.
+	with open(manifestFile, mode='a') as f:
+		f.write('{"stage" : "burst", "key" : "2", "fi')
+
+	manifest=runManifest(manifestFile, 'run', logger)
+	assert sorted(manifest.records) == [('burst', '0'), ('burst', '1')]
+	manifest.manifest_record('burst', 2, [outputs[2]])
+	manifest.manifest_record('burst', 3, [outputs[3]])
+	manifest.manifest_close()
+
+	with open(manifestFile, mode='r') as f:
+		lines=f.read().splitlines()
+	assert [json.loads(line).get('key') for line in lines] == [None, '0', '1', '2', '3']
+	manifest=runManifest(manifestFile, 'run', logger)
+	assert all(manifest.manifest_is_done('burst', k) for k in range(4))
+	manifest.manifest_close()
+
+	## A changed fingerprint starts the manifest afresh.
+	manifest=runManifest(manifestFile, 'other', logger)
+	assert manifest.records == {}
+	manifest.manifest_close()
+	with open(manifestFile, mode='r') as f:
+		assert f.read() == json.dumps({'fingerprint' : 'other'})+"\n"
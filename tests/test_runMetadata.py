@@ -0,0 +1,49 @@
+import logging
+import threading
+
+from ssosoft.runMetadata import runMetadata
+
+def test_metadata_put_get_and_reopen(tmp_path):
+	metadataFile=str(tmp_path/'run.metadata.sqlite')
+	logger=logging.getLogger('test')
+	store=runMetadata(metadataFile, logger)
+	store.metadata_put(0, 1, 1, 'burst.000.001', 'header 1', '2024-01-01T12:00:00')
+	store.metadata_put(0, 1, 1, 'burst.000.001', 'header 1b')
+	assert store.metadata_get(0, 1) == {'batch' : 0, 'index' : 1, 'burst' : 1,
+		'file' : 'burst.000.001', 'timestamp' : None, 'header' : 'header 1b'
+		}
+	assert store.metadata_get(0, 2) is None
+	store.metadata_close()
+	store=runMetadata(metadataFile, logger)
+	assert store.metadata_get(0, 1)['header'] == 'header 1b'
+	store.metadata_close()
+
+def test_metadata_threaded_puts(tmp_path):
+	store=runMetadata(str(tmp_path/'run.metadata.sqlite'), logging.getLogger('test'))
+	def put(start):
+		for index in range(start, 200, 4):
+			store.metadata_put(index//100, index%100, index, str(index), 'h')
+	threads=[threading.Thread(target=put, args=(start,)) for start in range(4)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	store.metadata_commit()
+	assert all(store.metadata_get(index//100, index%100)['burst'] == index
+			for index in range(200)
+			)
+	store.metadata_close()
+
+def test_metadata_quality_rows_replace(tmp_path):
+	store=runMetadata(str(tmp_path/'run.metadata.sqlite'), logging.getLogger('test'))
+	store.metadata_put_quality(0, 1, [[0, 'a.dat', None, 10.0, 0.1, 0.01, True],
+		[1, 'b.dat', None, 11.0, 0.2, 0.02, False]
+		])
+	store.metadata_put_quality(0, 1, [[0, 'c.fit', 3, 12.0, 0.3, 0.03, True]])
+	store.metadata_put_quality(0, 2, [[0, 'd.fit', 4, 13.0, 0.4, 0.04, False]])
+	assert [row['file'] for row in store.metadata_get_quality(0)] == ['c.fit', 'd.fit']
+	assert store.metadata_get_quality(0, 1) == [{'batch' : 0, 'index' : 1,
+		'position' : 0, 'file' : 'c.fit', 'ext' : 3, 'mean' : 12.0,
+		'contrast' : 0.3, 'sharpness' : 0.03, 'selected' : True
+		}]
+	store.metadata_close()
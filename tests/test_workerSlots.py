@@ -0,0 +1,55 @@
+import multiprocessing
+import threading
+import time
+
+from ssosoft.workerSlots import workerSlots
+
+def _acquire(slots):
+	slots.slots_acquire()
+
+def _wait_for(predicate, timeout=10):
+	end=time.time()+timeout
+	while not predicate():
+		assert time.time() < end, "Timed out."
+		time.sleep(0.01)
+
+def test_slots_bound_running_tasks():
+	slots=workerSlots(2, nChannels=2)
+	running=[]
+	peak=[]
+	lock=threading.Lock()
+	def work(channel):
+		with slots.slots_channel(channel).slots_slot():
+			with lock:
+				running.append(channel)
+				peak.append(len(running))
+			time.sleep(0.01)
+			with lock:
+				running.remove(channel)
+	threads=[threading.Thread(target=work, args=(i%2,)) for i in range(12)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join(10)
+	assert max(peak) <= 2
+	assert list(slots.running) == [0, 0]
+	assert list(slots.waiting) == [0, 0]
+
+def test_slots_reset_frees_killed_waiting_channel():
+	slots=workerSlots(1, nChannels=2)
+	deadChannel=slots.slots_channel(0)
+	liveChannel=slots.slots_channel(1)
+	liveChannel.slots_acquire()
+	process=multiprocessing.Process(target=_acquire, args=(deadChannel,))
+	process.start()
+	_wait_for(lambda: slots.waiting[0] == 1)
+	process.terminate()
+	process.join()
+	slots.slots_reset(0)
+	liveChannel.slots_release()
+	thread=threading.Thread(target=liveChannel.slots_acquire, daemon=True)
+	thread.start()
+	thread.join(5)
+	assert not thread.is_alive(), "Live channel starved by a killed channel."
+	assert list(slots.running) == [0, 1]
+	assert list(slots.waiting) == [0, 0]
@@ -0,0 +1,84 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from ssosoft.rosaZylaCal import rosaZylaCal
+
+def _configured(zylaConfig, name, **settings):
+	r=rosaZylaCal('ZYLA', zylaConfig(name, **settings))
+	r.rosa_zyla_configure_run()
+	return r
+
+def _write_spool(file, imageShape, overscan, seed=0):
+	spool=np.zeros((imageShape[0]+overscan[0], imageShape[1]+overscan[1]),
+			dtype=np.uint16
+			)
+	spool[:imageShape[0], :imageShape[1]]=np.random.default_rng(seed).integers(
+			1000, 1100, size=imageShape
+			)
+	spool.tofile(file)
+
+@pytest.mark.parametrize('imageShape, overscan', [
+	((24, 20), (8, 8)),
+	((40, 30), (20, 2)),
+	((5, 300), (1, 40)),
+	((300, 250), (2, 6))
+	])
+def test_geometry_matches_full_frame(tmp_path, zylaConfig, imageShape, overscan):
+	r=_configured(zylaConfig, 'geometry')
+	file=str(tmp_path/'0spool.dat')
+	_write_spool(file, imageShape, overscan)
+	assert r.rosa_zyla_detect_zyla_geometry(file)
+	fast=(tuple(int(n) for n in r.dataShape), tuple(int(n) for n in r.imageShape))
+	r.rosa_zyla_detect_zyla_dims(np.fromfile(file, dtype=np.uint16))
+	full=(tuple(int(n) for n in r.dataShape), tuple(int(n) for n in r.imageShape))
+	assert fast == full
+	assert fast == ((imageShape[0]+overscan[0], imageShape[1]+overscan[1]), imageShape)
+
+def test_geometry_without_overscan_falls_back(tmp_path, zylaConfig):
+	r=_configured(zylaConfig, 'geometry')
+	file=str(tmp_path/'0spool.dat')
+	_write_spool(file, (24, 20), (0, 0))
+	assert not r.rosa_zyla_detect_zyla_geometry(file)
+
+def test_geometry_cache(tmp_path, zylaConfig):
+	calStoreBase=str(tmp_path/'store')
+	r=_configured(zylaConfig, 'first', calStoreBase=calStoreBase)
+	file=str(tmp_path/'0spool.dat')
+	_write_spool(file, (24, 20), (8, 8))
+	assert r.rosa_zyla_detect_zyla_geometry(file)
+	assert r.zylaGeometryFile == os.path.join(calStoreBase, 'zyla_geometry.json')
+	with open(r.zylaGeometryFile, mode='r') as f:
+		cache=json.load(f)
+	assert list(cache.values()) == [24]
+
+	## The image rows are taken from the cache, shared through
+	## calStoreBase, rather than read back from the file.
+	key,=cache
+	cache[key]=23
+	with open(r.zylaGeometryFile, mode='w') as f:
+		json.dump(cache, f)
+	r=_configured(zylaConfig, 'second', calStoreBase=calStoreBase)
+	assert r.rosa_zyla_detect_zyla_geometry(file)
+	assert tuple(int(n) for n in r.imageShape) == (23, 20)
+
+	## Another camera configuration is detected and added.
+	otherFile=str(tmp_path/'1spool.dat')
+	_write_spool(otherFile, (16, 20), (8, 8))
+	assert r.rosa_zyla_detect_zyla_geometry(otherFile)
+	assert tuple(int(n) for n in r.imageShape) == (16, 20)
+	with open(r.zylaGeometryFile, mode='r') as f:
+		assert sorted(json.load(f).values()) == [16, 23]
+
+def test_mismatched_file_stops_run(tmp_path, zylaConfig):
+	r=rosaZylaCal('ZYLA', zylaConfig('truncated'))
+	averaged=[]
+	r.rosa_zyla_average_image_from_list=lambda *args, **kwargs: averaged.append(args)
+	dataFile=os.path.join(str(tmp_path/'data'), '5000000000spool.dat')
+	with open(dataFile, mode='r+b') as f:
+		f.truncate(100)
+	with pytest.raises(AssertionError, match='1 files do not match'):
+		r.rosa_zyla_run_calibration(saveBursts=False)
+	assert averaged == []